@@ -0,0 +1,173 @@
+"""
+Training data analytics
+
+Copyright 2017 Pavel Folov
+"""
+
+import datetime
+
+import numpy as np
+
+from kochkalib import ExerciseColumns
+
+# day ordinal of numpy datetime64 zero
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+PERIODS = ('day', 'week', 'month')
+
+
+class Analytics:
+    """
+    Vectorized calculations over exercises
+
+    Columns of `ExerciseColumns` are copied to numpy arrays once, all
+    results are calculated by arrays, not by `Exercise`/`Set` objects.
+    Exercises with dates out of the text format are skipped in results
+    grouped by dates.
+
+    >>> analytics = Analytics(ExerciseTxtParser('data.txt'))
+    >>> names, periods, tonnage = analytics.tonnage('week')
+    >>> dates, average = analytics.rolling_tonnage('жим', window=28)
+    """
+
+    def __init__(self, exercises):
+        if not isinstance(exercises, ExerciseColumns):
+            exercises = ExerciseColumns(exercises)
+        # copies, exported buffers would lock the arrays for appending
+        self.names = np.array(exercises.names, dtype=object)
+        self.name_ids = np.array(exercises.name_ids, dtype=np.int64)
+        self.dates = np.array(exercises.dates, dtype=np.int64)
+        offsets = np.array(exercises.offsets, dtype=np.int64)
+        self.weights = np.array(exercises.weights, dtype=np.float64)
+        self.counts = np.array(exercises.counts, dtype=np.int64)
+        self.set_counts = np.array(exercises.set_counts, dtype=np.int64)
+        # exercise row of every set
+        self.set_rows = np.repeat(np.arange(len(self.dates)),
+                                  np.diff(offsets))
+
+    def set_tonnage(self) -> np.ndarray:
+        """Weight * count * set_count of every set"""
+        return self.weights * self.counts * self.set_counts
+
+    def exercise_tonnage(self) -> np.ndarray:
+        """Total weight of every exercise"""
+        return np.bincount(self.set_rows, weights=self.set_tonnage(),
+                           minlength=len(self.dates))
+
+    def tonnage(self, period='day'):
+        """
+        Total weight per exercise name and period
+
+        Returns arrays of names, periods (numpy datetime64 of the period
+        start) and tonnage sorted by name and period.
+        """
+        dated = self.dates > 0
+        periods = self.periods(period)[dated]
+        first = periods.min(initial=0)
+        span = periods.max(initial=0) - first + 1
+        keys = self.name_ids[dated] * span + (periods - first)
+        groups, inverse = np.unique(keys, return_inverse=True)
+        tonnage = np.bincount(inverse,
+                              weights=self.exercise_tonnage()[dated],
+                              minlength=len(groups))
+        names = self.names[groups // span]
+        # groups are by name ids, periods stay sorted within a name
+        order = np.argsort(names, kind='stable')
+        starts = _period_start(groups[order] % span + first, period)
+        return names[order], starts, tonnage[order]
+
+    def periods(self, period='day') -> np.ndarray:
+        """Period number of every exercise: day, week or month"""
+        if period not in PERIODS:
+            raise ValueError('Unknown period: {}'.format(period))
+        days = self.dates - _EPOCH_ORDINAL
+        if period == 'day':
+            return days
+        elif period == 'week':
+            # 1970.01.01 is Thursday, weeks start on Monday
+            return (days + 3) // 7
+        return days.astype('datetime64[D]').astype('datetime64[M]') \
+            .astype(np.int64)
+
+    def e1rm(self, formula='epley') -> np.ndarray:
+        """
+        Estimated one repetition maximum of every set
+
+        Brzycki formula is not defined for 37 and more repetitions,
+        such sets are nan.
+        """
+        counts = self.counts.astype(np.float64)
+        if formula == 'epley':
+            result = self.weights * (1 + counts / 30)
+        elif formula == 'brzycki':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                result = self.weights * 36 / (37 - counts)
+            result[self.counts >= 37] = np.nan
+        else:
+            raise ValueError('Unknown formula: {}'.format(formula))
+        single = self.counts == 1
+        result[single] = self.weights[single]
+        return result
+
+    def best_e1rm(self, formula='epley') -> np.ndarray:
+        """Best estimated maximum of every exercise name"""
+        best = np.zeros(len(self.names))
+        e1rm = np.nan_to_num(self.e1rm(formula))
+        np.maximum.at(best, self.name_ids[self.set_rows], e1rm)
+        return best
+
+    def rolling_tonnage(self, name, window=7, period='day'):
+        """
+        Rolling average of tonnage of the exercise name
+
+        Periods without the exercise are zero. Returns arrays of period
+        starts and averages over `window` periods.
+        """
+        if window < 1:
+            raise ValueError('Window must be 1 or more periods: {}'.format(
+                window))
+        rows = (self.name_ids == self._name_id(name)) & (self.dates > 0)
+        if not rows.any():
+            return np.array([], dtype='datetime64[D]'), np.array([])
+        periods = self.periods(period)[rows]
+        first = periods.min()
+        series = np.bincount(periods - first,
+                             weights=self.exercise_tonnage()[rows])
+        sums = np.cumsum(series)
+        sums[window:] = sums[window:] - sums[:-window]
+        sizes = np.minimum(np.arange(1, len(series) + 1), window)
+        starts = _period_start(np.arange(first, first + len(series)),
+                               period)
+        return starts, sums / sizes
+
+    def intensity_histogram(self, name=None, bins=np.arange(0, 110, 10),
+                            formula='epley'):
+        """
+        Distribution of sets by intensity, percent of the best e1RM
+
+        Sets are counted with their `set_count`. Returns counts and
+        bin edges as `numpy.histogram` does.
+        """
+        set_names = self.name_ids[self.set_rows]
+        best = self.best_e1rm(formula)[set_names]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            intensity = np.where(best > 0, self.weights / best * 100, 0)
+        counts = self.set_counts
+        if name is not None:
+            rows = set_names == self._name_id(name)
+            intensity, counts = intensity[rows], counts[rows]
+        return np.histogram(intensity, bins=bins, weights=counts)
+
+    def _name_id(self, name) -> int:
+        """Index of the name in `names`, -1 if there is no such name"""
+        found = np.flatnonzero(self.names == name)
+        return found[0] if len(found) else -1
+
+
+def _period_start(periods, period) -> np.ndarray:
+    """Converts period numbers to datetime64 days of period start"""
+    if period == 'day':
+        return periods.astype('datetime64[D]')
+    elif period == 'week':
+        return (periods * 7 - 3).astype('datetime64[D]')
+    return periods.astype('datetime64[M]').astype('datetime64[D]')
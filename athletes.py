@@ -0,0 +1,193 @@
+"""
+Directory of training logs, one log per athlete
+
+    logs/
+        ivanov.txt
+        petrov.txt
+
+Copyright 2017 Pavel Folov
+"""
+
+import logging
+import os
+
+from kochkalib import ExerciseTxtTailLoader
+from metrics import metrics
+from patterns import Event
+
+logger = logging.getLogger(__name__)
+
+
+class AthleteDirectory:
+    """
+    Training logs of athletes, the athlete is the name of a log file
+
+    Logs are loaded by `ExerciseTxtTailLoader` with the cache, so
+    reopening the directory unpickles caches of unchanged logs and parses
+    only appended records. Logs without a fresh cache are parsed by a
+    process pool, a worker writes the cache and the log is loaded from
+    it. `reload` parses only changed logs.
+
+    >>> team = AthleteDirectory('logs', workers=4)
+    >>> team.load()
+    >>> for athlete, exercise in team:
+    ...     print(athlete, exercise)
+    >>> stats = team.stats()
+    """
+
+    suffix = '.txt'
+    # smaller logs are parsed in the process, a worker start is longer
+    parallel_threshold = 256 * 1024
+
+    def __init__(self, path, workers=None, use_cache=True, resync=True):
+        self.path = path
+        self.workers = workers or os.cpu_count() or 1
+        self.use_cache = use_cache
+        self.resync = resync
+        # athlete: loader, exercises
+        self.loaders = {}
+        self.exercises = {}
+        # athlete, ParseError
+        self.on_parse_error = Event()
+
+    def athletes(self) -> list:
+        """Athletes having a log in the directory"""
+        return sorted(
+            filename[:-len(self.suffix)]
+            for filename in os.listdir(self.path)
+            if filename.endswith(self.suffix) and
+            os.path.isfile(os.path.join(self.path, filename)))
+
+    def filename(self, athlete) -> str:
+        return os.path.join(self.path, athlete + self.suffix)
+
+    def load(self):
+        """Loads all logs again"""
+        self.loaders = {}
+        self.exercises = {}
+        self.reload()
+
+    def reload(self) -> list:
+        """Loads new and changed logs, returns their athletes"""
+        with metrics.span('athletes.load') as fields:
+            athletes = self.athletes()
+            for athlete in set(self.loaders) - set(athletes):
+                # the log is removed
+                del self.loaders[athlete]
+                del self.exercises[athlete]
+            changed = [athlete for athlete in athletes
+                       if athlete not in self.loaders or
+                       self.loaders[athlete].is_changed()]
+            self._parse_in_pool([athlete for athlete in changed
+                                 if self._is_worth_pool(athlete)])
+            for athlete in changed:
+                self._load(athlete)
+            fields.update(athletes=len(athletes), changed=len(changed))
+        return changed
+
+    def _load(self, athlete):
+        loader = self.loaders.get(athlete)
+        if loader is None:
+            loader = self.loaders[athlete] = ExerciseTxtTailLoader(
+                self.filename(athlete), use_cache=self.use_cache,
+                resync=self.resync)
+            loader.on_parse_error.append(
+                lambda error: self.on_parse_error(athlete, error))
+        exercises = loader.load()
+        if loader.is_full:
+            self.exercises[athlete] = exercises
+        else:
+            self.exercises[athlete].extend(exercises)
+
+    def _is_worth_pool(self, athlete) -> bool:
+        if not self.use_cache or self.workers <= 1 or \
+                athlete in self.loaders:
+            return False
+        filename = self.filename(athlete)
+        stat = os.stat(filename)
+        if stat.st_size < self.parallel_threshold:
+            return False
+        try:
+            cache_stat = os.stat(filename + '.cache')
+        except FileNotFoundError:
+            return True
+        return cache_stat.st_mtime_ns < stat.st_mtime_ns
+
+    def _parse_in_pool(self, athletes):
+        """
+        Parses logs by workers, they write caches to be loaded from
+
+        Parse errors are kept in the caches, they are reported by loading.
+        """
+        if not athletes:
+            return
+        # imported here, it takes a while and is not needed usually
+        from concurrent.futures import ProcessPoolExecutor
+
+        filenames = [self.filename(athlete) for athlete in athletes]
+        with ProcessPoolExecutor(min(self.workers, len(athletes))) as pool:
+            for _ in pool.map(_parse_log, filenames,
+                              [self.resync] * len(filenames)):
+                pass
+
+    def __iter__(self):
+        """Yields (athlete, exercise) of loaded logs"""
+        for athlete, exercises in sorted(self.exercises.items()):
+            for exercise in exercises:
+                yield athlete, exercise
+
+    def stats(self) -> dict:
+        """
+        Totals per athlete, per exercise name and of all, by one pass
+
+        A name has the best weight of all athletes and who lifted it.
+        """
+        athletes = {}
+        names = {}
+        total = _empty_stat()
+        for athlete, exercise in self:
+            tonnage = sets = max_weight = 0
+            for set_ in exercise.sets:
+                sets += set_.set_count
+                tonnage += set_.total_weight
+                if set_.weight > max_weight:
+                    max_weight = set_.weight
+            athlete_stat = athletes.get(athlete)
+            if athlete_stat is None:
+                athlete_stat = athletes[athlete] = _empty_stat()
+            name_stat = names.get(exercise.name)
+            if name_stat is None:
+                name_stat = names[exercise.name] = _empty_stat(
+                    best_athlete=None, athletes=set())
+            name_stat['athletes'].add(athlete)
+            date = exercise.date
+            for stat in (athlete_stat, name_stat, total):
+                stat['exercises'] += 1
+                stat['sets'] += sets
+                stat['tonnage'] += tonnage
+                if max_weight > stat['max_weight']:
+                    stat['max_weight'] = max_weight
+                    if 'best_athlete' in stat:
+                        stat['best_athlete'] = athlete
+                if stat['first_date'] is None or date < stat['first_date']:
+                    stat['first_date'] = date
+                if stat['last_date'] is None or date > stat['last_date']:
+                    stat['last_date'] = date
+        for stat in names.values():
+            stat['athletes'] = len(stat['athletes'])
+        total['athletes'] = len(athletes)
+        return {'total': total, 'athletes': athletes, 'names': names}
+
+
+def _empty_stat(**fields):
+    stat = {'exercises': 0, 'sets': 0, 'tonnage': 0, 'max_weight': 0,
+            'first_date': None, 'last_date': None}
+    stat.update(fields)
+    return stat
+
+
+def _parse_log(filename, resync):
+    """Process pool job, parses the log to its cache"""
+    loader = ExerciseTxtTailLoader(filename, use_cache=True, resync=resync)
+    for _ in loader.iter_load():
+        pass
@@ -0,0 +1,369 @@
+"""
+Kochka benchmarks
+
+    python3 benchmarks.py [--lines 1000 100000 1000000] [--json results.json]
+
+Logs are generated by a seeded generator, so runs with the same
+arguments parse the same files and results can be compared over time.
+`--json` writes results with the environment description.
+
+Copyright 2017 Pavel Folov
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from kochkalib import ExerciseTxtParser, ExerciseTxtBufferParser, \
+    ExerciseTxtParallelParser, ExerciseColumns, ExerciseIndex, \
+    save_exercises_to_file, append_exercises_to_file, record_key, \
+    diff_records
+
+NAMES = ['жим', 'тяга', 'присед', 'подтягивания', 'выпады', 'тяга_блока']
+NOTES = ['травма, поясница', 'после болезни', 'плохо спал',
+         'новые кроссовки', 'разминка 20 минут, легко']
+# set count separators as they are typed: x, cyrillic х, *
+MULTIPLIERS = [' x{}', ' х{}', ' *{}', 'x{}', ' х {}', ' X{}']
+# lines which break a record
+ERRORS = ['', 'garbage', '45', '2017.13', '45 10 x', 'жим жим']
+
+
+def generate_log(filename, lines, seed=0, notes=0.1, multipliers=0.3,
+                 errors=0.0):
+    """
+    Writes synthetic training log of about `lines` lines
+
+    `notes` and `errors` are shares of records with a note and with a
+    broken line, `multipliers` is a share of set lines with a set count.
+    """
+    rnd = random.Random(seed)
+    written = 0
+    day = 0
+    with open(filename, 'w') as f:
+        while written < lines:
+            day += 1
+            record = ['{:04d}.{:02d}.{:02d}'.format(
+                2000 + day // 336, day // 28 % 12 + 1, day % 28 + 1)]
+            record.append(rnd.choice(NAMES))
+            if rnd.random() < notes:
+                record.append('# ' + rnd.choice(NOTES))
+            for _ in range(rnd.randint(3, 15)):
+                set_line = '{} {}'.format(rnd.randint(35, 150),
+                                          rnd.randint(1, 12))
+                if rnd.random() < multipliers:
+                    set_line += rnd.choice(MULTIPLIERS).format(
+                        rnd.randint(2, 5))
+                record.append(set_line)
+            if rnd.random() < errors:
+                record.insert(rnd.randint(1, len(record)),
+                              rnd.choice(ERRORS))
+            f.write('\n'.join(record))
+            f.write('\n\n')
+            written += len(record) + 1
+
+
+def timed(func, repeat=1):
+    """Returns the best time of `repeat` calls"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def _repeat(lines):
+    # small files are parsed several times against timer noise
+    return max(1, min(5, 100000 // lines))
+
+
+def report(results, name, lines, **values):
+    """Appends a result and prints it"""
+    results.append(dict(name=name, lines=lines, **values))
+    print('{:<30} {:>10} {}'.format(name, lines, ', '.join(
+        '{}({:.6g})'.format(key, value) for key, value in values.items())))
+
+
+def bench_parsers(results, filename, lines):
+    """
+    Parsers speed, `speedup` is against the line parser
+
+    The buffer parser is about 5x faster on 1000000 lines, three runs gave
+    5.1x, 5.1x and 5.9x (Intel Xeon, 1 CPU, Python 3.11.7); the ratio
+    depends on the machine and on the share of broken records.
+    """
+    size = os.path.getsize(filename)
+    repeat = _repeat(lines)
+    line_elapsed = timed(lambda: list(ExerciseTxtParser(filename)), repeat)
+    report(results, ExerciseTxtParser.__name__, lines, seconds=line_elapsed,
+           lines_per_s=lines / line_elapsed,
+           mb_per_s=size / line_elapsed / 2 ** 20)
+    elapsed = timed(lambda: list(ExerciseTxtBufferParser(filename)), repeat)
+    report(results, ExerciseTxtBufferParser.__name__, lines, seconds=elapsed,
+           lines_per_s=lines / elapsed, mb_per_s=size / elapsed / 2 ** 20,
+           speedup=line_elapsed / elapsed)
+
+    def parse_stream():
+        with open(filename) as f:
+            list(ExerciseTxtBufferParser(filename).parse_stream(f))
+
+    elapsed = timed(parse_stream, repeat)
+    report(results, 'ExerciseTxtBufferParser.stream', lines,
+           seconds=elapsed, lines_per_s=lines / elapsed,
+           mb_per_s=size / elapsed / 2 ** 20)
+    workers = os.cpu_count() or 1
+    elapsed = timed(lambda: list(
+        ExerciseTxtParallelParser(filename, workers=workers)), repeat)
+    report(results, 'ExerciseTxtParallelParser', lines, seconds=elapsed,
+           lines_per_s=lines / elapsed, mb_per_s=size / elapsed / 2 ** 20,
+           workers=workers)
+
+
+def traced_memory(func):
+    """Returns current and peak memory size while func result is kept"""
+    tracemalloc.start()
+    try:
+        result = func()
+        size, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return size, peak
+
+
+def bench_memory(results, filename, lines):
+    exercises = list(ExerciseTxtBufferParser(filename))
+    sets = sum(len(e.sets) for e in exercises) or 1
+    for title, func in (
+            ('memory.objects', lambda: list(ExerciseTxtParser(filename))),
+            ('memory.shared_sets',
+             lambda: list(ExerciseTxtBufferParser(filename))),
+            ('memory.columns', lambda: ExerciseColumns(exercises))):
+        size, peak = traced_memory(func)
+        report(results, title, lines, mb=size / 2 ** 20,
+               peak_mb=peak / 2 ** 20, bytes_per_set=size / sets)
+
+
+def bench_save(results, filename, lines):
+    """Rewrite with a backup, and append of one exercise"""
+    exercises = list(ExerciseTxtBufferParser(filename))
+    with tempfile.TemporaryDirectory() as tmp:
+        target = os.path.join(tmp, 'data.txt')
+        # the first save has no backup to deduplicate with
+        report(results, 'save_exercises_to_file.first', lines,
+               seconds=timed(lambda: save_exercises_to_file(
+                   target, exercises)))
+        report(results, 'save_exercises_to_file', lines,
+               seconds=timed(lambda: save_exercises_to_file(
+                   target, exercises), _repeat(lines)))
+        report(results, 'append_exercises_to_file', lines,
+               seconds=timed(lambda: append_exercises_to_file(
+                   target, exercises[-1:]), 5))
+
+
+def bench_search(results, filename, lines, calls=1000):
+    """Building of the index and text queries over notes and names"""
+    exercises = list(ExerciseTxtBufferParser(filename))
+    report(results, 'ExerciseIndex', lines,
+           seconds=timed(lambda: ExerciseIndex(exercises)))
+    index = ExerciseIndex(exercises)
+    for query in ('травма', 'травма поясница', 'болезнь OR травма', 'пояс*',
+                  'жим'):
+        elapsed = timed(lambda: [index.text.search(query)
+                                 for _ in range(calls)]) / calls
+        report(results, 'TextIndex.search({})'.format(query), lines,
+               ms=elapsed * 1000, rows=len(index.text.search(query)))
+
+
+def bench_diff(results, filename, lines):
+    """Diff of reloaded records after an edit of one record by others"""
+    from array import array
+
+    exercises = list(ExerciseTxtBufferParser(filename))
+    old_keys = array('q', map(record_key, exercises))
+    report(results, 'record_key', lines,
+           seconds=timed(lambda: array('q', map(record_key, exercises))))
+    for title, position in (('head', 0), ('middle', len(exercises) // 2),
+                            ('tail', len(exercises) - 1)):
+        new_keys = array('q', old_keys)
+        new_keys[position] += 1
+        report(results, 'diff_records.' + title, lines, ms=timed(
+            lambda: diff_records(old_keys, new_keys), 5) * 1000)
+
+
+def bench_logging(results, filename, lines, calls=5000):
+    """
+    Latency of `logger.info` calls with handlers of loggingconf
+
+    Handlers are called by the caller or by the listener thread of the
+    queue. A stalled disk is simulated by a slow file every 1000 lines.
+    A full queue drops records instead of blocking callers, `dropped` is
+    the number of records lost so.
+    """
+    import queue
+    from logging.handlers import TimedRotatingFileHandler
+    from loggingconf import BatchFileHandler, LogListener, LogQueueHandler
+
+    class StalledStream:
+        def __init__(self, f):
+            self.f = f
+            self.writes = 0
+
+        def write(self, text):
+            self.writes += 1
+            if self.writes % 1000 == 0:
+                time.sleep(0.01)
+            return self.f.write(text)
+
+        def flush(self):
+            self.f.flush()
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            open(os.devnull, 'w') as devnull:
+        for mode in ('sync', 'queue'):
+            file_class = TimedRotatingFileHandler if mode == 'sync' \
+                else BatchFileHandler
+            handlers = [logging.StreamHandler(devnull)] + [
+                file_class(os.path.join(tmp, '{}-{}.log'.format(mode, i)),
+                           when='D', encoding='utf-8') for i in range(3)]
+            handlers[1].stream = StalledStream(handlers[1].stream)
+            formatter = logging.Formatter(
+                '%(asctime)s %(name)-15s - %(levelname)-10s - %(message)s')
+            for handler in handlers:
+                handler.setFormatter(formatter)
+            logger = logging.getLogger('benchmarks.' + mode)
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            listener = None
+            queue_handler = None
+            if mode == 'sync':
+                for handler in handlers:
+                    logger.addHandler(handler)
+            else:
+                log_queue = queue.Queue(10000)
+                queue_handler = LogQueueHandler(log_queue, handlers)
+                logger.addHandler(queue_handler)
+                listener = LogListener(log_queue, [queue_handler])
+                listener.start()
+            latencies = []
+            for i in range(calls):
+                started = time.perf_counter()
+                logger.info('added set: %s', i)
+                latencies.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            if listener is not None:
+                listener.stop()
+            flushed = time.perf_counter() - started
+            for handler in handlers:
+                logger.removeHandler(handler)
+                handler.close()
+            logger.handlers.clear()
+            latencies.sort()
+            report(results, 'logger.info.' + mode, lines,
+                   p50_us=latencies[calls // 2] * 1e6,
+                   p99_us=latencies[calls * 99 // 100] * 1e6,
+                   max_us=latencies[-1] * 1e6,
+                   total_s=sum(latencies), shutdown_s=flushed,
+                   dropped=queue_handler.dropped if queue_handler else 0)
+
+
+def bench_model_data(results, filename, lines, calls=200000):
+    """ExerciseModel.data calls per second of a scrolled table"""
+    # QCoreApplication of PyQt4 needs no display
+    try:
+        from PyQt4 import QtCore
+        from main import ExerciseModel
+    except ImportError as e:
+        print('ExerciseModel.data is skipped: {}'.format(e))
+        return
+    exercises = list(ExerciseTxtBufferParser(filename))
+    # model notifications are delivered by the event loop timers
+    app = QtCore.QCoreApplication.instance() or \
+        QtCore.QCoreApplication(sys.argv)
+    role = QtCore.Qt.DisplayRole
+    for cache_size in (0, ExerciseModel.display_cache_size):
+        model = ExerciseModel(None)
+        model.display_cache_size = cache_size
+        model.addExercises(exercises)
+        while model.canFetchMore():
+            model.fetchMore()
+        # 30 visible rows are painted while scrolling by 3 rows
+        indexes = [model.index(row, col)
+                   for top in range(0, max(min(len(exercises), 3000) - 30, 1),
+                                    3)
+                   for row in range(top, min(top + 30, len(exercises)))
+                   for col in range(model.columnCount())]
+        indexes = (indexes * (calls // len(indexes) + 1))[:calls]
+        elapsed = timed(lambda: [model.data(i, role) for i in indexes])
+        report(results, 'ExerciseModel.data', lines, cache_size=cache_size,
+               calls_per_s=calls / elapsed)
+
+
+BENCHMARKS = {
+    'parsers': bench_parsers,
+    'memory': bench_memory,
+    'save': bench_save,
+    'search': bench_search,
+    'logging': bench_logging,
+    'diff': bench_diff,
+    'model': bench_model_data,
+}
+
+
+def environment() -> dict:
+    return {
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run(lines_list, names, seed=0, errors=0.001):
+    """Runs benchmarks for every log size, returns a list of results"""
+    results = []
+    for lines in lines_list:
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'data.txt')
+            generate_log(filename, lines, seed=seed, errors=errors)
+            for name in names:
+                BENCHMARKS[name](results, filename, lines)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Kochka benchmarks')
+    parser.add_argument('--lines', type=int, nargs='+', default=[1000000],
+                        help='log sizes, 1000 to 10000000 lines')
+    parser.add_argument('--bench', nargs='+', choices=list(BENCHMARKS),
+                        default=list(BENCHMARKS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--errors', type=float, default=0.001,
+                        help='share of records with an error')
+    parser.add_argument('--json', help='file to write results to')
+    args = parser.parse_args(argv)
+
+    results = run(args.lines, args.bench, args.seed, args.errors)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'environment': environment(),
+                'arguments': vars(args),
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Undo/redo history of persistent lists
+
+A `PersistentList` is never changed, a changed list is a new one sharing
+items with the old list, so a snapshot of a state costs one node per
+added item whatever the size of the list is.
+
+>>> history = History(PersistentList())
+>>> history.push(history.current.append(set_))
+>>> old, new = history.current, history.undo()
+>>> size, items = diff(old, new)  # keep `size` items, add `items`
+
+Copyright 2017 Pavel Folov
+"""
+
+from collections import deque
+
+
+class PersistentList:
+    """
+    Immutable list, a node is the last item with the list before it
+
+    Appending makes one node, other changes copy nodes after the changed
+    position only. Items are got by walking from the end, lists are
+    meant to be short or to be read by `items_from` near the end.
+    """
+
+    __slots__ = ['last', 'parent', 'size']
+
+    def __init__(self):
+        """Empty list, items are added by `append` and `extend`"""
+        self.last = None
+        self.parent = None
+        self.size = 0
+
+    def append(self, item) -> 'PersistentList':
+        node = PersistentList.__new__(PersistentList)
+        node.last = item
+        node.parent = self
+        node.size = self.size + 1
+        return node
+
+    def extend(self, items) -> 'PersistentList':
+        node = self
+        for item in items:
+            node = node.append(item)
+        return node
+
+    def prefix(self, size) -> 'PersistentList':
+        """List of the first `size` items"""
+        node = self
+        while node.size > size:
+            node = node.parent
+        return node
+
+    def items_from(self, start) -> list:
+        """Items from `start` to the end"""
+        items = []
+        node = self
+        while node.size > start:
+            items.append(node.last)
+            node = node.parent
+        items.reverse()
+        return items
+
+    def replace(self, start, stop, items=()) -> 'PersistentList':
+        """List with `items` instead of items from `start` to `stop`"""
+        tail = self.items_from(stop)
+        return self.prefix(start).extend(items).extend(tail)
+
+    def common_size(self, other: 'PersistentList') -> int:
+        """Size of the prefix shared with `other` list"""
+        a, b = self.prefix(other.size), other.prefix(self.size)
+        while a is not b and a.size:
+            a, b = a.parent, b.parent
+        return a.size
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter(self.items_from(0))
+
+    def __repr__(self):
+        return 'PersistentList({!r})'.format(self.items_from(0))
+
+
+def diff(old: PersistentList, new: PersistentList):
+    """
+    Returns (size, items), `new` is the first `size` items of `old`
+    followed by `items`
+    """
+    size = old.common_size(new)
+    return size, new.items_from(size)
+
+
+class History:
+    """
+    Undo/redo of snapshots, the current one is `current`
+
+    A new snapshot drops snapshots which were undone. Only `limit` last
+    snapshots are kept, older ones are forgotten.
+    """
+
+    def __init__(self, initial, limit=1000):
+        self.limit = limit
+        self._snapshots = deque([initial])
+        self._position = 0
+
+    @property
+    def current(self):
+        return self._snapshots[self._position]
+
+    @property
+    def position(self) -> int:
+        return self._position
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    def reset(self, initial):
+        self._snapshots = deque([initial])
+        self._position = 0
+
+    def push(self, snapshot):
+        while len(self._snapshots) > self._position + 1:
+            self._snapshots.pop()
+        self._snapshots.append(snapshot)
+        if len(self._snapshots) > self.limit:
+            self._snapshots.popleft()
+        self._position = len(self._snapshots) - 1
+
+    def can_undo(self) -> bool:
+        return self._position > 0
+
+    def can_redo(self) -> bool:
+        return self._position < len(self._snapshots) - 1
+
+    def undo(self):
+        return self.goto(self._position - 1)
+
+    def redo(self):
+        return self.goto(self._position + 1)
+
+    def goto(self, position):
+        """Makes the snapshot at `position` current and returns it"""
+        if not 0 <= position < len(self._snapshots):
+            raise IndexError('No snapshot at {}'.format(position))
+        self._position = position
+        return self._snapshots[position]
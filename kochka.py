@@ -0,0 +1,355 @@
+"""
+Kochka command line, works without Qt
+
+    python3 kochka.py check data.txt
+    python3 kochka.py stats --json data.txt
+    cat data.txt | python3 kochka.py export --format csv - > data.csv
+    python3 kochka.py compact data.txt
+    python3 kochka.py convert data.txt data.db
+    python3 kochka.py team logs/
+    python3 kochka.py serve --port 8080 data.txt
+
+`-` reads the training log from stdin. Files are parsed by blocks,
+so memory does not grow with the file size (except `compact` in place).
+.db, .sqlite files are read as SQLite storage, stats are counted by SQL.
+Modules are imported by commands, `--help` does not load the parser.
+
+Exit status: 0 - ok, 1 - the log has errors, 2 - wrong arguments.
+
+Copyright 2017 Pavel Folov
+"""
+
+import os
+import sys
+
+# columns of `export --format csv`, one row per set
+CSV_HEADER = ['date', 'name', 'weight', 'count', 'set_count', 'note']
+
+
+def _open_output(filename):
+    if filename is None or filename == '-':
+        return sys.stdout
+    return open(filename, 'w')
+
+
+def _open_storage(filename, on_parse_error=None, is_new=False):
+    """Text or SQLite storage, errors of text are sent to on_parse_error"""
+    from storage import open_storage
+
+    if not is_new and filename != '-':
+        # SQLite creates a missing file
+        os.stat(filename)
+    storage = open_storage(filename, resync=True)
+    if on_parse_error is not None:
+        storage.on_parse_error.append(on_parse_error)
+    return storage
+
+
+def _parse(filename, errors):
+    """Yields exercises of the storage or stdin, errors are appended"""
+    with _open_storage(filename, errors.append) as storage:
+        yield from storage.iter_exercises()
+
+
+def _print_errors(filename, errors, file=sys.stderr):
+    for error in errors:
+        print('{}:{}: {}: {!r}'.format(
+            filename, error.lineno, error.reason, error.line), file=file)
+
+
+def cmd_check(args) -> int:
+    errors = []
+    count = sum(1 for _ in _parse(args.file, errors))
+    _print_errors(args.file, errors, sys.stdout)
+    if not args.quiet:
+        print('exercises({}), errors({})'.format(count, len(errors)),
+              file=sys.stderr)
+    return 1 if errors else 0
+
+
+def cmd_stats(args) -> int:
+    errors = []
+    with _open_storage(args.file, errors.append) as storage:
+        stats = storage.stats()
+    total = stats['total']
+    total['errors'] = len(errors)
+
+    if args.json:
+        import json
+        json.dump(stats, sys.stdout, ensure_ascii=False, indent=2,
+                  sort_keys=True)
+        print()
+    else:
+        print('{:<20} {:>9} {:>9} {:>12} {:>6}'.format(
+            'name', 'exercises', 'sets', 'tonnage', 'max'))
+        for name, stat in sorted(stats['names'].items()):
+            print('{:<20} {exercises:>9} {sets:>9} {tonnage:>12} '
+                  '{max_weight:>6}'.format(name, **stat))
+        print('{:<20} {exercises:>9} {sets:>9} {tonnage:>12} '
+              '{max_weight:>6}'.format('total', **total))
+        print('dates: {first_date} - {last_date}, errors: {errors}'.format(
+            **total))
+    _print_errors(args.file, errors)
+    return 1 if errors else 0
+
+
+def cmd_export(args) -> int:
+    errors = []
+    out = _open_output(args.output)
+    try:
+        if args.format == 'csv':
+            import csv
+            writer = csv.writer(out)
+            writer.writerow(CSV_HEADER)
+            for exercise in _parse(args.file, errors):
+                writer.writerows(
+                    [exercise.date, exercise.name, s.weight, s.count,
+                     s.set_count, exercise.note or '']
+                    for s in exercise.sets)
+        else:
+            import json
+            for exercise in _parse(args.file, errors):
+                out.write(json.dumps({
+                    'date': exercise.date,
+                    'name': exercise.name,
+                    'note': exercise.note,
+                    'sets': [[s.weight, s.count, s.set_count]
+                             for s in exercise.sets],
+                }, ensure_ascii=False))
+                out.write('\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    _print_errors(args.file, errors)
+    return 1 if errors else 0
+
+
+def cmd_compact(args) -> int:
+    """Writes records in the normal form: one blank line, `x` multiplier"""
+    errors = []
+    if args.file != '-' and args.output is None:
+        # in place, the file is backed up and replaced
+        with _open_storage(args.file, errors.append) as storage:
+            if hasattr(storage, 'compact'):
+                storage.compact()
+                return 0
+            exercises = list(storage.iter_exercises())
+            _print_errors(args.file, errors)
+            if errors and not args.force:
+                print('{}: not rewritten, records with errors would be '
+                      'lost, use --force'.format(args.file), file=sys.stderr)
+                return 1
+            if exercises:
+                storage.save(exercises)
+        return 1 if errors else 0
+
+    out = _open_output(args.output)
+    try:
+        for exercise in _parse(args.file, errors):
+            out.write(exercise.str_to_save() + '\n\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    _print_errors(args.file, errors)
+    return 1 if errors else 0
+
+
+def cmd_convert(args) -> int:
+    """Copies exercises between text, SQLite and segments storages"""
+    return _copy(args, lambda: _open_storage(args.target, is_new=True))
+
+
+def cmd_segment(args) -> int:
+    """Splits the log into segments per year or month"""
+    from storage import SegmentStorage
+
+    if os.path.exists(args.target):
+        raise ValueError('{} exists, segments are not replaced'.format(
+            args.target))
+    # nothing is written before saving
+    target = SegmentStorage(args.target, period=args.period)
+    result = _copy(args, lambda: target)
+    if args.freeze:
+        frozen = target.freeze(compression=args.freeze)
+        print('frozen({})'.format(len(frozen)), file=sys.stderr)
+    return result
+
+
+def _copy(args, open_target) -> int:
+    """Copies the source to the storage opened by `open_target`"""
+    from kochkalib import ExerciseColumns
+
+    errors = []
+
+    def on_parse_error(error):
+        errors.append(error)
+        if not args.force:
+            # stops the copy, the target is not created
+            raise ValueError('{}:{}: {}, not converted, use --force'.format(
+                args.source, error.lineno, error.reason))
+
+    # the source is read before, stdin is read once
+    with _open_storage(args.source, on_parse_error) as source:
+        exercises = ExerciseColumns(source.iter_exercises())
+    with open_target() as target:
+        count = target.save(exercises)
+    _print_errors(args.source, errors)
+    print('exercises({}), errors({})'.format(count, len(errors)),
+          file=sys.stderr)
+    return 1 if errors else 0
+
+
+def cmd_team(args) -> int:
+    """Totals of a directory of athlete logs"""
+    from athletes import AthleteDirectory
+
+    errors = []
+    team = AthleteDirectory(args.directory, workers=args.workers,
+                            use_cache=not args.no_cache)
+    team.on_parse_error.append(
+        lambda athlete, error: errors.append((athlete, error)))
+    team.load()
+    stats = team.stats()
+    stats['total']['errors'] = len(errors)
+
+    if args.json:
+        import json
+        json.dump(stats, sys.stdout, ensure_ascii=False, indent=2,
+                  sort_keys=True)
+        print()
+    else:
+        row = '{:<20} {exercises:>9} {sets:>9} {tonnage:>12} {max_weight:>6}'
+        print('{:<20} {:>9} {:>9} {:>12} {:>6}'.format(
+            'athlete', 'exercises', 'sets', 'tonnage', 'max'))
+        for athlete, stat in sorted(stats['athletes'].items()):
+            print(row.format(athlete, **stat))
+        print()
+        print('{:<20} {:>9} {:>9} {:>12} {:>6} {}'.format(
+            'name', 'exercises', 'sets', 'tonnage', 'max', 'best'))
+        for name, stat in sorted(stats['names'].items()):
+            print((row + ' {best_athlete}').format(name, **stat))
+        print(row.format('total', **stats['total']))
+    for athlete, error in errors:
+        print('{}:{}: {}: {!r}'.format(
+            team.filename(athlete), error.lineno, error.reason, error.line),
+            file=sys.stderr)
+    return 1 if errors else 0
+
+
+def cmd_serve(args) -> int:
+    """HTTP/JSON server of the log, see `server`"""
+    import logging
+    import server
+
+    if not args.verbose:
+        logging.basicConfig(level=logging.INFO)
+        # a span of every request is too much for the console
+        logging.getLogger('kochka.metrics').setLevel(logging.WARNING)
+    os.stat(args.file)
+    server.run(args.file, args.host, args.port)
+    return 0
+
+
+def create_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='kochka', description='Kochka training log tools')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='log to stderr, metrics too')
+    parser.add_argument('--profile', metavar='PREFIX', nargs='?',
+                        const='kochka-profile',
+                        help='write cProfile and tracemalloc reports')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    check = commands.add_parser('check', help='validate the log')
+    check.add_argument('-q', '--quiet', action='store_true',
+                       help='print errors only')
+    check.set_defaults(func=cmd_check)
+
+    stats = commands.add_parser('stats', help='totals per exercise name')
+    stats.add_argument('--json', action='store_true')
+    stats.set_defaults(func=cmd_stats)
+
+    export = commands.add_parser('export', help='export sets')
+    export.add_argument('-f', '--format', choices=['csv', 'jsonl'],
+                        default='csv')
+    export.add_argument('-o', '--output', help='file, stdout by default')
+    export.set_defaults(func=cmd_export)
+
+    compact = commands.add_parser(
+        'compact', help='rewrite the log in the normal form')
+    compact.add_argument('-o', '--output',
+                         help='file or - for stdout, in place by default')
+    compact.add_argument('--force', action='store_true',
+                         help='rewrite in place dropping records with errors')
+    compact.set_defaults(func=cmd_compact)
+
+    for command in (check, stats, export, compact):
+        command.add_argument('file', help='training log, - for stdin')
+
+    convert = commands.add_parser(
+        'convert', help='copy exercises between storages')
+    convert.add_argument('--force', action='store_true',
+                         help='convert dropping records with errors')
+    convert.add_argument('source', help='training log, - for stdin')
+    convert.add_argument('target', help='.txt, .db or .segments, replaced')
+    convert.set_defaults(func=cmd_convert)
+
+    segment = commands.add_parser(
+        'segment', help='split the log into files per year or month')
+    segment.add_argument('--period', choices=['year', 'month'],
+                         default='year')
+    segment.add_argument('--freeze', choices=['gz', 'xz'],
+                         help='compress all segments but the last one')
+    segment.add_argument('--force', action='store_true',
+                         help='split dropping records with errors')
+    segment.add_argument('source', help='training log, - for stdin')
+    segment.add_argument('target', help='new directory, e.g. data.segments')
+    segment.set_defaults(func=cmd_segment)
+
+    team = commands.add_parser(
+        'team', help='totals of a directory of athlete logs')
+    team.add_argument('--json', action='store_true')
+    team.add_argument('-w', '--workers', type=int,
+                      help='parsing processes, CPU count by default')
+    team.add_argument('--no-cache', action='store_true',
+                      help='do not read and write .cache files')
+    team.add_argument('directory', help='<athlete>.txt logs')
+    team.set_defaults(func=cmd_team)
+
+    serve = commands.add_parser('serve', help='HTTP/JSON server of the log')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8080)
+    serve.add_argument('file', help='training log, .txt, .db or .segments')
+    serve.set_defaults(func=cmd_serve)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = create_parser().parse_args(argv)
+    if args.verbose:
+        import logging
+        logging.basicConfig(level=logging.DEBUG)
+    try:
+        if args.profile:
+            from metrics import profiled
+            with profiled(args.profile):
+                return args.func(args)
+        return args.func(args)
+    except BrokenPipeError:
+        # output is closed by a pipe reader as `head`
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    except (OSError, ValueError) as e:
+        print('kochka: {}'.format(e), file=sys.stderr)
+        return 1
+    finally:
+        if args.verbose:
+            from metrics import metrics
+            metrics.log_summary()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
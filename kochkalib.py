@@ -4,12 +4,28 @@ Kochka core related lib
 Copyright 2017 Pavel Folov
 """
 
+import datetime
+import difflib
+import gc
+import io
+import logging
+import os
+import pickle
 import re
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right, insort
 from enum import Enum
+from functools import lru_cache
+from itertools import repeat
+from operator import gt, mul
 from textwrap import shorten
 
 from patterns import Event
 from oslib import filebackup
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
 
 
 class Set:
@@ -36,6 +52,9 @@ class Set:
         else:
             return '{} {}'.format(self.weight, self.count)
 
+    def __reduce__(self):
+        return Set, (self.weight, self.count, self.set_count)
+
 
 class Exercise:
     """Упражнение из подходов"""
@@ -78,16 +97,495 @@ class Exercise:
     def name_with_note(self):
         if self.note is None:
             return self.name
-        else:
-            return '{} ({})'.format(
-                self.name,
-                shorten(self.note, width=20, placeholder='...')
-            )
+        return '{} ({})'.format(
+            self.name,
+            shorten(self.note, width=20, placeholder='...')
+        )
 
     def __str__(self):
         return 'date({0.date}), name({0.name}), sets({0.sets_str})'.format(
             self)
 
+    def __reduce__(self):
+        # compact pickle, exercises are passed between processes
+        return Exercise, (self.date, self.name, self.sets, self.note)
+
+
+class SetView(Set):
+    """Set of `ExerciseColumns`, read only"""
+
+    # values are kept by the slots of Set, the properties hide them
+    __slots__ = ()
+
+    weight = property(Set.weight.__get__)
+    count = property(Set.count.__get__)
+    set_count = property(Set.set_count.__get__)
+
+    def __init__(self, columns, index):
+        Set.weight.__set__(self, columns.weights[index])
+        Set.count.__set__(self, columns.counts[index])
+        Set.set_count.__set__(self, columns.set_counts[index])
+
+
+class ExerciseView(Exercise):
+    """Exercise stored in `ExerciseColumns`, read only"""
+
+    __slots__ = ['_columns', '_row']
+
+    def __init__(self, columns, row):
+        self._columns = columns
+        self._row = row
+
+    @property
+    def date(self):
+        return self._columns.date_at(self._row)
+
+    @property
+    def name(self):
+        columns = self._columns
+        return columns.names[columns.name_ids[self._row]]
+
+    @property
+    def note(self):
+        return self._columns.notes.get(self._row)
+
+    @property
+    def sets(self):
+        columns = self._columns
+        return [SetView(columns, i) for i in columns.set_range(self._row)]
+
+    def add_set(self, set_: Set):
+        raise TypeError('Exercise view is read only')
+
+    @property
+    def total_weight(self) -> int:
+        return self._columns.total_weight_at(self._row)
+
+    @property
+    def sets_str(self) -> str:
+        return self._columns.sets_str_at(self._row)
+
+
+class ExerciseColumns:
+    """
+    Exercises stored by columns
+
+    Sets of all exercises are kept in `weights`, `counts` and `set_counts`
+    arrays, `offsets` maps an exercise to the range of its sets. Dates are
+    day ordinals, names are dictionary encoded, notes are sparse. Items
+    are `ExerciseView`s, so the container is used as a list of exercises.
+
+    >>> exercises = ExerciseColumns(ExerciseTxtParser('data.txt'))
+    >>> exercises.append(Exercise('2017.01.13', 'жим', [Set(35, 5)]))
+    >>> print(exercises[-1])
+    >>> # date(2017.01.13), name(жим), sets([35 5])
+    """
+
+    def __init__(self, exercises=()):
+        self.weights = array('I')
+        self.counts = array('H')
+        self.set_counts = array('H')
+        self.offsets = array('I', [0])
+        self.dates = array('I')
+        self.name_ids = array('I')
+        self.names = []
+        self.notes = {}
+        # dates which are not converted to ordinal, 0 in `dates`
+        self._raw_dates = {}
+        self._name_ids = {}
+        self.extend(exercises)
+
+    def append(self, exercise: Exercise):
+        row = len(self.dates)
+        try:
+            self.dates.append(_date_to_ordinal(exercise.date))
+        except (ValueError, TypeError):
+            self.dates.append(0)
+            self._raw_dates[row] = exercise.date
+        name_id = self._name_ids.get(exercise.name)
+        if name_id is None:
+            name_id = self._name_ids[exercise.name] = len(self.names)
+            self.names.append(exercise.name)
+        self.name_ids.append(name_id)
+        if exercise.note is not None:
+            self.notes[row] = exercise.note
+        for set_ in exercise.sets:
+            self.weights.append(set_.weight)
+            self.counts.append(set_.count)
+            self.set_counts.append(set_.set_count)
+        self.offsets.append(len(self.weights))
+
+    def extend(self, exercises):
+        for exercise in exercises:
+            self.append(exercise)
+
+    def truncate(self, count):
+        """Removes exercises from `count` to the end"""
+        if count >= len(self):
+            return
+        sets_count = self.offsets[count]
+        for column in (self.weights, self.counts, self.set_counts):
+            del column[sets_count:]
+        del self.offsets[count + 1:]
+        del self.dates[count:]
+        del self.name_ids[count:]
+        for rows in (self.notes, self._raw_dates):
+            for row in [row for row in rows if row >= count]:
+                del rows[row]
+
+    def copy(self) -> 'ExerciseColumns':
+        """Snapshot of exercises, it is not changed with this list"""
+        columns = ExerciseColumns.__new__(ExerciseColumns)
+        for name in ('weights', 'counts', 'set_counts', 'offsets', 'dates',
+                     'name_ids'):
+            setattr(columns, name, getattr(self, name)[:])
+        columns.names = self.names[:]
+        columns.notes = dict(self.notes)
+        columns._raw_dates = dict(self._raw_dates)
+        columns._name_ids = dict(self._name_ids)
+        return columns
+
+    def date_at(self, row) -> str:
+        ordinal = self.dates[row]
+        if not ordinal:
+            return self._raw_dates[row]
+        date = datetime.date.fromordinal(ordinal)
+        return '{:04d}.{:02d}.{:02d}'.format(date.year, date.month, date.day)
+
+    def set_range(self, row) -> range:
+        return range(self.offsets[row], self.offsets[row + 1])
+
+    def total_weight_at(self, row) -> int:
+        start, stop = self.offsets[row], self.offsets[row + 1]
+        return sum(map(mul, self.weights[start:stop], map(
+            mul, self.counts[start:stop], self.set_counts[start:stop])))
+
+    def sets_str_at(self, row) -> str:
+        """`Exercise.sets_str` read from the columns"""
+        start, stop = self.offsets[row], self.offsets[row + 1]
+        return ' '.join(
+            '[{} {} x{}]'.format(weight, count, set_count) if set_count > 1
+            else '[{} {}]'.format(weight, count)
+            for weight, count, set_count in zip(
+                self.weights[start:stop], self.counts[start:stop],
+                self.set_counts[start:stop]))
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [ExerciseView(self, i) for i in range(len(self))[row]]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError('exercise index out of range')
+        return ExerciseView(self, row)
+
+    def __iter__(self):
+        return (ExerciseView(self, row) for row in range(len(self)))
+
+
+class ExerciseIndex:
+    """
+    Date, name and text indexes of exercises list rows
+
+    Rows are added in the list order by `add`. Dates are kept sorted for
+    `bisect` range queries, names map to ascending row lists, words of
+    names and notes are in `TextIndex`.
+
+    >>> index = ExerciseIndex(exercises)
+    >>> rows = index.filter(name='жим', date_from='2017.01.01')
+    >>> [exercises[row] for row in rows]
+    >>> rows = index.filter(text='травм* OR болезнь')
+    """
+
+    def __init__(self, exercises=()):
+        self.names = {}
+        self.text = TextIndex()
+        self._dates = []
+        self._date_rows = array('I')
+        for exercise in exercises:
+            self.add(exercise)
+
+    def add(self, exercise: Exercise):
+        row = len(self._dates)
+        date = exercise.date or ''
+        self.names.setdefault(exercise.name, array('I')).append(row)
+        self.text.add(row, exercise.name, exercise.note)
+        if not self._dates or self._dates[-1] <= date:
+            # usual case, exercises are added by dates
+            self._dates.append(date)
+            self._date_rows.append(row)
+        else:
+            pos = bisect_right(self._dates, date)
+            self._dates.insert(pos, date)
+            self._date_rows.insert(pos, row)
+
+    def truncate(self, count):
+        """Removes rows from `count` to the end"""
+        if count >= len(self._dates):
+            return
+        for name, rows in list(self.names.items()):
+            _truncate_rows(rows, count)
+            if not rows:
+                del self.names[name]
+        self.text.truncate(count)
+        dates, date_rows = self._dates, self._date_rows
+        while date_rows and date_rows[-1] >= count:
+            dates.pop()
+            date_rows.pop()
+        if len(dates) > count:
+            # rows added out of dates order are inside
+            kept = [i for i, row in enumerate(date_rows) if row < count]
+            self._dates = [dates[i] for i in kept]
+            self._date_rows = array('I', (date_rows[i] for i in kept))
+
+    def __len__(self):
+        return len(self._dates)
+
+    def date_rows(self, date_from=None, date_to=None) -> array:
+        """Rows of exercises from `date_from` to `date_to` inclusive"""
+        start = 0 if date_from is None \
+            else bisect_left(self._dates, date_from)
+        stop = len(self._dates) if date_to is None \
+            else bisect_right(self._dates, date_to)
+        rows = self._date_rows[start:stop]
+        # rows are sorted already if exercises were added by dates
+        if any(map(gt, rows, rows[1:])):
+            rows = array('I', sorted(rows))
+        return rows
+
+    def filter(self, name=None, date_from=None, date_to=None,
+               text=None) -> array:
+        """
+        Ascending rows of exercises matching all given conditions
+
+        `text` is a `TextIndex.search` query over names and notes.
+        """
+        conditions = []
+        if name is not None:
+            conditions.append(self.names.get(name, array('I')))
+        if text:
+            conditions.append(self.text.search(text))
+        if not conditions or date_from is not None or date_to is not None:
+            conditions.append(self.date_rows(date_from, date_to))
+        return _intersection(conditions)
+
+
+class TextIndex:
+    """
+    Inverted index of exercise names and notes
+
+    Words are case folded, `ё` is `е`, and Russian endings are cut off,
+    so "травма", "травмы" and "Травмой" are the same token. A token maps
+    to ascending rows.
+
+    Query terms are joined by AND, groups of terms by OR, `*` at the end
+    of a term matches tokens by prefix:
+
+    >>> index.search('травма поясница')     # both
+    >>> index.search('болезнь OR травма')   # any
+    >>> index.search('пояс* OR колен*')
+    """
+
+    or_words = ('or', 'или')
+
+    def __init__(self):
+        self.postings = {}
+        # sorted tokens for prefix queries
+        self.tokens = []
+
+    def add(self, row, *texts):
+        """Indexes texts of the row, rows are added in ascending order"""
+        for text in texts:
+            if not text:
+                continue
+            for token in text_tokens(text):
+                rows = self.postings.get(token)
+                if rows is None:
+                    rows = self.postings[token] = array('I')
+                    insort(self.tokens, token)
+                elif rows[-1] == row:
+                    # the name and the note have the word both
+                    continue
+                rows.append(row)
+
+    def truncate(self, count):
+        """Removes rows from `count` to the end"""
+        for token, rows in list(self.postings.items()):
+            _truncate_rows(rows, count)
+            if not rows:
+                del self.postings[token]
+                del self.tokens[bisect_left(self.tokens, token)]
+
+    def search(self, query) -> array:
+        """Ascending rows matching the query"""
+        groups = [[]]
+        for term in query.split():
+            if term.casefold() in self.or_words:
+                groups.append([])
+                continue
+            is_prefix = term.endswith('*')
+            tokens = text_tokens(term)
+            if not tokens:
+                continue
+            if is_prefix:
+                # the last word is typed partially
+                groups[-1].extend(self.token_rows(token)
+                                  for token in tokens[:-1])
+                groups[-1].append(self.prefix_rows(tokens[-1]))
+            else:
+                groups[-1].extend(map(self.token_rows, tokens))
+        results = [_intersection(group) for group in groups if group]
+        if not results:
+            return array('I')
+        if len(results) == 1:
+            return results[0]
+        return array('I', sorted(set().union(*results)))
+
+    def token_rows(self, token) -> array:
+        return self.postings.get(token, array('I'))
+
+    def prefix_rows(self, prefix) -> array:
+        """Rows of all tokens starting with the prefix"""
+        start = bisect_left(self.tokens, prefix)
+        stop = bisect_left(self.tokens, prefix + '\uffff', start)
+        postings = [self.postings[token] for token in self.tokens[start:stop]]
+        if len(postings) == 1:
+            return postings[0]
+        return array('I', sorted(set().union(*postings)))
+
+
+# underscores join words of names: тяга_блока
+_word_pattern = re.compile(r'[^\W_]+')
+# longer endings are first, "ами" is cut off rather than "и"
+_russian_endings = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'иях',
+    'ий', 'ый', 'ой', 'ей', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю',
+    'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ью', 'ия', 'ии', 'ию',
+    'ть', 'ет', 'ит', 'ут', 'ют', 'ат', 'ят', 'ешь', 'ишь', 'ла', 'ло',
+    'ли', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й'), key=len,
+    reverse=True)
+_reflexive_endings = ('ся', 'сь')
+_min_stem = 3
+
+
+def stem(word) -> str:
+    """Cuts off an ending of a Russian word, the stem is 3 letters at least"""
+    for ending in _reflexive_endings:
+        if word.endswith(ending) and len(word) - len(ending) >= _min_stem:
+            word = word[:-len(ending)]
+            break
+    for ending in _russian_endings:
+        if word.endswith(ending) and len(word) - len(ending) >= _min_stem:
+            return word[:-len(ending)]
+    return word
+
+
+@lru_cache(maxsize=4096)
+def text_tokens(text) -> tuple:
+    """Folded stems of words, names and notes repeat so they are cached"""
+    return tuple(stem(word) for word in _word_pattern.findall(
+        text.casefold().replace('ё', 'е')))
+
+
+def _intersection(rows_list) -> array:
+    """Rows which are in all ascending rows"""
+    rows_list = sorted(rows_list, key=len)
+    rows = rows_list[0][:]
+    for other in rows_list[1:]:
+        if not rows:
+            break
+        if len(rows) * 16 < len(other):
+            # few rows are looked up in the larger ones by bisect
+            rows = array('I', (row for row in rows if _contains(other, row)))
+        else:
+            rows = array('I', sorted(set(rows).intersection(other)))
+    return rows
+
+
+def _truncate_rows(rows: array, count):
+    """Removes rows from `count` of ascending rows"""
+    del rows[bisect_left(rows, count):]
+
+
+def _contains(rows: array, row) -> bool:
+    """Checks the row is in ascending rows"""
+    pos = bisect_left(rows, row)
+    return pos < len(rows) and rows[pos] == row
+
+
+def record_key(exercise: Exercise) -> int:
+    """Hash of the record, equal records have equal keys in the process"""
+    return hash((exercise.date, exercise.name, exercise.note,
+                 tuple((s.weight, s.count, s.set_count)
+                       for s in exercise.sets)))
+
+
+def diff_records(old_keys: array, new_keys: array, max_matched=2000) -> list:
+    """
+    Changes of old records to new ones by their `record_key`s
+
+    Returns `difflib.SequenceMatcher` opcodes without 'equal' ones. Same
+    head and tail are skipped by comparing chunks of key arrays, the rest
+    is matched if it is shorter than `max_matched` or replaced.
+
+    >>> for tag, i1, i2, j1, j2 in diff_records(old_keys, new_keys):
+    ...     print(tag, old[i1:i2], new[j1:j2])
+    """
+    head = _common_head(old_keys, new_keys)
+    tail = _common_tail(old_keys, new_keys,
+                        min(len(old_keys), len(new_keys)) - head)
+    old_stop, new_stop = len(old_keys) - tail, len(new_keys) - tail
+    if head == old_stop and head == new_stop:
+        return []
+    if max(old_stop, new_stop) - head > max_matched:
+        return [('replace', head, old_stop, head, new_stop)]
+    matcher = difflib.SequenceMatcher(
+        None, old_keys[head:old_stop].tolist(),
+        new_keys[head:new_stop].tolist(), autojunk=False)
+    return [(tag, i1 + head, i2 + head, j1 + head, j2 + head)
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+            if tag != 'equal']
+
+
+# compared slices are small, big ones are slow to allocate
+_diff_chunk = 4096
+
+
+def _common_head(a: array, b: array) -> int:
+    size = min(len(a), len(b))
+    start = 0
+    while start < size and \
+            a[start:start + _diff_chunk] == b[start:start + _diff_chunk]:
+        start += _diff_chunk
+    start = min(start, size)
+    while start < size and a[start] == b[start]:
+        start += 1
+    return start
+
+
+def _common_tail(a: array, b: array, limit) -> int:
+    """Size of the same end, it is `limit` at most"""
+    size = 0
+    while size < limit:
+        chunk = min(_diff_chunk, limit - size)
+        if a[len(a) - size - chunk:len(a) - size] != \
+                b[len(b) - size - chunk:len(b) - size]:
+            break
+        size += chunk
+    while size < limit and a[len(a) - size - 1] == b[len(b) - size - 1]:
+        size += 1
+    return size
+
+
+def _date_to_ordinal(date: str) -> int:
+    match = ExerciseTxtParser.date_pattern.match(date)
+    if not match:
+        raise ValueError('Unexpected date format: {}'.format(date))
+    return datetime.date(*map(int, match.groups())).toordinal()
+
 
 class ParserState(Enum):
     START = 0
@@ -96,6 +594,38 @@ class ParserState(Enum):
     NOTE_GOT = 3
     SETS_GETTING = 4
     DONE = 5
+    # lines are skipped until a date after an error
+    RESYNC = 6
+
+
+class ParseError:
+    """Parser error: line number, line, parser state and reason"""
+
+    __slots__ = ['lineno', 'line', 'state', 'reason', 'detail']
+
+    # what is expected in a state
+    reasons = {
+        ParserState.START: 'date expected',
+        ParserState.DATE_GOT: 'name expected',
+        ParserState.NAME_GOT: 'note or set expected',
+        ParserState.NOTE_GOT: 'set expected',
+        ParserState.SETS_GETTING: 'set or blank line expected',
+    }
+
+    def __init__(self, lineno, line, state, reason, detail):
+        self.lineno = lineno
+        self.line = line
+        self.state = state
+        self.reason = reason
+        # parser description at the moment of the error
+        self.detail = detail
+
+    def __str__(self):
+        if not self.line:
+            return 'Unexpected new line: lineno({}), detail{}'.format(
+                self.lineno, self.detail)
+        return 'Parser sequence error: lineno({}), line({}), ' \
+               'detail({})'.format(self.lineno, self.line, self.detail)
 
 
 class ExerciseTxtParser:
@@ -112,6 +642,13 @@ class ExerciseTxtParser:
     >>> parser = ExerciseTxtParser('data.txt')
     >>> for e in parser: print(e)
     >>> # date(2017.01.13), name(жим), sets([35 5] [45 10 x5] [50 6 x2])
+
+    Errors are sent to `on_error` as messages and to `on_parse_error` as
+    `ParseError`. With `resync` a record with an error is dropped and
+    lines are skipped until the next date, a date line which is the
+    error itself starts the next record (a blank line is missed). A
+    record with sets before such a date line is complete, it is kept.
+    Otherwise the parser stays in its state and the record goes on.
     """
 
     date_pattern = re.compile(r'(?P<Y>\d{4})\.(?P<M>\d{2})\.(?P<D>\d{2})$')
@@ -119,21 +656,37 @@ class ExerciseTxtParser:
     set_pattern = re.compile(r'(?P<WEIGHT>\d{2,3}) (?P<COUNT>\d{1,2})'
                              r'(?:\s?[\*xXхХ]\s?(?P<SET_COUNT>\d{1,2}))?$')
 
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, resync=False):
         self.filename = filename
+        self.resync = resync
         self.state = ParserState.START
         self.currentExercise = None
+        # a record finished without a blank line, it is yielded next
+        self.finishedExercise = None
         self.on_error = Event()
+        self.on_parse_error = Event()
 
     def __iter__(self):
+        yield from metrics.iter_span(
+            'parse', self._iter_file(), parser=type(self).__name__,
+            bytes=os.path.getsize(self.filename))
+
+    def _iter_file(self):
         # из cookbook, может лучше просто итератор реализовать
         with open(self.filename) as f:
-            for lineno, line in enumerate(f, start=1):
-                self.dispatch_line(line.rstrip(), lineno)
-                if self.is_done:
-                    self.state = ParserState.START
-                    yield self.currentExercise
-                    self.currentExercise = None
+            yield from self.parse_lines(f)
+
+    def parse_lines(self, lines, start=1):
+        """Parses an iterable of lines, numbering them from `start`"""
+        for lineno, line in enumerate(lines, start=start):
+            self.dispatch_line(line.rstrip(), lineno)
+            if self.finishedExercise is not None:
+                yield self.finishedExercise
+                self.finishedExercise = None
+            if self.is_done:
+                self.state = ParserState.START
+                yield self.currentExercise
+                self.currentExercise = None
 
     @property
     def is_start(self):
@@ -159,15 +712,24 @@ class ExerciseTxtParser:
     def is_done(self):
         return self.state is ParserState.DONE
 
+    @property
+    def is_resync(self):
+        return self.state is ParserState.RESYNC
+
     # todo: избавиться от условий (конечный автомат, или еще чего)
     def dispatch_line(self, line: str, lineno: int):
+        if self.is_resync:
+            if not self.date_pattern.match(line):
+                return
+            self.state = ParserState.START
         done_cond = (not line) and self.is_sets_getting
         if done_cond:
             self.state = ParserState.DONE
             return
         elif not line:
-            self.on_error('Unexpected new line: lineno({}), detail{}'.format(
-                lineno, str(self)))
+            if not self.is_start or not self.resync:
+                # extra blank lines between records are not errors to resync
+                self._error(lineno, line, 'unexpected blank line')
             return
         elif self.is_start and self.date_pattern.match(line):
             self.currentExercise = Exercise(date=line)
@@ -181,6 +743,15 @@ class ExerciseTxtParser:
             self.currentExercise.note = line.lstrip('# ')
             self.state = ParserState.NOTE_GOT
             return
+        elif self.is_sets_getting and self.resync and \
+                self.date_pattern.match(line):
+            # the record is complete, only the blank line is missed
+            self.report(ParseError(lineno, line, self.state,
+                                   'blank line expected', str(self)))
+            self.finishedExercise = self.currentExercise
+            self.currentExercise = Exercise(date=line)
+            self.state = ParserState.DATE_GOT
+            return
         elif self.is_name_got or self.is_note_got or self.is_sets_getting:
             match = self.set_pattern.match(line)
             if match:
@@ -188,8 +759,24 @@ class ExerciseTxtParser:
                     self._create_set_by_match(match))
                 self.state = ParserState.SETS_GETTING
                 return
-        err_msg = 'Parser sequence error: lineno({}), line({}), detail({})'
-        self.on_error(err_msg.format(lineno, line, str(self)))
+        self._error(lineno, line, ParseError.reasons[self.state])
+
+    def _error(self, lineno, line, reason):
+        self.report(ParseError(lineno, line, self.state, reason, str(self)))
+        if self.resync:
+            self.currentExercise = None
+            if self.date_pattern.match(line):
+                # the next record after a missed blank line
+                self.state = ParserState.START
+                self.dispatch_line(line, lineno)
+            else:
+                self.state = ParserState.RESYNC
+
+    def report(self, error: ParseError):
+        """Sends the error to subscribers"""
+        metrics.count('parse.errors')
+        self.on_parse_error(error)
+        self.on_error(str(error))
 
     def _create_set_by_match(self, match):
         set_dict = match.groupdict()
@@ -203,14 +790,443 @@ class ExerciseTxtParser:
         return 'Parser: {0.state}, exercise({0.currentExercise})'.format(self)
 
 
-def save_exercises_to_file(filename, exercises):
-    """Writes exercises to file"""
+class _SetLineCache(dict):
+    """Set line -> Set, creates missing sets by the parser pattern"""
+
+    def __init__(self, parser):
+        super().__init__()
+        self.parser = parser
+
+    def __missing__(self, line):
+        set_ = self[line] = self.parser._create_set_by_match(
+            self.parser.set_pattern.match(line))
+        return set_
+
+
+class ExerciseTxtBufferParser(ExerciseTxtParser):
+    """
+    Training text file parser working on the whole file buffer
+
+    Well-formed records (date, name, optional note, sets, blank line) are
+    taken by one regex match each. Everything else falls back to
+    `dispatch_line`, so exercises and `on_error` messages are the same as
+    `ExerciseTxtParser` gives. Equal set lines share one `Set` object,
+    sets are not changed after parsing.
+
+    >>> parser = ExerciseTxtBufferParser('data.txt')
+    >>> exercises = list(parser)
+    """
+
+    # same grammar as date/name/set patterns, but for lines of a buffer
+    record_pattern = re.compile(
+        r'(\d{4}\.\d{2}\.\d{2})\n'
+        r'(\w+)\n'
+        r'(?:(#[^\n]*)\n)?'
+        r'((?:\d{2,3} \d{1,2}(?:[^\S\n]?[\*xXхХ][^\S\n]?\d{1,2})?\n)+)'
+        r'\n'
+    )
+
+    def __init__(self, filename: str, resync=False):
+        super().__init__(filename, resync)
+        self._known_sets = _SetLineCache(self)
+
+    def _iter_file(self):
+        with open(self.filename) as f:
+            text = f.read()
+        yield from self.parse_text(text)
+
+    def parse_text(self, text: str, start=1):
+        """Parses a text buffer, numbering its lines from `start`"""
+        record_match = self.record_pattern.match
+        # set lines repeat a lot, so equal lines share one Set object
+        get_set = self._known_sets.__getitem__
+        pos = 0
+        # lines are counted only when a line is parsed by `dispatch_line`
+        lineno = start
+        counted = 0
+        text_len = len(text)
+        while pos < text_len:
+            if self.state is ParserState.START:
+                match = record_match(text, pos)
+                while match:
+                    date, name, note, sets_block = match.groups()
+                    if note is not None:
+                        note = note.rstrip().lstrip('# ')
+                    pos = match.end()
+                    yield Exercise(date, name, list(map(
+                        get_set, sets_block[:-1].split('\n'))), note)
+                    match = record_match(text, pos)
+                if pos >= text_len:
+                    break
+            lineno += text.count('\n', counted, pos)
+            end = text.find('\n', pos)
+            if end == -1:
+                end = text_len
+            self.dispatch_line(text[pos:end].rstrip(), lineno)
+            lineno += 1
+            pos = counted = end + 1
+            if self.finishedExercise is not None:
+                yield self.finishedExercise
+                self.finishedExercise = None
+            if self.is_done:
+                self.state = ParserState.START
+                yield self.currentExercise
+                self.currentExercise = None
+
+    def parse_stream(self, f, start=1, block_size=1024 * 1024):
+        """
+        Parses a text file object by blocks cut at blank lines
+
+        Only a block and an unfinished record are kept in memory, so big
+        files and pipes are parsed as fast as a buffer. The last record
+        is finished by the end of the stream, a blank line after it is
+        not needed.
+
+        >>> exercises = parser.parse_stream(sys.stdin)
+        """
+        lineno = start
+        rest = ''
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            text = rest + block
+            cut = text.rfind('\n\n')
+            if cut == -1:
+                rest = text
+                continue
+            cut += 2
+            yield from self.parse_text(text[:cut], lineno)
+            lineno += text.count('\n', 0, cut)
+            rest = text[cut:]
+        if rest:
+            yield from self.parse_text(rest, lineno)
+            lineno += rest.count('\n') + (not rest.endswith('\n'))
+        if not self.is_start and not self.is_resync:
+            yield from self.parse_text('\n', lineno)
+
+
+class ExerciseTxtParallelParser(ExerciseTxtBufferParser):
+    """
+    Training text file parser using worker processes
+
+    The file is split into byte ranges at blank lines, every range is
+    parsed by `ExerciseTxtBufferParser` in a worker process and results
+    come back in the file order. Line numbers of errors are the same
+    as for the whole file. Small files and `workers` <= 1 are parsed
+    serially.
+
+    >>> parser = ExerciseTxtParallelParser('data.txt', workers=4)
+    >>> exercises = list(parser)
+    """
+
+    # files smaller than this are not worth of starting processes
+    parallel_threshold = 4 * 1024 * 1024
+
+    boundary_pattern = re.compile(rb'\n\r?\n')
+
+    def __init__(self, filename: str, workers=1, resync=False):
+        super().__init__(filename, resync)
+        self.workers = workers
+
+    def _iter_file(self):
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        yield from self.parse_data(data)
+
+    def parse_data(self, data: bytes, start=1):
+        """Parses bytes of the file, numbering its lines from `start`"""
+        if self.workers <= 1 or len(data) < self.parallel_threshold:
+            yield from self.parse_text(_decode_text(data), start)
+            return
+
+        # imported here, it takes a while and is not needed usually
+        from concurrent.futures import ProcessPoolExecutor
+
+        chunks = self._split_data(data, start)
+        with ProcessPoolExecutor(self.workers) as executor:
+            results = executor.map(
+                _parse_chunk, repeat(self.filename),
+                [data[chunk_start:stop] for chunk_start, stop, _ in chunks],
+                [lineno for _, _, lineno in chunks], repeat(self.resync))
+            for (chunk_start, stop, lineno), result in zip(chunks, results):
+                if not self.is_start:
+                    # a record of the previous range is not finished,
+                    # the worker started from the wrong state
+                    yield from self.parse_text(
+                        _decode_text(data[chunk_start:stop]), lineno)
+                    continue
+                exercises, errors, self.state, self.currentExercise = result
+                for error in errors:
+                    self.report(error)
+                yield from exercises
+
+    def _split_data(self, data: bytes, lineno=1) -> list:
+        """Returns (start, stop, lineno) byte ranges aligned to blank lines"""
+        size = len(data)
+        chunks = []
+        start = 0
+        for i in range(1, self.workers + 1):
+            if start >= size:
+                break
+            match = self.boundary_pattern.search(
+                data, max(start, size * i // self.workers))
+            stop = match.end() if match and i < self.workers else size
+            chunks.append((start, stop, lineno))
+            lineno += data.count(b'\n', start, stop)
+            start = stop
+        return chunks
+
+
+def _decode_text(data: bytes) -> str:
+    """Decodes bytes of text file as `open` does"""
+    return io.TextIOWrapper(io.BytesIO(data)).read()
+
+
+def _parse_chunk(filename, data, lineno, resync):
+    """Process pool job of `ExerciseTxtParallelParser`"""
+    parser = ExerciseTxtBufferParser(filename, resync)
+    errors = []
+    parser.on_parse_error.append(errors.append)
+    exercises = list(parser.parse_text(_decode_text(data), lineno))
+    return exercises, errors, parser.state, parser.currentExercise
+
+
+class ExerciseTxtTailLoader:
+    """
+    Training text file loader parsing only appended records on reload
+
+    Offset, size and mtime of the parsed part are kept with a checksum of
+    the parsed bytes. If the file has only grown, `load` parses just the
+    new tail, otherwise the whole file is parsed again and `is_full` is
+    set, so previously loaded exercises have to be dropped.
+
+    With `use_cache` parsed exercises are kept in the cache file next to
+    the data file, the first `load` takes them from there when the cached
+    part of the file is unchanged and parses only the rest. Parse errors
+    of the cached part are kept there too and are reported again.
+
+    >>> loader = ExerciseTxtTailLoader('data.txt')
+    >>> exercises = loader.load()  # whole file
+    >>> exercises += loader.load()  # appended records only
+    """
+
+    cache_version = 2
+
+    def __init__(self, filename: str, workers=1, use_cache=False,
+                 resync=False):
+        self.filename = filename
+        self.workers = workers
+        self.use_cache = use_cache
+        self.resync = resync
+        self.on_error = Event()
+        self.on_parse_error = Event()
+        self.is_full = True
+        self.reset()
+
+    @property
+    def cache_filename(self):
+        return self.filename + '.cache'
+
+    def reset(self):
+        """Forgets parsed part, next `load` parses the whole file"""
+        self.offset = 0
+        self.lineno = 1
+        self.size = None
+        self.mtime = None
+        self.checksum = zlib.crc32(b'')
+        # parse errors of the parsed part, they are cached
+        self.errors = []
+        self._parser = ExerciseTxtParallelParser(self.filename, self.workers,
+                                                 self.resync)
+        self._parser.on_error.append(self.on_error)
+        self._parser.on_parse_error.append(self.on_parse_error)
+        self._parser.on_parse_error.append(self.errors.append)
+
+    def load(self) -> list:
+        """Returns exercises parsed since the previous load"""
+        return list(self.iter_load())
+
+    def iter_load(self):
+        """
+        Yields exercises parsed since the previous load
+
+        `is_full` is set before the first exercise. The loader is reset
+        if the iteration is not finished.
+        """
+        yield from metrics.iter_span('load', self._iter_load())
+
+    def _iter_load(self):
+        is_first = self.size is None
+        cached = self._load_cache() if is_first and self.use_cache else []
+        # all exercises are kept only to be cached
+        collected = [] if self.use_cache else None
+        try:
+            with open(self.filename, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                # the cache is checked by the content too
+                is_same = not is_first and stat.st_size == self.size and \
+                    stat.st_mtime_ns == self.mtime
+                if is_same:
+                    self.is_full = False
+                    return
+                is_tail = self._is_prefix_same(f, stat.st_size)
+                if not is_tail:
+                    self.reset()
+                    cached = []
+                    f.seek(0)
+                data = f.read()
+
+            self.is_full = is_first or not is_tail
+            if is_first and is_tail:
+                # errors of the cached part are not parsed again
+                for error in self.errors:
+                    self.on_parse_error(error)
+                    self.on_error(str(error))
+            yield from _collected(cached, collected)
+            # the last line may be still written, it is parsed next time
+            cut = data.rfind(b'\n') + 1
+            yield from _collected(self._parser.parse_data(
+                data[:cut], self.lineno), collected)
+            self._remember(data[:cut], stat)
+            if self.use_cache and (not is_tail or is_first and
+                                   len(collected) > len(cached)):
+                self.save_cache(collected)
+        except GeneratorExit:
+            # offsets and the parser state are not consistent
+            self.reset()
+            raise
+
+    def is_changed(self) -> bool:
+        """Checks the file is changed since the last load"""
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return True
+        return stat.st_size != self.size or stat.st_mtime_ns != self.mtime
+
+    def remember_file(self):
+        """Takes the whole file as parsed, e.g. after saving exercises"""
+        self.reset()
+        with open(self.filename, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self._remember(f.read(stat.st_size), stat)
+
+    def save_cache(self, exercises):
+        """Writes all exercises of the parsed part to the cache file"""
+        cache = {
+            'version': self.cache_version,
+            'offset': self.offset,
+            'lineno': self.lineno,
+            'checksum': self.checksum,
+            'size': self.size,
+            'mtime': self.mtime,
+            'state': self._parser.state,
+            'exercise': self._parser.currentExercise,
+            'exercises': exercises,
+            'errors': self.errors,
+        }
+        tmp_filename = self.cache_filename + '.tmp'
+        try:
+            with open(tmp_filename, 'wb') as f:
+                pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_filename, self.cache_filename)
+        except (OSError, pickle.PicklingError):
+            logger.exception('cache is not saved: %s', self.cache_filename)
+
+    def _load_cache(self) -> list:
+        # a lot of objects are created, collector passes only slow it down
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(self.cache_filename, 'rb') as f:
+                cache = pickle.load(f)
+        except FileNotFoundError:
+            return []
+        except Exception:
+            # stale format or broken file, it is rebuilt after parsing
+            logger.warning('cache is not loaded: %s', self.cache_filename,
+                           exc_info=True)
+            return []
+        finally:
+            if gc_enabled:
+                gc.enable()
+        if cache.get('version') != self.cache_version:
+            return []
+        self.offset = cache['offset']
+        self.lineno = cache['lineno']
+        self.checksum = cache['checksum']
+        self.size = cache['size']
+        self.mtime = cache['mtime']
+        self._parser.state = cache['state']
+        self._parser.currentExercise = cache['exercise']
+        self.errors.extend(cache['errors'])
+        return cache['exercises']
+
+    def _is_prefix_same(self, f, size) -> bool:
+        if self.size is None or size < self.offset:
+            return False
+        return zlib.crc32(f.read(self.offset)) == self.checksum
+
+    def _remember(self, data: bytes, stat):
+        self.offset += len(data)
+        self.lineno += data.count(b'\n')
+        self.checksum = zlib.crc32(data, self.checksum)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime_ns
+
+
+def save_exercises_to_file(filename, exercises, use_cache=False):
+    """Writes exercises to file, and to the parsed data cache if needed"""
     if not exercises:
         raise ValueError('Exercises cannot be empty')
 
-    with filebackup(filename), open(filename, 'w') as f:
+    with metrics.span('save', records=len(exercises)) as fields, \
+            filebackup(filename), open(filename, 'w') as f:
         for exercise in exercises:
             f.write(''.join([
                 exercise.str_to_save(),
                 '\n\n'
             ]))
+        fields['bytes'] = f.tell()
+
+    if use_cache:
+        loader = ExerciseTxtTailLoader(filename, use_cache=True)
+        loader.remember_file()
+        loader.save_cache(exercises)
+
+
+def _collected(exercises, collected: list):
+    """Yields exercises appending them to `collected` if it is given"""
+    if collected is None:
+        yield from exercises
+        return
+    for exercise in exercises:
+        collected.append(exercise)
+        yield exercise
+
+
+def append_exercises_to_file(filename, exercises):
+    """Appends exercises to the end of file by one write"""
+    if not exercises:
+        return
+
+    with open(filename, 'rb') as f:
+        f.seek(max(0, os.fstat(f.fileno()).st_size - 2))
+        tail = f.read()
+    # the previous record has to be finished by a blank line
+    if not tail or tail.endswith(b'\n\n'):
+        separator = ''
+    elif tail.endswith(b'\n'):
+        separator = '\n'
+    else:
+        separator = '\n\n'
+    text = separator + ''.join(
+        exercise.str_to_save() + '\n\n' for exercise in exercises)
+    with metrics.span('append', records=len(exercises)) as fields, \
+            open(filename, 'a') as f:
+        start = f.tell()
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+        fields['bytes'] = f.tell() - start
@@ -1,4 +1,161 @@
-import coloredlogs
+"""
+Logging configuration
+
+Handlers are called by a listener thread, loggers only put records to a
+bounded queue, so disk stalls do not stop the GUI thread:
+
+>>> listener = configure()
+>>> ...
+>>> listener.stop()  # queued records are written
+"""
+
+import logging
+import logging.config
+import queue
+import threading
+from logging.handlers import QueueHandler, TimedRotatingFileHandler
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class BatchFileHandler(TimedRotatingFileHandler):
+    """Rotating file handler flushed once per batch of `LogListener`"""
+
+    def flush(self):
+        # called by every emit
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+
+class LogQueueHandler(QueueHandler):
+    """
+    Puts records with handlers of the logger to the queue
+
+    The caller is not blocked, a record is dropped by a full queue and
+    counted, `LogListener` reports dropped records.
+    """
+
+    def __init__(self, queue_, handlers):
+        super().__init__(queue_)
+        self.handlers = handlers
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait((self.handlers, record))
+        except queue.Full:
+            # called under the handler lock
+            self.dropped += 1
+            metrics.count('log.dropped')
+
+
+class LogListener:
+    """
+    Calls handlers of queued records on a thread
+
+    Records are taken by batches, files are flushed after a batch rather
+    than after every record. Records dropped by `queue_handlers` are
+    logged when the queue is drained and the total is logged by `stop`.
+    """
+
+    batch_size = 256
+    _stop = object()
+
+    def __init__(self, queue_, queue_handlers=()):
+        self.queue = queue_
+        self.queue_handlers = list(queue_handlers)
+        self._thread = None
+        self._reported = 0
+
+    @property
+    def dropped(self) -> int:
+        return sum(handler.dropped for handler in self.queue_handlers)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name='LogListener', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Writes queued records and stops the thread"""
+        if self._thread is None:
+            return
+        dropped = self.dropped
+        if dropped:
+            logger.warning('log records are dropped by the full queue: '
+                           'total(%d)', dropped)
+        self.queue.put(self._stop)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not self.handle_batch(batch):
+                return
+            if self.queue.empty():
+                self._report_dropped()
+
+    def _report_dropped(self):
+        dropped = self.dropped
+        if dropped > self._reported:
+            logger.warning('log records are dropped by the full queue: '
+                           'dropped(%d)', dropped - self._reported)
+            self._reported = dropped
+
+    def handle_batch(self, batch) -> bool:
+        """Handles records, returns False if the listener is stopped"""
+        is_running = True
+        # handler: its last record to report a flush error
+        flushed = {}
+        for item in batch:
+            if item is self._stop:
+                is_running = False
+                continue
+            handlers, record = item
+            for handler in handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+                    flushed[handler] = record
+        for handler, record in flushed.items():
+            try:
+                getattr(handler, 'flush_batch', handler.flush)()
+            except OSError:
+                handler.handleError(record)
+        return is_running
+
+
+def configure(queue_size=10000) -> LogListener:
+    """
+    Applies `config`, handlers of loggers are moved to a listener thread
+
+    Returns the started listener, it is to be stopped at the exit.
+    """
+    logging.config.dictConfig(config)
+    log_queue = queue.Queue(queue_size)
+    queue_handlers = []
+    for name in [None] + list(config['loggers']):
+        logger_ = logging.getLogger(name)
+        handlers = logger_.handlers[:]
+        if not handlers:
+            continue
+        for handler in handlers:
+            logger_.removeHandler(handler)
+        queue_handler = LogQueueHandler(log_queue, handlers)
+        logger_.addHandler(queue_handler)
+        queue_handlers.append(queue_handler)
+    listener = LogListener(log_queue, queue_handlers)
+    listener.start()
+    return listener
 
 
 def _logger_settings(level):
@@ -17,8 +174,14 @@ config = {
             'datefmt': _date_format,
             'format': _default_format,
         },
+        # metrics are JSON lines
+        'message': {
+            'class': 'logging.Formatter',
+            'format': '%(message)s',
+        },
         'colored': {
-            '()': coloredlogs.ColoredFormatter,
+            # imported by the config, the listener does not need it
+            '()': 'coloredlogs.ColoredFormatter',
             'datefmt': _date_format,
             'format': _default_format,
         },
@@ -30,7 +193,7 @@ config = {
             'formatter': 'colored',
         },
         'file': {
-            'class': 'logging.handlers.TimedRotatingFileHandler',
+            'class': 'loggingconf.BatchFileHandler',
             'encoding': 'utf-8',
             'level': 'DEBUG',
             'filename': 'logs/kochka.log',
@@ -40,7 +203,7 @@ config = {
             'formatter': 'default',
         },
         'audit': {
-            'class': 'logging.handlers.TimedRotatingFileHandler',
+            'class': 'loggingconf.BatchFileHandler',
             'encoding': 'utf-8',
             'level': 'INFO',
             'filename': 'logs/audit.log',
@@ -49,8 +212,18 @@ config = {
             'utc': True,
             'formatter': 'default',
         },
+        'metrics': {
+            'class': 'loggingconf.BatchFileHandler',
+            'encoding': 'utf-8',
+            'level': 'INFO',
+            'filename': 'logs/metrics.log',
+            'when': 'D',
+            'backupCount': 30,
+            'utc': True,
+            'formatter': 'message',
+        },
         'errors': {
-            'class': 'logging.handlers.TimedRotatingFileHandler',
+            'class': 'loggingconf.BatchFileHandler',
             'encoding': 'utf-8',
             'level': 'ERROR',
             'filename': 'logs/kochka-errors.log',
@@ -66,6 +239,7 @@ config = {
         # 'engineio': _logger_settings('WARNING'),
         'oslib': _logger_settings('INFO'),
         'kochka.audit': {'handlers': ['audit'], 'level': 'INFO', 'propagate': False},
+        'kochka.metrics': {'handlers': ['metrics'], 'level': 'INFO', 'propagate': False},
     },
     # root and other modules
     'root': {
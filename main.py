@@ -8,27 +8,43 @@ import sys
 import os
 import os.path
 import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import namedtuple, OrderedDict
 from functools import lru_cache
+from itertools import chain, islice
 import logging
-import logging.config
 
 from PyQt4 import QtGui, QtCore
 
 import design
-from kochkalib import Set, Exercise, ExerciseTxtParser, save_exercises_to_file
+from history import History, PersistentList, diff
+from kochkalib import Set, Exercise, ExerciseColumns, ExerciseIndex, \
+    record_key, diff_records
 import loggingconf
+from metrics import metrics, profiled
+from patterns import CoalescingEvent
+from storage import open_storage
 
 __version__ = '0.1'
 __author__ = 'Pavel Frolov'
 
-# todo: фильтр по упражнениям
 # todo: i18n
 # todo: icon
-# todo: threading for load and save data
 
 audit = logging.getLogger('kochka.audit')
 logger = logging.getLogger('kochka.app')
 
+# undo history snapshot: exercises added since loading and entered sets
+EditState = namedtuple('EditState', ['exercises', 'sets'])
+
+
+def call_soon(func):
+    """Calls the function on the next event loop tick"""
+    QtCore.QTimer.singleShot(0, func)
+
 
 @lru_cache()
 def replaced_webcolor(text, color):
@@ -42,6 +58,10 @@ class KochkaApp(QtGui.QMainWindow, design.Ui_MainWindow):
 
     # todo: change working dir to program dir
     data_filename = 'data.txt'
+    # worker processes to parse big data files, 1 is serial parsing
+    load_workers = 1
+    # undo steps
+    history_limit = 1000
 
     disabled_color = 'a9a9a9'
     enabled_color = '008000'
@@ -65,9 +85,28 @@ class KochkaApp(QtGui.QMainWindow, design.Ui_MainWindow):
             self.totalSetsWeightLcd.display)
 
         self.exerciseModel = ExerciseModel(self.exercisesTableView)
-        self.exercisesTableView.setModel(self.exerciseModel)
+        self.exerciseFilterModel = ExerciseFilterModel(self.exercisesTableView)
+        self.exerciseFilterModel.setSourceModel(self.exerciseModel)
+        self.exercisesTableView.setModel(self.exerciseFilterModel)
+
+        # .db file is kept in SQLite
+        self.storage = open_storage(self.data_filename,
+                                    workers=self.load_workers,
+                                    use_cache=True,
+                                    resync=True)
+        # load or save worker and its thread
+        self._worker = None
+        self._worker_thread = None
+        self._worker_started = None
+        # saving is not allowed while data is partially loaded
+        self._is_data_loaded = False
+        self._errors_dialog = None
 
         self._init_menu()
+        self._init_history()
+        self._init_filter()
+        self._init_progress()
+        self._init_watcher()
         self._app_init()
 
     @property
@@ -108,10 +147,129 @@ class KochkaApp(QtGui.QMainWindow, design.Ui_MainWindow):
         delete_action.triggered.connect(self.slot_setsTabel_deleteRow)
         self.sets_table_menu.addAction(delete_action)
 
+    def _init_history(self):
+        self.history = History(
+            EditState(PersistentList(), self.setModel.state),
+            self.history_limit)
+        undo_action = QtGui.QAction(QtGui.QIcon.fromTheme('edit-undo'),
+                                    'Отменить', self)
+        undo_action.setShortcut(QtGui.QKeySequence.Undo)
+        undo_action.triggered.connect(self.slot_undo)
+        self.addAction(undo_action)
+        self.undoAction = undo_action
+        redo_action = QtGui.QAction(QtGui.QIcon.fromTheme('edit-redo'),
+                                    'Повторить', self)
+        redo_action.setShortcut(QtGui.QKeySequence.Redo)
+        redo_action.triggered.connect(self.slot_redo)
+        self.addAction(redo_action)
+        self.redoAction = redo_action
+        self._update_history_actions()
+
+    def _reset_history(self, exercises=()):
+        """Starts the history again, the model is cleared or replaced"""
+        self.history.reset(EditState(PersistentList().extend(exercises),
+                                     self.setModel.state))
+        self._update_history_actions()
+
+    def _update_history_actions(self):
+        # models are not changed under load and save workers
+        is_idle = self._worker is None
+        self.undoAction.setEnabled(is_idle and self.history.can_undo())
+        self.redoAction.setEnabled(is_idle and self.history.can_redo())
+
+    def _remember_edit(self, exercise=None):
+        """Adds the current state to the undo history"""
+        exercises = self.history.current.exercises
+        if exercise is not None:
+            exercises = exercises.append(exercise)
+        self.history.push(EditState(exercises, self.setModel.state))
+        self._update_history_actions()
+
+    def slot_undo(self):
+        self._goto_edit(self.history.position - 1)
+
+    def slot_redo(self):
+        self._goto_edit(self.history.position + 1)
+
+    def _goto_edit(self, position):
+        # models are not changed under load and save workers
+        if self._worker is not None or \
+                not 0 <= position < len(self.history):
+            return
+        old = self.history.current
+        new = self.history.goto(position)
+        model = self.exerciseModel
+        size, exercises = diff(old.exercises, new.exercises)
+        # exercises of the history follow loaded ones
+        model.truncate(len(model.exercises) - len(old.exercises) + size)
+        model.addExercises(exercises)
+        self.setModel.restore(new.sets)
+        audit.info('history position: %d, exercises(-%d, +%d)', position,
+                   len(old.exercises) - size, len(exercises))
+        self.exercises_manually_chanded = model.is_saved_changed or \
+            len(model.exercises) > model.saved_count
+        self.sets_manually_changed = len(new.sets) > 0
+        self._update_history_actions()
+
+    def _init_filter(self):
+        self.filterName = QtGui.QComboBox(self.centralwidget)
+        self.filterName.setEditable(True)
+        self.filterName.addItem('')
+        self.filterName.addItems([self.exerciseName.itemText(i)
+                                  for i in range(self.exerciseName.count())])
+        self.filterName.lineEdit().setPlaceholderText('фильтр')
+        self.filterName.editTextChanged.connect(self.slot_filterName_changed)
+        self.horizontalLayout_4.insertWidget(1, self.filterName)
+        self.filterText = QtGui.QLineEdit(self.centralwidget)
+        self.filterText.setPlaceholderText('поиск: травм* OR болезнь')
+        self.filterText.textChanged.connect(self.slot_filterText_changed)
+        self.horizontalLayout_4.insertWidget(2, self.filterText)
+
+    def slot_filterName_changed(self, text):
+        self.exerciseFilterModel.set_filter(name=text or None)
+
+    def slot_filterText_changed(self, text):
+        self.exerciseFilterModel.set_filter(text=text.strip() or None)
+
+    def _init_progress(self):
+        self.loadProgress = QtGui.QProgressBar(self.centralwidget)
+        # busy indicator, count of exercises in the file is unknown
+        self.loadProgress.setRange(0, 0)
+        self.loadProgress.setMaximumWidth(150)
+        self.lblLoadProgress = QtGui.QLabel(self.centralwidget)
+        self.cancelLoadBtn = QtGui.QPushButton('Отменить', self.centralwidget)
+        self.cancelLoadBtn.clicked.connect(self.slot_cancelLoad_clicked)
+        for i, widget in enumerate([self.loadProgress, self.lblLoadProgress,
+                                    self.cancelLoadBtn]):
+            widget.hide()
+            self.horizontalLayout_3.insertWidget(i, widget)
+
+    def _init_watcher(self):
+        # the file is created by `_app_init` if there is no one
+        self.watcher = FileWatcher(self.storage.watched_files, self)
+        self.watcher.changed.connect(self.slot_dataFile_changed)
+        # a change while a worker runs is checked after it
+        self._is_file_changed = False
+
+    def slot_dataFile_changed(self):
+        if self._worker is not None:
+            self._is_file_changed = True
+            return
+        self._is_file_changed = False
+        # own saves are remembered by the storage
+        if not self._is_data_loaded or not self.storage.is_changed():
+            return
+        if self.exercises_manually_chanded:
+            logger.warning('data file is changed by others, not reloaded '
+                           'to keep unsaved exercises')
+            self.statusBar().showMessage(
+                'Файл данных изменён, сохраните или загрузите данные')
+            return
+        logger.info('data file is changed by others, reloading')
+        self._data_load()
+
     def _app_init(self):
-        if not os.path.exists(self.data_filename):
-            with open(self.data_filename, 'w'):
-                pass
+        self.storage.create()
         self._data_load()
 
     def closeEvent(self, event :QtGui.QCloseEvent):
@@ -119,6 +277,8 @@ class KochkaApp(QtGui.QMainWindow, design.Ui_MainWindow):
         if need_confirm and not self._confirmed("Несохраненные данные будут утеряны, все равно закрыть?"):
             event.ignore()
         else:
+            self._stop_worker()
+            self.storage.close()
             event.accept()
 
     def slot_setsTable_customContextMenuRequested(self, pos):
@@ -136,22 +296,60 @@ class KochkaApp(QtGui.QMainWindow, design.Ui_MainWindow):
         audit.info('removing %s set: %s', set_index, self.setModel.sets[set_index])
         self.setModel.removeSetByIndex(set_index)
         self.sets_manually_changed = True
+        self._remember_edit()
         
     def slot_loadData_clicked(self):
         need_confirm = self.sets_manually_changed or self.exercises_manually_chanded
         if need_confirm and not self._confirmed("Несохраненные данные будут утеряны, все равно загрузить?"):
             return
+        if self.exercises_manually_chanded or not self._is_data_loaded:
+            # model has exercises not from the file
+            self.storage.reset()
         self._data_load()
         self.exercises_manually_chanded = False
 
+    def slot_cancelLoad_clicked(self):
+        # called directly, event loop of the worker thread is busy
+        if isinstance(self._worker, DataLoadWorker):
+            self._worker.cancel()
+
     def slot_saveData_clicked(self):
-        save_exercises_to_file(
-            self.data_filename,
-            self.exerciseModel.exercises
+        model = self.exerciseModel
+        is_changed = self.storage.is_changed()
+        if is_changed and model.is_saved_changed and not self._confirmed(
+                'Файл данных изменён другими, их изменения будут утеряны, '
+                'все равно сохранить?'):
+            return
+        # the worker reads a snapshot, the model may be changed
+        exercises = model.exercises.copy()
+        worker = DataSaveWorker(
+            self.storage,
+            exercises,
+            len(exercises),
+            model.saved_count,
+            is_rewrite=model.is_saved_changed,
+            # new exercises are appended to changes of others
+            is_merge=is_changed and not model.is_saved_changed
         )
-        audit.info('data saved')
+        self._start_worker(worker, self.slot_dataSave_finished)
+
+    def slot_dataSave_finished(self):
+        worker = self._finish_worker()
+        metrics.record('app.save', worker.elapsed, records=worker.count,
+                       rewrite=worker.is_rewrite,
+                       failed=worker.error is not None)
+        if worker.error is not None:
+            self._show_error('Data is not saved: {}'.format(worker.error))
+            return
+        model = self.exerciseModel
+        model.saved_count = worker.count
+        model.is_saved_changed = False
         self.sets_manually_changed = False
         self.exercises_manually_chanded = False
+        if worker.is_merge:
+            logger.info('data file is changed by others, reloading merged')
+            self.storage.reset()
+            self._data_load()
 
     def slot_addSet_clicked(self):
         set_ = Set(
@@ -162,11 +360,13 @@ class KochkaApp(QtGui.QMainWindow, design.Ui_MainWindow):
         self.setModel.addSet(set_)
         audit.info('added set: %s', set_)
         self.sets_manually_changed = True
+        self._remember_edit()
 
     def slot_clearSet_clicked(self):
         self.setModel.clear()
         audit.info('sets cleared')
         self.sets_manually_changed = False
+        self._remember_edit()
 
     def _check_exercise(self) -> bool:
         if not self.exerciseName.currentText():
@@ -183,25 +383,126 @@ class KochkaApp(QtGui.QMainWindow, design.Ui_MainWindow):
         exercise = Exercise(
             self.exerciseDate.text(),
             self.exerciseName.currentText(),
-            sets=self.setModel.sets,
+            # the history keeps the exercise, sets are changed later
+            sets=list(self.setModel.sets),
             note=self.exerciseNote.text() or None
         )
         self.exerciseModel.addExercise(exercise)
         audit.info('added exercise: %s', exercise)
         self.exercises_manually_chanded = True
         self.sets_manually_changed = False
+        self._remember_edit(exercise)
 
     def _data_load(self):
         logger.info('data is loading...')
-        self.exerciseModel.clear()
-
-        parser = ExerciseTxtParser(self.data_filename)
-        parser.on_error.append(lambda e: self._show_error(e))
-
-        for exercise in parser:
-            self.exerciseModel.addExercise(exercise)
-        logger.info('data has been loaded: trainings(%d)',
-                    self.exerciseModel.rowCount())
+        self._is_data_loaded = False
+        # loaded rows are kept, a full reload changes differing rows only
+        worker = DataLoadWorker(
+            self.storage, is_diff=len(self.exerciseModel.exercises) > 0)
+        worker.batchLoaded.connect(self.slot_batchLoaded)
+        worker.reloaded.connect(self.slot_dataReloaded)
+        self._start_worker(worker, self.slot_dataLoad_finished)
+
+    def slot_batchLoaded(self, exercises, is_full):
+        if is_full:
+            self.exerciseModel.clear()
+            self._reset_history()
+        self.exerciseModel.addExercises(exercises)
+        self.lblLoadProgress.setText(
+            'загружено: {}'.format(len(self.exerciseModel.exercises)))
+        self._worker.batch_done()
+
+    def slot_dataReloaded(self, exercises, index, keys):
+        with metrics.span('app.update', records=len(exercises)) as fields:
+            fields['changes'] = self.exerciseModel.updateExercises(
+                exercises, index, keys)
+        self._reset_history()
+        self.lblLoadProgress.setText('загружено: {}'.format(len(exercises)))
+
+    def slot_dataLoad_finished(self):
+        worker = self._finish_worker()
+        model = self.exerciseModel
+        if worker.error is not None:
+            self._show_error('Data is not loaded: {}'.format(worker.error))
+        elif worker.is_cancelled:
+            logger.info('data loading is cancelled: trainings(%d)',
+                        len(model.exercises))
+        else:
+            self._is_data_loaded = True
+            count = len(model.exercises)
+            model.saved_count = count
+            logger.info('data has been loaded: trainings(%d), full(%s)',
+                        count, self.storage.is_full)
+        # edits before the load are not in the model, also a partial one
+        self._reset_history()
+        metrics.record('app.load', worker.elapsed,
+                       records=len(self.exerciseModel.exercises),
+                       errors=len(worker.parse_errors),
+                       cancelled=worker.is_cancelled,
+                       failed=worker.error is not None)
+        self.saveDataBtn.setEnabled(self._is_data_loaded)
+        if worker.parse_errors:
+            logger.warning('data has parse errors: errors(%d)',
+                           len(worker.parse_errors))
+            self._show_parse_errors(worker.parse_errors)
+
+    def _show_parse_errors(self, errors):
+        if self._errors_dialog is not None:
+            self._errors_dialog.close()
+        # not modal, loading is not stopped by the errors
+        self._errors_dialog = ParseErrorsDialog(self, errors)
+        self._errors_dialog.show()
+
+    def _start_worker(self, worker, on_finished):
+        """Runs the worker, `on_finished` is called after its thread"""
+        thread = QtCore.QThread(self)
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        # not queued to the GUI thread, which may wait for the thread
+        worker.finished.connect(thread.quit, QtCore.Qt.DirectConnection)
+        thread.finished.connect(on_finished)
+        self._worker = worker
+        self._worker_thread = thread
+        self._worker_started = time.perf_counter()
+        is_load = isinstance(worker, DataLoadWorker)
+        self.loadDataBtn.setEnabled(False)
+        self.saveDataBtn.setEnabled(False)
+        # exercises are not changed under workers
+        self.addExerciseBtn.setEnabled(False)
+        for widget in (self.loadProgress, self.lblLoadProgress,
+                       self.cancelLoadBtn):
+            widget.setVisible(is_load)
+        self.lblLoadProgress.setText('')
+        self._update_history_actions()
+        thread.start()
+
+    def _finish_worker(self):
+        worker = self._worker
+        self._worker_thread.wait()
+        # from the click to the end of the thread
+        worker.elapsed = time.perf_counter() - self._worker_started
+        self._worker = None
+        self._worker_thread = None
+        self.loadDataBtn.setEnabled(True)
+        self.saveDataBtn.setEnabled(True)
+        self.addExerciseBtn.setEnabled(True)
+        for widget in (self.loadProgress, self.lblLoadProgress,
+                       self.cancelLoadBtn):
+            widget.hide()
+        self._update_history_actions()
+        if self._is_file_changed:
+            call_soon(self.slot_dataFile_changed)
+        return worker
+
+    def _stop_worker(self):
+        """Cancels loading and waits for saving"""
+        if self._worker is None:
+            return
+        if isinstance(self._worker, DataLoadWorker):
+            self._worker.cancel()
+        # the app is closed, results are not needed
+        self._worker_thread.finished.disconnect()
+        self._worker_thread.wait()
 
     def _show_error(self, message):
         QtGui.QMessageBox(
@@ -240,31 +541,66 @@ class SetModel(QtCore.QAbstractTableModel):
         self.gui = parent
         self.colLabels = ['вес', 'раз', 'подходов', 'объём']
         self.sets = []
+        # the same sets for the undo history
+        self.state = PersistentList()
+        # running total, sets are not summed on every change
+        self.total_weight = 0
+        # listeners get only the last total of bulk changes
+        self.on_total_weight = CoalescingEvent(
+            [self.totalWeightChanged.emit], scheduler=call_soon)
 
     def addSet(self, set_):
-        # todo: implement insertRows
-        # http://doc.qt.io/qt-4.8/model-view-programming.html#inserting-and-removing-rows
-        self.beginResetModel()
-        self.sets.append(set_)
-        self.endResetModel()
-        self.totalWeightChanged.emit(self.calcTotalWeight())
+        self.insertSets(len(self.sets), [set_])
 
     def removeSetByIndex(self, index):
-        # todo: implement removeRow
+        self.removeRow(index)
+
+    def insertSets(self, row, sets):
         # http://doc.qt.io/qt-4.8/model-view-programming.html#inserting-and-removing-rows
-        self.beginResetModel()
-        del self.sets[index]
-        self.endResetModel()
-        self.totalWeightChanged.emit(self.calcTotalWeight())
+        if not sets or not 0 <= row <= len(self.sets):
+            return False
+        self.beginInsertRows(QtCore.QModelIndex(), row, row + len(sets) - 1)
+        self.sets[row:row] = sets
+        self.state = self.state.replace(row, row, sets)
+        self.total_weight += sum(s.total_weight for s in sets)
+        self.endInsertRows()
+        self.on_total_weight(self.total_weight)
+        return True
+
+    def insertRows(self, row, count, parent=None, **kwargs):
+        """Inserts empty sets"""
+        return self.insertSets(row, [Set(0, 0) for _ in range(count)])
+
+    def removeRows(self, row, count, parent=None, **kwargs):
+        if count <= 0 or row < 0 or row + count > len(self.sets):
+            return False
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row + count - 1)
+        self.total_weight -= sum(s.total_weight
+                                 for s in self.sets[row:row + count])
+        del self.sets[row:row + count]
+        self.state = self.state.replace(row, row + count)
+        self.endRemoveRows()
+        self.on_total_weight(self.total_weight)
+        return True
 
     def calcTotalWeight(self):
-        return sum(s.total_weight for s in self.sets)
+        return self.total_weight
+
+    def restore(self, state: PersistentList):
+        """Changes sets to the history state, only differing rows"""
+        size, sets = diff(self.state, state)
+        self.removeRows(size, len(self.sets) - size)
+        self.insertSets(size, sets)
+        # shared with the history, later diffs are short
+        self.state = state
 
     def clear(self):
         self.beginResetModel()
         self.sets = []
+        self.state = PersistentList()
+        self.total_weight = 0
         self.endResetModel()
-        self.totalWeightChanged.emit(0)
+        self.on_total_weight(0)
 
     def rowCount(self, parent=None, **kwargs):
         return len(self.sets)
@@ -293,26 +629,155 @@ class SetModel(QtCore.QAbstractTableModel):
 
 
 class ExerciseModel(QtCore.QAbstractTableModel):
-    """Model for Exercise TableView"""
+    """
+    Model for Exercise TableView
+
+    Rows are shown to a view by `fetchMore` while it is scrolled, a big
+    list of exercises is not laid out at once.
+    """
+
+    # exercises are added, also to rows which are not fetched yet
+    exercisesAdded = QtCore.pyqtSignal()
+    # exercises are removed or replaced, also in rows not fetched yet
+    exercisesChanged = QtCore.pyqtSignal()
+
+    fetch_size = 1000
+    # LRU rows of display values, rows are not changed after adding
+    display_cache_size = 4096
 
     def __init__(self, parent):
         QtCore.QAbstractTableModel.__init__(self)
         self.gui = parent
         self.colLabels = ['дата', 'название', 'резюме', 'объём']
-        self.exercises = []
+        self.exercises = ExerciseColumns()
+        self.exercise_index = ExerciseIndex()
+        # `record_key`s of exercises to diff them with reloaded ones
+        self.exercise_keys = array('q')
+        # exercises which are in the data file, the rest are new
+        self.saved_count = 0
+        # saved exercises were edited or removed, file is to be rewritten
+        self.is_saved_changed = False
+        self._fetched_count = 0
+        self._display_cache = OrderedDict()
+        # [old exercises, x, y] while rows are updated: rows before x are
+        # old ones, rows from x are new ones from y
+        self._splice = None
+        # filtered views are updated once for batches added in a tick
+        self.on_exercises_added = CoalescingEvent(
+            [self.exercisesAdded.emit], scheduler=call_soon)
 
     def addExercise(self, exercise):
-        self.beginResetModel()
-        self.exercises.append(exercise)
-        self.endResetModel()
+        self.addExercises([exercise])
+
+    def addExercises(self, exercises):
+        is_all_fetched = self._fetched_count == len(self.exercises)
+        for exercise in exercises:
+            self.exercises.append(exercise)
+            self.exercise_index.add(exercise)
+            self.exercise_keys.append(record_key(exercise))
+        # the rest of rows are fetched by the view while scrolling
+        if is_all_fetched:
+            self.fetchMore()
+        self.on_exercises_added()
+
+    def truncate(self, count):
+        """Removes exercises from `count` to the end, e.g. by undo"""
+        if count >= len(self.exercises):
+            return
+        is_fetched = count < self._fetched_count
+        if is_fetched:
+            self.beginRemoveRows(QtCore.QModelIndex(), count,
+                                 self._fetched_count - 1)
+        self.exercises.truncate(count)
+        self.exercise_index.truncate(count)
+        del self.exercise_keys[count:]
+        self._fetched_count = min(self._fetched_count, count)
+        self._display_cache = OrderedDict()
+        if count < self.saved_count:
+            # the data file is to be rewritten without them
+            self.saved_count = count
+            self.is_saved_changed = True
+        if is_fetched:
+            self.endRemoveRows()
+        # filtered views do not follow removed rows
+        self.exercisesChanged.emit()
+
+    def updateExercises(self, exercises, index, keys) -> int:
+        """
+        Replaces exercises by reloaded ones changing differing rows only
+
+        Rows of the same records stay, so views keep the selection and
+        the scroll position. Returns the number of changes.
+        """
+        changes = diff_records(self.exercise_keys, keys)
+        old = self.exercises
+        self.exercises = exercises
+        self.exercise_index = index
+        self.exercise_keys = keys
+        self.saved_count = len(exercises)
+        self.is_saved_changed = False
+        self._display_cache = OrderedDict()
+        # views read rows of both lists as they are after every signal
+        splice = self._splice = [old, len(old), len(exercises)]
+        root = QtCore.QModelIndex()
+        try:
+            # from the end, rows before a change are the same in both lists
+            for tag, i1, i2, j1, j2 in reversed(changes):
+                if i1 >= self._fetched_count:
+                    # rows are not shown yet
+                    splice[1:] = i1, j1
+                    continue
+                if tag == 'replace' and i2 - i1 == j2 - j1:
+                    splice[1:] = i1, j1
+                    last = min(i2, self._fetched_count) - 1
+                    self.dataChanged.emit(self.index(i1, 0), self.index(
+                        last, self.columnCount() - 1))
+                    continue
+                removed = min(i2, self._fetched_count) - i1
+                if removed:
+                    self.beginRemoveRows(root, i1, i1 + removed - 1)
+                    self._fetched_count -= removed
+                    splice[1:] = i1, j2
+                    self.endRemoveRows()
+                if j2 > j1:
+                    self.beginInsertRows(root, i1, i1 + j2 - j1 - 1)
+                    self._fetched_count += j2 - j1
+                    splice[1:] = i1, j1
+                    self.endInsertRows()
+        finally:
+            self._splice = None
+            self._display_cache = OrderedDict()
+        self.exercisesChanged.emit()
+        return len(changes)
 
     def clear(self):
         self.beginResetModel()
-        self.exercises = []
+        self.exercises = ExerciseColumns()
+        self.exercise_index = ExerciseIndex()
+        self.exercise_keys = array('q')
+        self.saved_count = 0
+        self.is_saved_changed = False
+        self._fetched_count = 0
+        self._display_cache = OrderedDict()
         self.endResetModel()
 
+    def canFetchMore(self, parent=None, **kwargs):
+        return self._fetched_count < len(self.exercises)
+
+    def fetchMore(self, parent=None, **kwargs):
+        count = min(self.fetch_size,
+                    len(self.exercises) - self._fetched_count)
+        if count <= 0:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), self._fetched_count,
+                             self._fetched_count + count - 1)
+        self._fetched_count += count
+        self.endInsertRows()
+
     def rowCount(self, parent=None, **kwargs):
-        return len(self.exercises)
+        if parent is not None and parent.isValid():
+            return 0
+        return self._fetched_count
 
     def columnCount(self, parent=None, **kwargs):
         return len(self.colLabels)
@@ -320,21 +785,47 @@ class ExerciseModel(QtCore.QAbstractTableModel):
     def data(self, index, role):
         if not index.isValid():
             return None
-        elif role != QtCore.Qt.DisplayRole and role != QtCore.Qt.EditRole:
+        return self.exerciseData(index.row(), index.column(), role)
+
+    def exerciseData(self, row, col, role):
+        """Data of any exercise, also of not fetched rows"""
+        if role != QtCore.Qt.DisplayRole and role != QtCore.Qt.EditRole:
             return None
         if role == QtCore.Qt.DisplayRole:
-            exercise = self.exercises[index.row()]
-            col = index.column()
-            if col == 1:
-                return exercise.name_with_note
-            elif col == 2:
-                return exercise.sets_str
-            elif col == 3:
-                return exercise.total_weight
-            else:
-                return getattr(exercise, Exercise.ATTRS[col])
+            return self._displayRow(row)[col]
         return ''
 
+    def _displayRow(self, row):
+        """Display values of all columns, they are cached"""
+        values = self._display_cache.get(row)
+        if values is not None:
+            self._display_cache.move_to_end(row)
+            return values
+        exercises, exercise_row = self._locate(row)
+        # sets are read from the columns, views of sets are not made
+        values = (
+            exercises.date_at(exercise_row),
+            exercises[exercise_row].name_with_note,
+            exercises.sets_str_at(exercise_row),
+            exercises.total_weight_at(exercise_row)
+        )
+        if self.display_cache_size and self._splice is None:
+            self._display_cache[row] = values
+            if len(self._display_cache) > self.display_cache_size:
+                # least recently shown, rows are scrolled away
+                self._display_cache.popitem(last=False)
+        return values
+
+    def _locate(self, row):
+        """Exercises list and its row shown at the row"""
+        splice = self._splice
+        if splice is None:
+            return self.exercises, row
+        old, x, y = splice
+        if row < x:
+            return old, row
+        return self.exercises, row - x + y
+
     def headerData(self, section, orientation, role):
         header_cond = (orientation == QtCore.Qt.Horizontal and
                        role == QtCore.Qt.DisplayRole)
@@ -343,10 +834,368 @@ class ExerciseModel(QtCore.QAbstractTableModel):
         return None
 
 
+class FileWatcher(QtCore.QObject):
+    """
+    Signals changes of files made by other programs
+
+    `QFileSystemWatcher` watches files and their directories, editors
+    often replace a file by renaming. Files are also polled by `stat`
+    for file systems without notifications. Changes within `delay` ms
+    are signaled once, when size or mtime of a file is changed.
+    """
+
+    changed = QtCore.pyqtSignal()
+
+    delay = 300
+    poll_interval = 2000
+
+    def __init__(self, filenames, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.filenames = [os.path.abspath(filename) for filename in filenames]
+        self._stat = self._stats()
+        self._delay_timer = QtCore.QTimer(self)
+        self._delay_timer.setSingleShot(True)
+        self._delay_timer.setInterval(self.delay)
+        self._delay_timer.timeout.connect(self.slot_check)
+        self._watcher = QtCore.QFileSystemWatcher(self)
+        self._watcher.fileChanged.connect(self.slot_changed)
+        self._watcher.directoryChanged.connect(self.slot_changed)
+        self._watch()
+        self._poll_timer = QtCore.QTimer(self)
+        self._poll_timer.setInterval(self.poll_interval)
+        self._poll_timer.timeout.connect(self.slot_check)
+        self._poll_timer.start()
+
+    def _watch(self):
+        # a replaced or created file is not watched yet
+        watched = self._watcher.files() + self._watcher.directories()
+        for filename in self.filenames:
+            for path in (filename, os.path.dirname(filename)):
+                if os.path.exists(path) and path not in watched:
+                    self._watcher.addPath(path)
+                    watched.append(path)
+
+    def slot_changed(self, path):
+        self._delay_timer.start()
+
+    def slot_check(self):
+        self._watch()
+        stat = self._stats()
+        if stat != self._stat:
+            self._stat = stat
+            self.changed.emit()
+
+    def _stats(self) -> list:
+        return [_file_stat(filename) for filename in self.filenames]
+
+
+def _file_stat(filename):
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class DataLoadWorker(QtCore.QObject):
+    """
+    Loads exercises in a thread
+
+    Exercises are sent by batches, the next batch waits while previous
+    ones are not added to the model, so the GUI event loop is not flooded.
+    """
+
+    # exercises, previous exercises have to be removed
+    batchLoaded = QtCore.pyqtSignal(object, bool)
+    # columns, index and keys of all exercises of a full load
+    reloaded = QtCore.pyqtSignal(object, object, object)
+    finished = QtCore.pyqtSignal()
+
+    batch_size = 2000
+    # batches sent but not added to the model yet
+    max_pending = 2
+
+    def __init__(self, storage, is_diff=False):
+        QtCore.QObject.__init__(self)
+        self.storage = storage
+        # a full load is sent by `reloaded` to diff it with the model
+        self.is_diff = is_diff
+        self.is_cancelled = False
+        self.error = None
+        # seconds from the start to the end, set by the app
+        self.elapsed = None
+        # ParseError list, it is read when the worker is finished
+        self.parse_errors = []
+        self._pending = threading.Semaphore(self.max_pending)
+
+    def cancel(self):
+        self.is_cancelled = True
+        # wakes up the worker waiting for the model
+        self._pending.release()
+
+    def batch_done(self):
+        self._pending.release()
+
+    def run(self):
+        on_error = self.parse_errors.append
+        self.storage.on_parse_error.append(on_error)
+        exercises = self.storage.iter_load()
+        try:
+            is_first = True
+            while not self.is_cancelled:
+                # `is_full` is known after the first exercise is taken
+                batch = list(islice(exercises, self.batch_size))
+                if not batch and not is_first:
+                    break
+                if is_first and self.is_diff and self.storage.is_full:
+                    self._reload(chain(batch, exercises))
+                    break
+                self._pending.acquire()
+                if self.is_cancelled:
+                    break
+                self.batchLoaded.emit(batch, is_first and self.storage.is_full)
+                is_first = False
+                if len(batch) < self.batch_size:
+                    break
+        except Exception as e:
+            logger.exception('data is not loaded')
+            self.error = str(e)
+        finally:
+            # the storage is reset if loading is not finished
+            exercises.close()
+            self.storage.on_parse_error.remove(on_error)
+            self.finished.emit()
+
+    def _reload(self, exercises):
+        """Builds model data in the thread, the model only swaps it"""
+        columns = ExerciseColumns()
+        index = ExerciseIndex()
+        keys = array('q')
+        for exercise in exercises:
+            if self.is_cancelled:
+                return
+            columns.append(exercise)
+            index.add(exercise)
+            keys.append(record_key(exercise))
+        self.reloaded.emit(columns, index, keys)
+
+
+class DataSaveWorker(QtCore.QObject):
+    """
+    Saves exercises in a thread
+
+    Only first `count` exercises are saved, `exercises` is a snapshot
+    which is not changed by the app while saving. Without a rewrite new
+    exercises are appended, also to a storage changed by others.
+    """
+
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, storage, exercises, count, saved_count, is_rewrite,
+                 is_merge=False):
+        QtCore.QObject.__init__(self)
+        self.storage = storage
+        self.exercises = exercises
+        self.count = count
+        self.saved_count = saved_count
+        self.is_rewrite = is_rewrite
+        # the storage is changed by others, it is reloaded after appending
+        self.is_merge = is_merge
+        self.error = None
+        self.elapsed = None
+
+    def run(self):
+        try:
+            if self.is_rewrite:
+                self.storage.save(self.exercises[:self.count])
+                audit.info('data saved')
+            else:
+                new_exercises = self.exercises[self.saved_count:self.count]
+                self.storage.append(new_exercises)
+                audit.info('data appended: exercises(%d)', len(new_exercises))
+        except Exception as e:
+            logger.exception('data is not saved')
+            self.error = str(e)
+        finally:
+            self.finished.emit()
+
+
+class ParseErrorsDialog(QtGui.QDialog):
+    """Summary of data file parse errors"""
+
+    max_rows = 1000
+
+    def __init__(self, parent, errors):
+        QtGui.QDialog.__init__(self, parent)
+        self.setWindowTitle('Ошибки в данных')
+        self.resize(700, 400)
+        layout = QtGui.QVBoxLayout(self)
+
+        label = QtGui.QLabel(
+            'Ошибок: {}, записи с ошибками не загружены'.format(len(errors)),
+            self)
+        layout.addWidget(label)
+
+        shown = errors[:self.max_rows]
+        table = QtGui.QTableWidget(len(shown), 4, self)
+        table.setHorizontalHeaderLabels(
+            ['строка', 'состояние', 'причина', 'текст'])
+        table.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+        table.horizontalHeader().setStretchLastSection(True)
+        for row, error in enumerate(shown):
+            values = [error.lineno, error.state.name, error.reason, error.line]
+            for col, value in enumerate(values):
+                table.setItem(row, col, QtGui.QTableWidgetItem(str(value)))
+        layout.addWidget(table)
+
+        buttons = QtGui.QDialogButtonBox(QtGui.QDialogButtonBox.Close,
+                                         parent=self)
+        buttons.rejected.connect(self.close)
+        layout.addWidget(buttons)
+
+
+class ExerciseFilterModel(QtGui.QAbstractProxyModel):
+    """
+    Filtered rows of ExerciseModel
+
+    Rows are taken from `ExerciseModel.exercise_index`, exercises are not
+    copied.
+    """
+
+    def __init__(self, parent):
+        QtGui.QAbstractProxyModel.__init__(self)
+        self.gui = parent
+        self.filter_kwargs = {}
+        # source rows, None is for all rows
+        self.rows = None
+
+    def setSourceModel(self, model):
+        QtGui.QAbstractProxyModel.setSourceModel(self, model)
+        model.modelReset.connect(self.refilter)
+        model.rowsAboutToBeInserted.connect(
+            self.slot_source_rowsAboutToBeInserted)
+        model.rowsInserted.connect(self.slot_source_rowsInserted)
+        model.rowsAboutToBeRemoved.connect(
+            self.slot_source_rowsAboutToBeRemoved)
+        model.rowsRemoved.connect(self.slot_source_rowsRemoved)
+        model.dataChanged.connect(self.slot_source_dataChanged)
+        model.exercisesAdded.connect(self.slot_source_exercisesChanged)
+        model.exercisesChanged.connect(self.slot_source_exercisesChanged)
+
+    def slot_source_rowsAboutToBeInserted(self, parent, first, last):
+        if self.rows is None:
+            self.beginInsertRows(QtCore.QModelIndex(), first, last)
+
+    def slot_source_rowsInserted(self, parent, first, last):
+        if self.rows is None:
+            self.endInsertRows()
+
+    def slot_source_rowsAboutToBeRemoved(self, parent, first, last):
+        if self.rows is None:
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+
+    def slot_source_rowsRemoved(self, parent, first, last):
+        if self.rows is None:
+            self.endRemoveRows()
+
+    def slot_source_dataChanged(self, top_left, bottom_right):
+        if self.rows is None:
+            self.dataChanged.emit(
+                self.index(top_left.row(), top_left.column()),
+                self.index(bottom_right.row(), bottom_right.column()))
+
+    def slot_source_exercisesChanged(self):
+        # all rows are shown by source rows, their changes are signaled
+        if self.rows is not None:
+            self.refilter()
+
+    def set_filter(self, **filters):
+        """
+        Changes given filters of `ExerciseIndex.filter`, None removes one
+
+        >>> model.set_filter(name='жим', text='травм*')
+        """
+        self.filter_kwargs.update(filters)
+        self.refilter()
+
+    def refilter(self, *args):
+        kwargs = {k: v for k, v in self.filter_kwargs.items()
+                  if v is not None}
+        self.beginResetModel()
+        self.rows = self.sourceModel().exercise_index.filter(**kwargs) \
+            if kwargs else None
+        self.endResetModel()
+
+    def rowCount(self, parent=None, **kwargs):
+        if parent is not None and parent.isValid():
+            return 0
+        if self.rows is None:
+            return self.sourceModel().rowCount()
+        return len(self.rows)
+
+    def columnCount(self, parent=None, **kwargs):
+        return self.sourceModel().columnCount()
+
+    def canFetchMore(self, parent=None, **kwargs):
+        return self.rows is None and self.sourceModel().canFetchMore()
+
+    def fetchMore(self, parent=None, **kwargs):
+        if self.rows is None:
+            self.sourceModel().fetchMore()
+
+    def data(self, index, role):
+        if not index.isValid():
+            return None
+        row = index.row() if self.rows is None else self.rows[index.row()]
+        return self.sourceModel().exerciseData(row, index.column(), role)
+
+    def index(self, row, column, parent=None, **kwargs):
+        if (parent is not None and parent.isValid()) or \
+                not 0 <= row < self.rowCount() or \
+                not 0 <= column < self.columnCount():
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index):
+        return QtCore.QModelIndex()
+
+    def mapToSource(self, index):
+        if not index.isValid():
+            return QtCore.QModelIndex()
+        row = index.row() if self.rows is None else self.rows[index.row()]
+        return self.sourceModel().index(row, index.column())
+
+    def mapFromSource(self, index):
+        if not index.isValid():
+            return QtCore.QModelIndex()
+        row = index.row()
+        if self.rows is not None:
+            # rows are ascending
+            pos = bisect_left(self.rows, row)
+            if pos == len(self.rows) or self.rows[pos] != row:
+                return QtCore.QModelIndex()
+            row = pos
+        return self.index(row, index.column())
+
+    def headerData(self, section, orientation, role):
+        if orientation == QtCore.Qt.Horizontal:
+            return self.sourceModel().headerData(section, orientation, role)
+        return QtGui.QAbstractProxyModel.headerData(
+            self, section, orientation, role)
+
+
 def main():
     os.makedirs('logs', exist_ok=True)
-    logging.config.dictConfig(loggingconf.config)
+    # handlers are called on the listener thread
+    listener = loggingconf.configure()
+    try:
+        _main()
+    finally:
+        # queued records are written before the exit
+        listener.stop()
+
 
+def _main():
     logger.info('app started')
 
     # # uncoment to remove
@@ -355,11 +1204,21 @@ def main():
     # from PyQt4.QtCore import pyqtRemoveInputHook
     # pyqtRemoveInputHook()
 
+    if '--profile' in sys.argv:
+        # reports are written to logs/profile* when the app is closed
+        with profiled(os.path.join('logs', 'profile')):
+            run_app()
+    else:
+        run_app()
+    metrics.log_summary()
+    logger.info('app stopped')
+
+
+def run_app():
     app = QtGui.QApplication(sys.argv)
     form = KochkaApp()
     form.show()
     app.exec_()
-    logger.info('app stopped')
 
 
 if __name__ == '__main__':
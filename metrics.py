@@ -0,0 +1,171 @@
+"""
+Timing instrumentation
+
+Spans and counters are written to `kochka.metrics` logger as JSON lines,
+latencies of spans are kept to report p50/p99 by `log_summary`.
+
+>>> with metrics.span('save', records=len(exercises)):
+...     save()
+>>> metrics.count('parse.errors')
+>>> metrics.log_summary()
+
+Copyright 2017 Pavel Folov
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger('kochka.metrics')
+
+
+class Histogram:
+    """Latencies of the last `size` calls"""
+
+    __slots__ = ['samples', 'calls', 'total']
+
+    def __init__(self, size=1024):
+        self.samples = deque(maxlen=size)
+        self.calls = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.calls += 1
+        self.total += seconds
+
+    def percentile(self, percent) -> float:
+        """Nearest rank percentile of kept samples"""
+        if not self.samples:
+            return 0.0
+        samples = sorted(self.samples)
+        rank = max(0, -(-len(samples) * percent // 100) - 1)
+        return samples[int(rank)]
+
+    def summary(self) -> dict:
+        return {
+            'calls': self.calls,
+            'total_ms': self.total * 1000,
+            'p50_ms': self.percentile(50) * 1000,
+            'p99_ms': self.percentile(99) * 1000,
+            'max_ms': max(self.samples, default=0.0) * 1000,
+        }
+
+
+class Metrics:
+    """Spans with latency histograms and counters, thread safe"""
+
+    def __init__(self, logger=logger):
+        self.logger = logger
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **fields):
+        """Times the block, `fields` are logged with the time"""
+        started = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            self.record(name, time.perf_counter() - started, **fields)
+
+    def record(self, name, seconds, **fields):
+        """Adds a measured time of span `name`"""
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(seconds)
+        self.log('span', name=name, ms=seconds * 1000, **fields)
+
+    def iter_span(self, name, iterable, **fields):
+        """
+        Yields items of iterable timing only the time to get them
+
+        The time of the consumer between items is not counted, number of
+        items is logged as `records`.
+        """
+        iterator = iter(iterable)
+        elapsed = 0.0
+        records = 0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - started
+                records += 1
+                yield item
+        finally:
+            # a generator is closed at once when the iteration is stopped
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+            self.count(name + '.records', records)
+            self.record(name, elapsed, records=records, **fields)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def log(self, type_, **fields):
+        # json is not built if nobody listens
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(json.dumps(
+                dict(type=type_, time=time.time(), **fields),
+                ensure_ascii=False))
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                'spans': {name: histogram.summary()
+                          for name, histogram in self.histograms.items()},
+                'counters': dict(self.counters),
+            }
+
+    def log_summary(self):
+        self.log('summary', **self.summary())
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def profiled(prefix):
+    """
+    Profiles the block by cProfile and tracemalloc
+
+    Writes `<prefix>.pstats` for pstats/snakeviz, the top of cumulative
+    time to `<prefix>-cpu.txt` and the top of allocations by line to
+    `<prefix>-memory.txt`.
+    """
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    tracemalloc.start()
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        profile.dump_stats(prefix + '.pstats')
+        with open(prefix + '-cpu.txt', 'w') as f:
+            pstats.Stats(profile, stream=f).sort_stats('cumulative') \
+                .print_stats(50)
+        with open(prefix + '-memory.txt', 'w') as f:
+            f.write('peak: {:.1f} MB\n'.format(peak / 2 ** 20))
+            for stat in snapshot.statistics('lineno')[:50]:
+                f.write('{}\n'.format(stat))
+        metrics.log('profile', prefix=prefix, peak_mb=peak / 2 ** 20)
@@ -4,30 +4,219 @@ OS functions
 Copyright 2017 Pavel Folov
 """
 
-import shutil
+import hashlib
+import os
+import re
+import zlib
 import logging
 
+from metrics import metrics
+
 logger = logging.getLogger(__name__)
 
+
+class BackupStore:
+    """Generations of a file stored by content defined chunks.
+
+    A file is cut into chunks at blank lines where a checksum of the text
+    before the line matches a mask, so cuts do not move when text is
+    inserted or appended before them. Chunks are stored by hash, a new
+    generation writes only chunks which are not stored yet.
+
+    >>> store = BackupStore('data.txt.backups', keep=10)
+    >>> generation = store.backup('data.txt')
+    >>> store.restore('data.txt', generation)
+    """
+
+    boundary_pattern = re.compile(rb'\n\n')
+    # a boundary is a cut with probability of 1/64
+    boundary_mask = 0x3f
+    boundary_window = 64
+    min_chunk_size = 2 * 1024
+    max_chunk_size = 256 * 1024
+
+    def __init__(self, path, keep=10):
+        self.path = path
+        self.keep = keep
+        self.chunks_path = os.path.join(path, 'chunks')
+        self.generations_path = os.path.join(path, 'generations')
+
+    def generations(self) -> list:
+        """Stored generations, the oldest first"""
+        try:
+            names = os.listdir(self.generations_path)
+        except FileNotFoundError:
+            return []
+        return sorted(int(name) for name in names if name.isdigit())
+
+    def backup(self, filepath) -> int:
+        """Stores the file as a new generation, returns the generation
+
+        Chunks of the last generation are reused for the unchanged head of
+        the file, so only the changed tail is chunked and hashed. The head
+        is checked by crc32 which is stored for every chunk boundary.
+        """
+        with metrics.span('backup') as fields:
+            with open(filepath, 'rb') as f:
+                data = f.read()
+            generations = self.generations()
+            entries = []
+            if generations:
+                entries = self._unchanged(
+                    self._manifest(generations[-1]), data)
+            start = entries[-1][1] if entries else 0
+            checksum = entries[-1][2] if entries else 0
+            written = 0
+            for chunk in self.chunks(data, start):
+                digest = hashlib.sha256(chunk).hexdigest()
+                start += len(chunk)
+                checksum = zlib.crc32(chunk, checksum)
+                entries.append((digest, start, checksum))
+                chunk_path = self._chunk_path(digest)
+                if not os.path.exists(chunk_path):
+                    os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+                    write_atomic(chunk_path, chunk)
+                    written += len(chunk)
+            generation = generations[-1] + 1 if generations else 1
+            os.makedirs(self.generations_path, exist_ok=True)
+            write_atomic(self._generation_path(generation), ''.join(
+                '{} {} {}\n'.format(*entry) for entry in entries).encode())
+            fields.update(bytes=len(data), written=written)
+        logger.info('backup generation(%d) of %s: size(%d), written(%d)',
+                    generation, filepath, len(data), written)
+        self.prune()
+        return generation
+
+    def restore(self, filepath, generation=None):
+        """Replaces the file by the generation, the last one by default"""
+        if generation is None:
+            generation = self.generations()[-1]
+        with metrics.span('restore', generation=generation):
+            chunks = []
+            for digest, _, _ in self._manifest(generation):
+                with open(self._chunk_path(digest), 'rb') as f:
+                    chunks.append(f.read())
+            write_atomic(filepath, b''.join(chunks))
+        logger.info('restored generation(%d) to %s', generation, filepath)
+
+    def prune(self):
+        """Removes generations over `keep` and chunks not used by others
+
+        Only chunks of the removed generations are checked, so the chunk
+        store is not walked.
+        """
+        generations = self.generations()
+        if self.keep is None or len(generations) <= self.keep:
+            return
+        dropped = set()
+        for generation in generations[:-self.keep]:
+            dropped.update(digest for digest, _, _ in
+                           self._manifest(generation))
+            os.remove(self._generation_path(generation))
+        for generation in generations[-self.keep:]:
+            dropped.difference_update(digest for digest, _, _ in
+                                      self._manifest(generation))
+        for digest in dropped:
+            try:
+                os.remove(self._chunk_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def chunks(self, data: bytes, start=0):
+        """Cuts data from the `start` chunk boundary into chunks"""
+        window = self.boundary_window
+        for match in self.boundary_pattern.finditer(data, start):
+            stop = match.end()
+            size = stop - start
+            if size < self.min_chunk_size:
+                continue
+            is_boundary = not zlib.crc32(
+                data[stop - window:stop]) & self.boundary_mask
+            if is_boundary:
+                yield from self._limited(data, start, stop)
+                start = stop
+        yield from self._limited(data, start, len(data))
+
+    def _manifest(self, generation) -> list:
+        """Chunks of the generation as (digest, stop, crc32 up to stop)
+
+        Generations stored before stops were kept have `None` for both.
+        """
+        with open(self._generation_path(generation), 'rb') as f:
+            lines = f.read().decode().splitlines()
+        entries = []
+        for line in lines:
+            fields = line.split()
+            if len(fields) == 3:
+                entries.append((fields[0], int(fields[1]), int(fields[2])))
+            elif fields:
+                entries.append((fields[0], None, None))
+        return entries
+
+    def _unchanged(self, entries, data) -> list:
+        """Leading entries whose chunks are the same in the data
+
+        The last chunk is cut by the end of the file, not by a boundary,
+        so it is cut again with the appended data.
+        """
+        entries = entries[:-1]
+        while entries and entries[-1][1] is not None:
+            _, stop, checksum = entries[-1]
+            if stop <= len(data) and \
+                    zlib.crc32(memoryview(data)[:stop]) == checksum:
+                return entries
+            # the file is changed inside, look for an earlier boundary
+            entries = entries[:len(entries) // 2]
+        return []
+
+    def _limited(self, data, start, stop):
+        """Cuts the range by max chunk size"""
+        while stop - start > self.max_chunk_size:
+            yield data[start:start + self.max_chunk_size]
+            start += self.max_chunk_size
+        if stop > start:
+            yield data[start:stop]
+
+    def _chunk_path(self, digest):
+        return os.path.join(self.chunks_path, digest[:2], digest)
+
+    def _generation_path(self, generation):
+        return os.path.join(self.generations_path, '{:08d}'.format(generation))
+
+
+def write_atomic(filepath, data: bytes):
+    """Writes the file by replacing it with a written temporary file"""
+    tmp_filepath = filepath + '.tmp'
+    with open(tmp_filepath, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filepath, filepath)
+
+
 class filebackup:
     """Backups a file while needs to rewrite the file.
 
-    Returns file back if something wrong happened.
-    Backup file will be replaced if exists.
+    Returns file back if something wrong happened. Backups are kept as
+    `keep` generations in `BackupStore` at `bak_filepath`.
 
     >>> with filebackup('1.txt') as sb:
-    >>>     print(sb.filepath, sb.bak_filepath)
+    >>>     print(sb.filepath, sb.bak_filepath, sb.generation)
     >>>     # write new file
     """
-    # todo: integrate backup scheme
-    def __init__(self, filepath, ext='.bak'):
+    def __init__(self, filepath, ext='.backups', keep=10):
         self.filepath = filepath
         self.bak_ext = ext
         self.bak_filepath = None
+        self.keep = keep
+        self.store = None
+        self.generation = None
 
     def __enter__(self):
         self.bak_filepath = self.filepath + self.bak_ext
-        shutil.move(self.filepath, self.bak_filepath)
+        self.store = BackupStore(self.bak_filepath, self.keep)
+        if os.path.exists(self.filepath):
+            self.generation = self.store.backup(self.filepath)
         logger.info('created backup from: %s, to: %s', self.filepath, self.bak_filepath)
         return self
 
@@ -36,5 +225,8 @@ class filebackup:
             logger.info('successful done')
             return
         logger.exception(exc_val)
-        # todo: os.remove(self.filepath)
-        shutil.move(self.bak_filepath, self.filepath)
+        if self.generation is None:
+            if os.path.exists(self.filepath):
+                os.remove(self.filepath)
+        else:
+            self.store.restore(self.filepath, self.generation)
@@ -2,6 +2,10 @@
 Patterns
 """
 
+import weakref
+from contextlib import contextmanager
+from types import MethodType
+
 
 # from https://stackoverflow.com/a/2022629
 class Event(list):
@@ -30,10 +34,144 @@ class Event(list):
     >>> e(2)
     g(2)
 
+    Calls inside `batch` are merged, only the last one is delivered when
+    the batch is finished:
+    >>> with e.batch():
+    ...     e(1)
+    ...     e(2)
+    g(2)
+
+    Subscribers added by `append_weak` are removed when they are deleted.
     """
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._suspended = 0
+        # args and kwargs of the last call held back
+        self._pending = None
+
     def __call__(self, *args, **kwargs):
+        if self._suspended:
+            self._pending = (args, kwargs)
+            return
+        self._fire(args, kwargs)
+
+    def _fire(self, args, kwargs):
         for f in self:
             f(*args, **kwargs)
 
+    def append_weak(self, f):
+        """Subscribes a function or a bound method by weak reference"""
+        self.append(WeakCallable(f, self._remove_dead))
+
+    def _remove_dead(self, subscriber):
+        if subscriber in self:
+            self.remove(subscriber)
+
+    @contextmanager
+    def batch(self):
+        """Suspends calls, the last one is delivered at the end"""
+        self._suspended += 1
+        try:
+            yield self
+        finally:
+            self._suspended -= 1
+            if not self._suspended:
+                self.flush()
+
+    def flush(self):
+        """Delivers the held back call if there is one"""
+        if self._pending is None or self._suspended:
+            return
+        args, kwargs = self._pending
+        self._pending = None
+        self._fire(args, kwargs)
+
     def __repr__(self):
         return "Event(%s)" % list.__repr__(self)
+
+
+class CoalescingEvent(Event):
+    """Event delivering only the last call per event loop tick.
+
+    `scheduler` takes a callable and calls it on the next tick, for Qt:
+    >>> e = CoalescingEvent(
+    ...     scheduler=lambda f: QtCore.QTimer.singleShot(0, f))
+    >>> e.append(lcd.display)
+    >>> for i in range(1000):
+    ...     e(i)
+    >>> # lcd.display(999) is called once on the next tick
+
+    Without a scheduler calls are delivered at once, as by `Event`.
+    """
+    def __init__(self, *args, scheduler=None):
+        super().__init__(*args)
+        self.scheduler = scheduler
+        self._is_scheduled = False
+
+    def __call__(self, *args, **kwargs):
+        if self.scheduler is None and not self._suspended:
+            self._fire(args, kwargs)
+            return
+        self._pending = (args, kwargs)
+        if not self._suspended:
+            self._schedule()
+
+    def flush(self):
+        if self._pending is None or self._suspended:
+            return
+        if self.scheduler is None:
+            super().flush()
+        else:
+            self._schedule()
+
+    def _schedule(self):
+        if not self._is_scheduled:
+            self._is_scheduled = True
+            self.scheduler(self._deliver)
+
+    def _deliver(self):
+        self._is_scheduled = False
+        super().flush()
+
+
+class WeakCallable:
+    """Weak reference to a function or a bound method.
+
+    `on_dead` is called with this object when the referent is deleted.
+    """
+    __slots__ = ['ref', '__weakref__']
+
+    def __init__(self, func, on_dead=None):
+        callback = None
+        if on_dead is not None:
+            self_ref = weakref.ref(self)
+
+            def callback(ref):
+                subscriber = self_ref()
+                if subscriber is not None:
+                    on_dead(subscriber)
+
+        if isinstance(func, MethodType):
+            self.ref = weakref.WeakMethod(func, callback)
+        else:
+            self.ref = weakref.ref(func, callback)
+
+    def __call__(self, *args, **kwargs):
+        func = self.ref()
+        if func is not None:
+            func(*args, **kwargs)
+
+    @property
+    def is_alive(self):
+        return self.ref() is not None
+
+    def __eq__(self, other):
+        if isinstance(other, WeakCallable):
+            return self is other or (self.is_alive and
+                                     self.ref() == other.ref())
+        return self.ref() == other
+
+    __hash__ = object.__hash__
+
+    def __repr__(self):
+        return 'WeakCallable(%r)' % self.ref()
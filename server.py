@@ -0,0 +1,340 @@
+"""
+Local HTTP/JSON server of the training log
+
+    python3 kochka.py serve data.txt --port 8080
+    curl 'http://127.0.0.1:8080/exercises?name=жим&from=2017.01.01&limit=10'
+
+Endpoints, all take `name`, `from` and `to` filters (dates inclusive)
+and `q` search over names and notes, e.g. `q=травм* OR болезнь`:
+
+    /exercises  exercises by `offset` and `limit`, file order
+    /names      names with exercise counts
+    /stats      totals per name and of all
+    /tonnage    tonnage per date and name
+    /health     version of the data and number of exercises
+
+Parsed exercises are kept in memory, the log is checked for changes
+every `check_interval` seconds and only appended records are parsed.
+Responses have ETag of the data version, `If-None-Match` gives 304,
+bodies are cached until the data changes.
+
+Copyright 2017 Pavel Folov
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qsl
+
+from kochkalib import ExerciseColumns, ExerciseIndex
+from metrics import metrics
+from storage import open_storage
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message=None):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+class LogServer:
+    """
+    HTTP/1.1 server with keep-alive on asyncio streams
+
+    >>> server = LogServer('data.txt', port=8080)
+    >>> asyncio.run(server.serve_forever())
+    """
+
+    check_interval = 1.0
+    keep_alive_timeout = 60
+    cache_size = 256
+    max_limit = 1000
+    default_limit = 100
+    # request line and headers
+    max_line_size = 8 * 1024
+    max_headers = 100
+
+    def __init__(self, filename, host='127.0.0.1', port=8080):
+        self.host = host
+        self.port = port
+        self.storage = open_storage(filename, use_cache=True, resync=True)
+        self.exercises = ExerciseColumns()
+        self.index = ExerciseIndex()
+        # ETags of previous runs are not valid
+        self.instance = '{:x}'.format(int(time.time() * 1000))
+        self.version = 0
+        self._cache = OrderedDict()
+        self._server = None
+        self.routes = {
+            '/exercises': self.get_exercises,
+            '/names': self.get_names,
+            '/stats': self.get_stats,
+            '/tonnage': self.get_tonnage,
+            '/health': self.get_health,
+        }
+
+    @property
+    def etag(self):
+        return '"{}-{}"'.format(self.instance, self.version)
+
+    async def start(self):
+        await self.reload()
+        self._server = await asyncio.start_server(
+            self.handle, self.host, self.port, limit=self.max_line_size,
+            reuse_address=True, backlog=1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info('serving %s on %s:%d', self.storage.filename,
+                    self.host, self.port)
+        return self._server
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            while True:
+                await asyncio.sleep(self.check_interval)
+                if self.storage.is_changed():
+                    await self.reload()
+        finally:
+            self.close()
+            await self._server.wait_closed()
+
+    def close(self):
+        self._server.close()
+        self.storage.close()
+
+    async def reload(self):
+        """
+        Loads changes of the log, the loop is not blocked by parsing
+
+        A log which is not readable, e.g. being replaced, is loaded by
+        the next check, the current version is served meanwhile.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            exercises, columns, index = await loop.run_in_executor(
+                None, self._load)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            logger.warning('data is not loaded, version(%d) is served: %s',
+                           self.version, e)
+            return
+        if columns is not None:
+            self.exercises, self.index = columns, index
+        elif exercises:
+            self.exercises.extend(exercises)
+            for exercise in exercises:
+                self.index.add(exercise)
+        else:
+            return
+        self.version += 1
+        self._cache.clear()
+        logger.info('data version(%d): exercises(%d)', self.version,
+                    len(self.exercises))
+
+    def _load(self):
+        exercises = self.storage.load()
+        if not self.storage.is_full:
+            return exercises, None, None
+        return exercises, ExerciseColumns(exercises), \
+            ExerciseIndex(exercises)
+
+    async def handle(self, reader, writer):
+        """Serves requests of one connection"""
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(),
+                                                  self.keep_alive_timeout)
+                except asyncio.TimeoutError:
+                    break
+                if not line:
+                    break
+                headers = await self._read_headers(reader)
+                try:
+                    method, target, version = line.decode('latin-1').split()
+                except ValueError:
+                    writer.write(self._response(
+                        HTTPStatus.BAD_REQUEST, {}, b'', False))
+                    break
+                keep_alive = _is_keep_alive(version, headers)
+                length = int(headers.get('content-length') or 0)
+                if length:
+                    await reader.readexactly(length)
+                with metrics.span('http', path=target.split('?')[0]) \
+                        as fields:
+                    status, extra, body = self.respond(method, target,
+                                                       headers)
+                    fields['status'] = status.value
+                if method == 'HEAD':
+                    extra['Content-Length'] = str(len(body))
+                    body = b''
+                writer.write(self._response(status, extra, body, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError,
+                asyncio.LimitOverrunError):
+            # dropped connections and too long lines
+            pass
+        finally:
+            writer.close()
+
+    async def _read_headers(self, reader) -> dict:
+        headers = {}
+        for _ in range(self.max_headers):
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                return headers
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        raise ValueError('Too many headers')
+
+    def respond(self, method, target, headers):
+        """Returns status, headers and body of the request"""
+        if method not in ('GET', 'HEAD'):
+            return self._error(HTTPStatus.METHOD_NOT_ALLOWED,
+                               {'Allow': 'GET, HEAD'})
+        url = urlsplit(target)
+        route = self.routes.get(url.path)
+        if route is None:
+            return self._error(HTTPStatus.NOT_FOUND)
+        params = dict(parse_qsl(url.query))
+        key = (url.path, tuple(sorted(params.items())))
+        body = self._cache.get(key)
+        if body is None:
+            try:
+                result = route(params)
+            except HTTPError as e:
+                return self._error(e.status, message=str(e))
+            body = json.dumps(result, ensure_ascii=False).encode()
+            self._cache[key] = body
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+
+        # after parameters are checked, a bad request is not 304
+        etag = self.etag
+        extra = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if_none_match = [tag.strip() for tag in
+                         headers.get('if-none-match', '').split(',')]
+        if etag in if_none_match or '*' in if_none_match:
+            return HTTPStatus.NOT_MODIFIED, extra, b''
+        return HTTPStatus.OK, extra, body
+
+    def _error(self, status, extra=None, message=None):
+        body = json.dumps({'error': message or status.phrase}).encode()
+        return status, extra or {}, body
+
+    @staticmethod
+    def _response(status, extra, body, keep_alive) -> bytes:
+        head = ['HTTP/1.1 {} {}'.format(status.value, status.phrase)]
+        if status is not HTTPStatus.NOT_MODIFIED:
+            head.append('Content-Type: application/json; charset=utf-8')
+            if 'Content-Length' not in extra:
+                head.append('Content-Length: {}'.format(len(body)))
+        for item in extra.items():
+            head.append('{}: {}'.format(*item))
+        head.append('Connection: {}'.format(
+            'keep-alive' if keep_alive else 'close'))
+        return ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body
+
+    def _rows(self, params):
+        return self.index.filter(params.get('name'), params.get('from'),
+                                 params.get('to'), params.get('q'))
+
+    def get_exercises(self, params):
+        offset = _int_param(params, 'offset', 0)
+        limit = min(_int_param(params, 'limit', self.default_limit),
+                    self.max_limit)
+        rows = self._rows(params)
+        columns = self.exercises
+        items = []
+        for row in rows[offset:offset + limit]:
+            start, stop = columns.offsets[row], columns.offsets[row + 1]
+            items.append({
+                'date': columns.date_at(row),
+                'name': columns.names[columns.name_ids[row]],
+                'note': columns.notes.get(row),
+                'sets': [list(s) for s in zip(
+                    columns.weights[start:stop], columns.counts[start:stop],
+                    columns.set_counts[start:stop])],
+            })
+        return {'total': len(rows), 'offset': offset, 'limit': limit,
+                'items': items}
+
+    def get_names(self, params):
+        names = {}
+        for row in self._rows(params):
+            name = self.exercises.names[self.exercises.name_ids[row]]
+            names[name] = names.get(name, 0) + 1
+        return names
+
+    def get_stats(self, params):
+        columns = self.exercises
+        names = {}
+        for row in self._rows(params):
+            name = columns.names[columns.name_ids[row]]
+            stat = names.get(name)
+            if stat is None:
+                stat = names[name] = {'exercises': 0, 'sets': 0,
+                                      'tonnage': 0, 'max_weight': 0}
+            stat['exercises'] += 1
+            for i in columns.set_range(row):
+                weight = columns.weights[i]
+                stat['sets'] += columns.set_counts[i]
+                stat['tonnage'] += \
+                    weight * columns.counts[i] * columns.set_counts[i]
+                if weight > stat['max_weight']:
+                    stat['max_weight'] = weight
+        total = {'exercises': 0, 'sets': 0, 'tonnage': 0, 'max_weight': 0}
+        for stat in names.values():
+            for key in ('exercises', 'sets', 'tonnage'):
+                total[key] += stat[key]
+            total['max_weight'] = max(total['max_weight'], stat['max_weight'])
+        return {'total': total, 'names': names}
+
+    def get_tonnage(self, params):
+        tonnage = {}
+        columns = self.exercises
+        for row in self._rows(params):
+            key = (columns.date_at(row), columns.names[columns.name_ids[row]])
+            tonnage[key] = tonnage.get(key, 0) + columns.total_weight_at(row)
+        return [key + (value,) for key, value in sorted(tonnage.items())]
+
+    def get_health(self, params):
+        return {'version': self.version, 'exercises': len(self.exercises),
+                'file': os.path.basename(self.storage.filename)}
+
+
+def _int_param(params, name, default) -> int:
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST,
+                        '{} has to be integer'.format(name))
+    if value < 0:
+        raise HTTPError(HTTPStatus.BAD_REQUEST,
+                        '{} cannot be negative'.format(name))
+    return value
+
+
+def _is_keep_alive(version, headers) -> bool:
+    connection = headers.get('connection', '').lower()
+    if version == 'HTTP/1.0':
+        return connection == 'keep-alive'
+    return connection != 'close'
+
+
+def run(filename, host='127.0.0.1', port=8080):
+    """Serves until interrupted"""
+    try:
+        asyncio.run(LogServer(filename, host, port).serve_forever())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,854 @@
+"""
+Training log storages
+
+`TextStorage` keeps exercises in the text file as `ExerciseTxtParser`
+reads it, `SqliteStorage` keeps them in SQLite tables, `SegmentStorage`
+in text files per year or month. All are loaded by `iter_load` giving
+only exercises added since the previous load and are saved by a full
+rewrite or by appending new exercises.
+
+>>> storage = open_storage('data.db')
+>>> exercises = storage.load()
+>>> storage.append([Exercise('2017.01.13', 'жим', [Set(35, 5)])])
+>>> copy_storage(open_storage('data.txt'), storage)  # import
+
+Copyright 2017 Pavel Folov
+"""
+
+import gzip
+import json
+import lzma
+import os
+import sqlite3
+import sys
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+from kochkalib import Set, Exercise, ExerciseTxtBufferParser, \
+    ExerciseTxtTailLoader, save_exercises_to_file, append_exercises_to_file
+from metrics import metrics
+from oslib import filebackup, write_atomic
+from patterns import Event
+
+SQLITE_SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+SEGMENTS_SUFFIX = '.segments'
+
+
+class Storage(ABC):
+    """
+    Storage interface
+
+    Queries are answered by scanning `iter_exercises`, storages with
+    indexes override them. A storage without one of abstract methods
+    is not created.
+    """
+
+    filename = None
+    # exercises of the last load replace all loaded before
+    is_full = True
+
+    def __init__(self):
+        self.on_parse_error = Event()
+
+    def create(self):
+        """Creates empty storage if there is no one"""
+
+    @abstractmethod
+    def reset(self):
+        """Forgets loaded part, next `iter_load` loads everything"""
+
+    def load(self) -> list:
+        return list(self.iter_load())
+
+    @abstractmethod
+    def iter_load(self):
+        """Yields exercises added since the previous load"""
+
+    @abstractmethod
+    def is_changed(self) -> bool:
+        """Checks the storage is changed by others since the last load"""
+
+    @abstractmethod
+    def iter_exercises(self):
+        """Yields all exercises, the load state is not changed"""
+
+    @abstractmethod
+    def save(self, exercises) -> int:
+        """Replaces all exercises, they are taken as loaded"""
+
+    @abstractmethod
+    def append(self, exercises) -> int:
+        """Adds exercises, they are taken as loaded"""
+
+    def close(self):
+        pass
+
+    @property
+    def watched_files(self) -> list:
+        """Files changed by commits of others, to watch for changes"""
+        return [self.filename]
+
+    def names(self) -> list:
+        return sorted({e.name for e in self.iter_exercises()})
+
+    def filter(self, name=None, date_from=None, date_to=None):
+        """Yields exercises of the name and dates range, bounds included"""
+        for exercise in self.iter_exercises():
+            if name is not None and exercise.name != name:
+                continue
+            if date_from is not None and exercise.date < date_from:
+                continue
+            if date_to is not None and exercise.date > date_to:
+                continue
+            yield exercise
+
+    def tonnage(self, name=None, date_from=None, date_to=None) -> list:
+        """(date, name, tonnage) sorted by date and name"""
+        tonnage = {}
+        for exercise in self.filter(name, date_from, date_to):
+            key = (exercise.date, exercise.name)
+            tonnage[key] = tonnage.get(key, 0) + exercise.total_weight
+        return [key + (value,) for key, value in sorted(tonnage.items())]
+
+    def stats(self) -> dict:
+        """Totals per exercise name and of all exercises"""
+        names = {}
+        first = last = None
+        for exercise in self.iter_exercises():
+            stat = names.get(exercise.name)
+            if stat is None:
+                stat = names[exercise.name] = _empty_stat()
+            stat['exercises'] += 1
+            for set_ in exercise.sets:
+                stat['sets'] += set_.set_count
+                stat['tonnage'] += set_.total_weight
+                stat['max_weight'] = max(stat['max_weight'], set_.weight)
+            if first is None or exercise.date < first:
+                first = exercise.date
+            if last is None or exercise.date > last:
+                last = exercise.date
+        return _stats(names, first, last)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _empty_stat():
+    return {'exercises': 0, 'sets': 0, 'tonnage': 0, 'max_weight': 0}
+
+
+def _stats(names, first, last):
+    total = _empty_stat()
+    for stat in names.values():
+        for key in ('exercises', 'sets', 'tonnage'):
+            total[key] += stat[key]
+        total['max_weight'] = max(total['max_weight'], stat['max_weight'])
+    total.update(first_date=first, last_date=last)
+    return {'total': total, 'names': names}
+
+
+class TextStorage(Storage):
+    """
+    Training text file, see `ExerciseTxtTailLoader`
+
+    `-` as filename reads stdin by `iter_exercises`.
+    """
+
+    def __init__(self, filename, workers=1, use_cache=False, resync=False):
+        super().__init__()
+        self.filename = filename
+        self.resync = resync
+        self.loader = ExerciseTxtTailLoader(filename, workers, use_cache,
+                                            resync)
+        self.loader.on_parse_error.append(self.on_parse_error)
+
+    @property
+    def is_full(self):
+        return self.loader.is_full
+
+    def create(self):
+        if not os.path.exists(self.filename):
+            with open(self.filename, 'w'):
+                pass
+
+    def reset(self):
+        self.loader.reset()
+
+    def iter_load(self):
+        return self.loader.iter_load()
+
+    def is_changed(self) -> bool:
+        return self.loader.is_changed()
+
+    def iter_exercises(self):
+        parser = ExerciseTxtBufferParser(self.filename, self.resync)
+        parser.on_parse_error.append(self.on_parse_error)
+        f = sys.stdin if self.filename == '-' else open(self.filename)
+        try:
+            yield from metrics.iter_span('parse', parser.parse_stream(f),
+                                         parser='stream')
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+    def save(self, exercises) -> int:
+        if not hasattr(exercises, '__len__'):
+            exercises = list(exercises)
+        save_exercises_to_file(self.filename, exercises,
+                               use_cache=self.loader.use_cache)
+        self.loader.remember_file()
+        return len(exercises)
+
+    def append(self, exercises) -> int:
+        append_exercises_to_file(self.filename, exercises)
+        # parses only appended exercises, they are loaded already
+        self.loader.load()
+        return len(exercises)
+
+
+class SqliteStorage(Storage):
+    """
+    Training log in SQLite database
+
+    Exercises are rows in file order, sets are rows of an exercise by
+    position, names are a dictionary. Dates are kept as they are written
+    in the text file, so they are sorted as text and an export gives the
+    same exercises back. Loaded part is the exercise id, saving new
+    exercises inserts only them. Other changes of loaded rows are found
+    by the `revision` counter, bumped by `save` and by update triggers,
+    and by row counts of the loaded part, then the load is full again.
+
+    The connection is shared by the app and worker threads, queries are
+    serialized by a lock.
+    """
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS names (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS exercises (
+            id INTEGER PRIMARY KEY,
+            date TEXT NOT NULL,
+            name_id INTEGER NOT NULL REFERENCES names (id),
+            note TEXT
+        );
+        CREATE TABLE IF NOT EXISTS sets (
+            exercise_id INTEGER NOT NULL REFERENCES exercises (id),
+            position INTEGER NOT NULL,
+            weight INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            set_count INTEGER NOT NULL,
+            PRIMARY KEY (exercise_id, position)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS exercises_date ON exercises (date);
+        CREATE INDEX IF NOT EXISTS exercises_name_date
+            ON exercises (name_id, date);
+        CREATE TABLE IF NOT EXISTS revision (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            rewrites INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO revision VALUES (0, 0);
+        CREATE TRIGGER IF NOT EXISTS exercises_update AFTER UPDATE ON exercises
+        BEGIN UPDATE revision SET rewrites = rewrites + 1; END;
+        CREATE TRIGGER IF NOT EXISTS sets_update AFTER UPDATE ON sets
+        BEGIN UPDATE revision SET rewrites = rewrites + 1; END;
+        CREATE TRIGGER IF NOT EXISTS names_update AFTER UPDATE ON names
+        BEGIN UPDATE revision SET rewrites = rewrites + 1; END;
+    '''
+
+    # deletes are not triggered, a rewrite deletes every row
+    select_loaded_state = '''
+        SELECT (SELECT rewrites FROM revision),
+            (SELECT COUNT(*) FROM exercises WHERE id <= :last_id),
+            (SELECT COUNT(*) FROM sets WHERE exercise_id <= :last_id)
+    '''
+
+    select_exercises = '''
+        SELECT e.id, e.date, n.name, e.note
+        FROM exercises e JOIN names n ON n.id = e.name_id
+        WHERE e.id > ? {} ORDER BY e.id LIMIT ?
+    '''
+
+    # exercises taken by a query, less than sqlite variables limit
+    page_size = 500
+    insert_batch_size = 10000
+
+    def __init__(self, filename):
+        super().__init__()
+        self.filename = filename
+        self.is_full = True
+        self._lock = threading.Lock()
+        # transactions are begun explicitly
+        self._connection = sqlite3.connect(
+            filename, isolation_level=None, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode = WAL')
+        self._connection.execute('PRAGMA synchronous = NORMAL')
+        self._connection.executescript(self.schema)
+        self.reset()
+
+    @property
+    def watched_files(self) -> list:
+        # commits are in the write-ahead log until a checkpoint
+        return [self.filename, self.filename + '-wal']
+
+    def reset(self):
+        self.last_id = None
+        self.data_version = None
+        # revision and row counts of the loaded part
+        self.loaded_state = None
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+
+    def _query(self, sql, params=()) -> list:
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def _remember(self, cursor):
+        """Takes the whole database as loaded"""
+        self.last_id = cursor.execute(
+            'SELECT COALESCE(MAX(id), 0) FROM exercises').fetchone()[0]
+        self.data_version = cursor.execute(
+            'PRAGMA data_version').fetchone()[0]
+        self.loaded_state = self._loaded_state(cursor, self.last_id)
+
+    def _loaded_state(self, cursor, last_id) -> tuple:
+        return tuple(cursor.execute(self.select_loaded_state,
+                                    {'last_id': last_id}).fetchone())
+
+    def iter_load(self):
+        is_full = self.last_id is None
+        with self._lock:
+            # commits of other connections change it
+            data_version = self._connection.execute(
+                'PRAGMA data_version').fetchone()[0]
+            if not is_full and data_version != self.data_version and \
+                    self._loaded_state(self._connection, self.last_id) != \
+                    self.loaded_state:
+                # loaded rows are rewritten, updated or deleted by others
+                is_full = True
+        self.is_full = is_full
+        last_id = 0 if is_full else self.last_id
+        try:
+            for exercise_id, exercise in self._select(last_id):
+                last_id = exercise_id
+                yield exercise
+        except GeneratorExit:
+            self.reset()
+            raise
+        with self._lock:
+            self.loaded_state = self._loaded_state(self._connection, last_id)
+        self.last_id = last_id
+        self.data_version = data_version
+
+    def is_changed(self) -> bool:
+        if self.last_id is None:
+            return True
+        return self._query('PRAGMA data_version')[0][0] != self.data_version
+
+    def iter_exercises(self):
+        for _, exercise in self._select():
+            yield exercise
+
+    def _select(self, last_id=0, where='', params=()):
+        """Yields (id, exercise) by pages of `page_size` exercises"""
+        sql = self.select_exercises.format(where)
+        # equal sets share one Set, sets are not changed after loading
+        known_sets = {}
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    sql, (last_id,) + tuple(params) + (self.page_size,)
+                ).fetchall()
+                if not rows:
+                    return
+                sets = {}
+                for exercise_id, *set_ in self._connection.execute(
+                        'SELECT exercise_id, weight, count, set_count '
+                        'FROM sets WHERE exercise_id IN ({}) '
+                        'ORDER BY exercise_id, position'.format(
+                            ','.join('?' * len(rows))),
+                        [row[0] for row in rows]):
+                    set_ = tuple(set_)
+                    set_obj = known_sets.get(set_)
+                    if set_obj is None:
+                        set_obj = known_sets[set_] = Set(*set_)
+                    sets.setdefault(exercise_id, []).append(set_obj)
+            for exercise_id, date, name, note in rows:
+                yield exercise_id, Exercise(
+                    date, name, sets.get(exercise_id, []), note)
+            last_id = rows[-1][0]
+
+    def save(self, exercises) -> int:
+        with metrics.span('sqlite.save') as fields, \
+                self._transaction() as cursor:
+            cursor.execute('DELETE FROM sets')
+            cursor.execute('DELETE FROM exercises')
+            cursor.execute('DELETE FROM names')
+            # other connections load everything again
+            cursor.execute('UPDATE revision SET rewrites = rewrites + 1')
+            count = fields['records'] = self._insert(cursor, exercises)
+            self._remember(cursor)
+        return count
+
+    def append(self, exercises) -> int:
+        with metrics.span('sqlite.append') as fields, \
+                self._transaction() as cursor:
+            count = fields['records'] = self._insert(cursor, exercises)
+            self._remember(cursor)
+        return count
+
+    def _insert(self, cursor, exercises) -> int:
+        """Inserts exercises by batches, returns the number of them"""
+        name_ids = dict(cursor.execute('SELECT name, id FROM names'))
+        next_id = cursor.execute(
+            'SELECT COALESCE(MAX(id), 0) FROM exercises').fetchone()[0] + 1
+        first_id = next_id
+        exercise_rows = []
+        set_rows = []
+        for exercise in exercises:
+            name_id = name_ids.get(exercise.name)
+            if name_id is None:
+                cursor.execute('INSERT INTO names (name) VALUES (?)',
+                               (exercise.name,))
+                name_id = name_ids[exercise.name] = cursor.lastrowid
+            exercise_rows.append(
+                (next_id, exercise.date, name_id, exercise.note))
+            set_rows.extend(
+                (next_id, position, s.weight, s.count, s.set_count)
+                for position, s in enumerate(exercise.sets))
+            next_id += 1
+            if len(exercise_rows) >= self.insert_batch_size:
+                self._insert_rows(cursor, exercise_rows, set_rows)
+                exercise_rows, set_rows = [], []
+        self._insert_rows(cursor, exercise_rows, set_rows)
+        return next_id - first_id
+
+    @staticmethod
+    def _insert_rows(cursor, exercise_rows, set_rows):
+        cursor.executemany(
+            'INSERT INTO exercises (id, date, name_id, note) '
+            'VALUES (?, ?, ?, ?)', exercise_rows)
+        cursor.executemany(
+            'INSERT INTO sets (exercise_id, position, weight, count, '
+            'set_count) VALUES (?, ?, ?, ?, ?)', set_rows)
+
+    def compact(self):
+        """Rebuilds the database file without free pages"""
+        with self._lock:
+            self._connection.execute('VACUUM')
+
+    def names(self) -> list:
+        return [name for name, in self._query(
+            'SELECT name FROM names ORDER BY name')]
+
+    def _where(self, name, date_from, date_to):
+        """SQL condition and params of the filter"""
+        conditions = []
+        params = []
+        if name is not None:
+            conditions.append(
+                'e.name_id = (SELECT id FROM names WHERE name = ?)')
+            params.append(name)
+        if date_from is not None:
+            conditions.append('e.date >= ?')
+            params.append(date_from)
+        if date_to is not None:
+            conditions.append('e.date <= ?')
+            params.append(date_to)
+        return ''.join(' AND ' + c for c in conditions), params
+
+    def filter(self, name=None, date_from=None, date_to=None):
+        where, params = self._where(name, date_from, date_to)
+        for _, exercise in self._select(0, where, params):
+            yield exercise
+
+    def tonnage(self, name=None, date_from=None, date_to=None) -> list:
+        where, params = self._where(name, date_from, date_to)
+        return self._query(
+            'SELECT e.date, n.name, '
+            'SUM(s.weight * s.count * s.set_count) '
+            'FROM exercises e JOIN names n ON n.id = e.name_id '
+            'JOIN sets s ON s.exercise_id = e.id '
+            'WHERE 1 {} GROUP BY e.date, n.name '
+            'ORDER BY e.date, n.name'.format(where), params)
+
+    def stats(self) -> dict:
+        names = {}
+        for name, exercises, sets, tonnage, max_weight in self._query(
+                'SELECT n.name, COUNT(DISTINCT e.id), SUM(s.set_count), '
+                'SUM(s.weight * s.count * s.set_count), MAX(s.weight) '
+                'FROM exercises e JOIN names n ON n.id = e.name_id '
+                'JOIN sets s ON s.exercise_id = e.id GROUP BY n.name'):
+            names[name] = {'exercises': exercises, 'sets': sets,
+                           'tonnage': tonnage, 'max_weight': max_weight}
+        (first, last), = self._query(
+            'SELECT MIN(date), MAX(date) FROM exercises')
+        return _stats(names, first, last)
+
+
+class SegmentStorage(Storage):
+    """
+    Training log split into text files by year or month
+
+    data.segments/
+        manifest.json
+        2015.txt.xz     frozen, compressed
+        2016.txt.gz
+        2017.txt
+
+    The manifest keeps the period and, per segment, its file, dates
+    range, number of exercises and checksum of the text. Exercises are
+    in segments order, the file order inside a segment. Saving renders
+    every segment and rewrites only ones with another checksum, with a
+    backup. Filters by dates open only segments of the range.
+
+    Text segments are loaded by `ExerciseTxtTailLoader`, so records
+    appended to the last segment are parsed only. Compressed segments
+    are frozen: they are streamed through the parser and rewritten
+    only if their exercises are changed.
+
+    >>> storage = SegmentStorage('data.segments', period='year')
+    >>> copy_storage(open_storage('data.txt'), storage)  # migration
+    >>> storage.freeze(before='2017', compression='xz')
+    >>> exercises = list(storage.filter(date_from='2017.01.01'))
+    """
+
+    manifest_version = 1
+    # length of the date prefix of a segment key
+    periods = {'year': 4, 'month': 7}
+    compressions = {'gz': gzip.open, 'xz': lzma.open}
+
+    def __init__(self, path, period='year', use_cache=False, resync=False):
+        super().__init__()
+        self.filename = self.path = path
+        self.use_cache = use_cache
+        self.resync = resync
+        self.is_full = True
+        # the period of an existing manifest wins
+        self.manifest = {'version': self.manifest_version, 'period': period,
+                         'segments': {}}
+        if os.path.exists(self.manifest_filename):
+            self.manifest = self._read_manifest()
+        self.reset()
+
+    @property
+    def manifest_filename(self):
+        return os.path.join(self.path, 'manifest.json')
+
+    @property
+    def period(self):
+        return self.manifest['period']
+
+    def segment_key(self, date) -> str:
+        return date[:self.periods[self.period]]
+
+    def create(self):
+        if not os.path.exists(self.manifest_filename):
+            os.makedirs(self.path, exist_ok=True)
+            self._write_manifest()
+
+    def reset(self):
+        # key: loader of text segments, (size, mtime) of compressed ones
+        self._loaded = {}
+
+    def _read_manifest(self) -> dict:
+        with open(self.manifest_filename, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != self.manifest_version:
+            raise ValueError('Unknown segments manifest version: {}'.format(
+                manifest.get('version')))
+        return manifest
+
+    def _write_manifest(self):
+        write_atomic(self.manifest_filename, json.dumps(
+            self.manifest, ensure_ascii=False, indent=2,
+            sort_keys=True).encode())
+
+    def _path(self, key) -> str:
+        return os.path.join(self.path, self.manifest['segments'][key]['file'])
+
+    def _keys(self, date_from=None, date_to=None) -> list:
+        """Segment keys overlapping the dates range, in order"""
+        return [key for key in sorted(self.manifest['segments'])
+                if (date_from is None or key >= date_from[:len(key)]) and
+                (date_to is None or key <= date_to[:len(key)])]
+
+    def _compression(self, key):
+        return self.manifest['segments'][key].get('compression')
+
+    def _is_segment_changed(self, key) -> bool:
+        loaded = self._loaded.get(key)
+        if loaded is None:
+            return True
+        if isinstance(loaded, ExerciseTxtTailLoader):
+            return loaded.is_changed()
+        return loaded != _file_stat(self._path(key))
+
+    def is_changed(self) -> bool:
+        if os.path.exists(self.manifest_filename) and \
+                self._read_manifest() != self.manifest:
+            return True
+        return set(self._loaded) != set(self.manifest['segments']) or \
+            any(map(self._is_segment_changed, self._loaded))
+
+    def iter_load(self):
+        if os.path.exists(self.manifest_filename):
+            self.manifest = self._read_manifest()
+        keys = self._keys()
+        changed = [key for key in keys if self._is_segment_changed(key)]
+        last = keys[-1] if keys else None
+        is_tail = self._loaded and set(self._loaded) == set(keys) and \
+            changed == [last] and not self._compression(last)
+        if is_tail:
+            exercises = self._loaded[last].iter_load()
+            first = next(exercises, None)
+            if not self._loaded[last].is_full:
+                # records are appended to the last segment only
+                self.is_full = False
+                if first is not None:
+                    yield first
+                yield from exercises
+                return
+            exercises.close()
+        elif not changed and self._loaded:
+            self.is_full = False
+            return
+        self.is_full = True
+        self.reset()
+        try:
+            for key in keys:
+                yield from self._load_segment(key)
+        except GeneratorExit:
+            self.reset()
+            raise
+
+    def _load_segment(self, key):
+        path = self._path(key)
+        if self._compression(key):
+            self._loaded[key] = _file_stat(path)
+            yield from self._iter_segment(key)
+            return
+        loader = ExerciseTxtTailLoader(path, use_cache=self.use_cache,
+                                       resync=self.resync)
+        loader.on_parse_error.append(self.on_parse_error)
+        self._loaded[key] = loader
+        yield from loader.iter_load()
+
+    def _iter_segment(self, key):
+        """Parses the segment without changing the load state"""
+        compression = self._compression(key)
+        opener = self.compressions[compression] if compression else open
+        parser = ExerciseTxtBufferParser(self._path(key), self.resync)
+        parser.on_parse_error.append(self.on_parse_error)
+        with opener(self._path(key), 'rt') as f:
+            yield from metrics.iter_span('parse', parser.parse_stream(f),
+                                         parser='segment', segment=key)
+
+    def iter_exercises(self, date_from=None, date_to=None):
+        """All exercises or exercises of segments overlapping the dates"""
+        for key in self._keys(date_from, date_to):
+            yield from self._iter_segment(key)
+
+    def filter(self, name=None, date_from=None, date_to=None):
+        for exercise in self.iter_exercises(date_from, date_to):
+            if name is not None and exercise.name != name:
+                continue
+            if date_from is not None and exercise.date < date_from:
+                continue
+            if date_to is not None and exercise.date > date_to:
+                continue
+            yield exercise
+
+    def save(self, exercises) -> int:
+        segments = self._group(exercises)
+        with metrics.span('segments.save') as fields:
+            written = []
+            for key, texts in segments.items():
+                if self._write_segment(key, ''.join(texts)):
+                    written.append(key)
+            for key in set(self.manifest['segments']) - set(segments):
+                os.remove(self._path(key))
+                del self.manifest['segments'][key]
+                written.append(key)
+            self._write_manifest()
+            fields.update(segments=len(segments), written=len(written))
+        self._remember()
+        return sum(self.manifest['segments'][key]['exercises']
+                   for key in segments)
+
+    def append(self, exercises) -> int:
+        exercises = list(exercises)
+        segments = self._group(exercises)
+        for key, texts in segments.items():
+            entry = self.manifest['segments'].get(key)
+            if entry is not None and not entry.get('compression'):
+                append_exercises_to_file(self._path(key), exercises=[
+                    exercise for exercise in exercises
+                    if self.segment_key(exercise.date) == key])
+                self._update_entry(key, _read_segment(self._path(key)))
+            else:
+                # new segment, or a frozen one is rewritten
+                old = '' if entry is None else \
+                    _separated(self._read_text(key))
+                self._write_segment(key, old + ''.join(texts))
+        self._write_manifest()
+        self._remember()
+        return len(exercises)
+
+    def freeze(self, before=None, compression='xz') -> list:
+        """
+        Compresses segments with keys less than `before`, by default
+        all but the last one, returns frozen keys
+        """
+        keys = self._keys()
+        if before is None:
+            before = keys[-1] if keys else ''
+        frozen = []
+        for key in keys:
+            if key >= before or self._compression(key) == compression:
+                continue
+            text = self._read_text(key)
+            old_path = self._path(key)
+            self._write_segment(key, text, compression, force=True)
+            if old_path != self._path(key):
+                os.remove(old_path)
+                _remove_cache(old_path)
+            frozen.append(key)
+        self._write_manifest()
+        self._remember()
+        return frozen
+
+    def _group(self, exercises) -> dict:
+        """Saved text of exercises per segment key, keys are sorted"""
+        segments = {}
+        for exercise in exercises:
+            segments.setdefault(self.segment_key(exercise.date), []).append(
+                exercise.str_to_save() + '\n\n')
+        return dict(sorted(segments.items()))
+
+    def _read_text(self, key) -> str:
+        compression = self._compression(key)
+        opener = self.compressions[compression] if compression else open
+        with opener(self._path(key), 'rt') as f:
+            return f.read()
+
+    def _write_segment(self, key, text, compression=None,
+                       force=False) -> bool:
+        """Writes the segment if its text is changed, returns written"""
+        entry = self.manifest['segments'].get(key)
+        if compression is None and entry is not None:
+            compression = entry.get('compression')
+        data = text.encode()
+        if not force and entry is not None and \
+                entry['checksum'] == zlib.crc32(data):
+            return False
+        filename = key + '.txt'
+        if compression:
+            filename += '.' + compression
+        path = os.path.join(self.path, filename)
+        os.makedirs(self.path, exist_ok=True)
+        if compression:
+            with metrics.span('segments.compress', segment=key,
+                              bytes=len(data)):
+                write_atomic(path, _compress(data, compression))
+        else:
+            with filebackup(path), open(path, 'wb') as f:
+                f.write(data)
+        self.manifest['segments'][key] = {'file': filename,
+                                          'compression': compression}
+        self._update_entry(key, data)
+        return True
+
+    def _update_entry(self, key, data: bytes):
+        entry = self.manifest['segments'][key]
+        # a record starts by its date line
+        dates = [line for line in data.decode().splitlines()
+                 if ExerciseTxtBufferParser.date_pattern.match(line)]
+        entry.update(checksum=zlib.crc32(data), exercises=len(dates),
+                     first_date=min(dates, default=None),
+                     last_date=max(dates, default=None))
+
+    def _remember(self):
+        """Takes segments as loaded, e.g. after saving"""
+        self.reset()
+        for key in self._keys():
+            path = self._path(key)
+            if self._compression(key):
+                self._loaded[key] = _file_stat(path)
+                continue
+            loader = ExerciseTxtTailLoader(path, use_cache=self.use_cache,
+                                           resync=self.resync)
+            loader.on_parse_error.append(self.on_parse_error)
+            loader.remember_file()
+            self._loaded[key] = loader
+
+
+def _file_stat(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _read_segment(path) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _separated(text) -> str:
+    """Text finished by a blank line to append records"""
+    if not text or text.endswith('\n\n'):
+        return text
+    return text + ('\n' if text.endswith('\n') else '\n\n')
+
+
+def _compress(data: bytes, compression) -> bytes:
+    if compression == 'gz':
+        return gzip.compress(data, mtime=0)
+    return lzma.compress(data)
+
+
+def _remove_cache(path):
+    try:
+        os.remove(path + '.cache')
+    except FileNotFoundError:
+        pass
+
+
+def open_storage(filename, workers=1, use_cache=False, resync=False):
+    """
+    SQLite storage for .db/.sqlite files, segments for .segments
+    directories and directories with a manifest, text storage otherwise
+    """
+    if filename.lower().endswith(SQLITE_SUFFIXES):
+        return SqliteStorage(filename)
+    if filename.rstrip(os.sep).endswith(SEGMENTS_SUFFIX) or \
+            os.path.isdir(filename):
+        return SegmentStorage(filename, use_cache=use_cache, resync=resync)
+    return TextStorage(filename, workers, use_cache, resync)
+
+
+def copy_storage(source: Storage, target: Storage) -> int:
+    """
+    Replaces exercises of target by exercises of source in one
+    transaction, returns the number of them
+    """
+    return target.save(source.iter_exercises())
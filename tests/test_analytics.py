@@ -0,0 +1,51 @@
+import pytest
+
+from kochkalib import Set, Exercise
+
+np = pytest.importorskip('numpy')
+from analytics import Analytics  # noqa: E402
+
+EXERCISES = [
+    # 2017.01.02 is Monday
+    Exercise('2017.01.02', 'жим', [Set(100, 5), Set(100, 5, 2)]),
+    Exercise('2017.01.03', 'жим', [Set(110, 1)]),
+    Exercise('2017.01.09', 'жим', [Set(100, 10)]),
+    Exercise('2017.01.03', 'тяга', [Set(150, 3)]),
+    Exercise('без даты', 'тяга', [Set(200, 1)]),
+]
+
+
+@pytest.fixture
+def analytics():
+    return Analytics(EXERCISES)
+
+
+def test_exercise_tonnage(analytics):
+    assert analytics.exercise_tonnage().tolist() == [
+        1500, 110, 1000, 450, 200]
+
+
+def test_tonnage_by_week_skips_undated(analytics):
+    names, starts, tonnage = analytics.tonnage('week')
+    assert names.tolist() == ['жим', 'жим', 'тяга']
+    assert starts.astype(str).tolist() == [
+        '2017-01-02', '2017-01-09', '2017-01-02']
+    assert tonnage.tolist() == [1610, 1000, 450]
+    with pytest.raises(ValueError):
+        analytics.tonnage('year')
+
+
+def test_e1rm_formulas(analytics):
+    assert analytics.e1rm()[:2] == pytest.approx([100 * 35 / 30] * 2)
+    assert analytics.e1rm()[2] == 110
+    assert analytics.e1rm('brzycki')[0] == pytest.approx(112.5)
+    assert analytics.best_e1rm().tolist() == pytest.approx([400 / 3, 200])
+
+
+def test_rolling_tonnage_counts_missed_days(analytics):
+    starts, average = analytics.rolling_tonnage('жим', window=2)
+    assert len(starts) == 8
+    assert str(starts[0]) == '2017-01-02'
+    assert average.tolist() == [1500, 805, 55, 0, 0, 0, 0, 500]
+    starts, average = analytics.rolling_tonnage('присед')
+    assert len(starts) == 0 and len(average) == 0
@@ -0,0 +1,18 @@
+from athletes import AthleteDirectory
+
+LOG = '2017.01.01\nжим\n50 5\n\nне дата\n\n2017.01.02\nтяга\n60 5\n\n'
+
+
+def test_parse_errors_are_reported_once(tmp_path):
+    for athlete in ('a', 'b'):
+        (tmp_path / (athlete + '.txt')).write_text(LOG)
+    team = AthleteDirectory(str(tmp_path), workers=2)
+    # logs are parsed by the pool
+    team.parallel_threshold = 0
+    errors = []
+    team.on_parse_error.append(
+        lambda athlete, error: errors.append((athlete, error.lineno)))
+    team.load()
+    assert sorted(errors) == [('a', 5), ('b', 5)]
+    assert [exercise.name for _, exercise in team] == [
+        'жим', 'тяга', 'жим', 'тяга']
@@ -0,0 +1,58 @@
+import pytest
+
+from kochkalib import Set, Exercise, ExerciseColumns
+
+
+def test_copy_is_not_changed_with_the_columns():
+    exercises = ExerciseColumns([
+        Exercise('2017.01.01', 'жим', [Set(50, 5)], 'травма'),
+        Exercise('без даты', 'тяга', [Set(60, 5)]),
+    ])
+    snapshot = exercises.copy()
+    exercises.truncate(1)
+    exercises.append(Exercise('2017.01.05', 'присед', [Set(70, 5)]))
+    assert [str(e) for e in snapshot] == [
+        'date(2017.01.01), name(жим), sets([50 5])',
+        'date(без даты), name(тяга), sets([60 5])']
+    assert snapshot[0].note == 'травма'
+    assert [e.name for e in exercises] == ['жим', 'присед']
+
+
+EXERCISES = [
+    Exercise('2017.01.01', 'жим', [Set(50, 5), Set(60, 3, 2)], 'травма'),
+    Exercise('2017.01.02', 'тяга', []),
+    Exercise('2017.01.03', 'жим', [Set(55, 8)]),
+]
+
+
+def test_views_are_the_same_as_exercises():
+    columns = ExerciseColumns(EXERCISES)
+    assert len(columns) == 3
+    assert columns.names == ['жим', 'тяга']
+    for view, exercise in zip(columns, EXERCISES):
+        assert (view.date, view.name, view.note) == \
+            (exercise.date, exercise.name, exercise.note)
+        assert view.sets_str == exercise.sets_str
+        assert view.total_weight == exercise.total_weight
+        assert [str(s) for s in view.sets] == [str(s) for s in exercise.sets]
+    assert [str(e) for e in columns[-2:]] == [str(e) for e in EXERCISES[1:]]
+
+
+def test_views_are_read_only_without_dict():
+    view = ExerciseColumns(EXERCISES)[0]
+    set_ = view.sets[1]
+    assert set_.total_weight == 360
+    for item in (view, set_):
+        assert not hasattr(item, '__dict__')
+    with pytest.raises(AttributeError):
+        set_.weight = 70
+    with pytest.raises(TypeError):
+        view.add_set(Set(70, 5))
+
+
+def test_truncate_removes_sets_and_notes():
+    columns = ExerciseColumns(EXERCISES)
+    columns.truncate(1)
+    assert len(columns) == 1 and len(columns.weights) == 2
+    columns.truncate(0)
+    assert columns.notes == {} and list(columns.offsets) == [0]
@@ -0,0 +1,49 @@
+import pytest
+
+from history import History, PersistentList, diff
+
+
+def test_persistent_list_changes_are_new_lists():
+    empty = PersistentList()
+    items = empty.extend([1, 2, 3])
+    assert list(empty) == []
+    assert list(items) == [1, 2, 3]
+    assert list(items.append(4)) == [1, 2, 3, 4]
+    assert list(items.replace(1, 2, ['a', 'b'])) == [1, 'a', 'b', 3]
+    assert list(items.prefix(2)) == [1, 2]
+    assert items.items_from(1) == [2, 3]
+    assert list(items) == [1, 2, 3]
+
+
+def test_diff_keeps_the_shared_prefix():
+    old = PersistentList().extend([1, 2, 3])
+    assert diff(old, old.append(4)) == (3, [4])
+    assert diff(old, old.prefix(1)) == (1, [])
+    assert diff(old, old.replace(1, 3, [5])) == (1, [5])
+    # equal items of other lists are not shared
+    assert diff(old, PersistentList().extend([1, 2, 3])) == (0, [1, 2, 3])
+
+
+def test_history_undo_redo():
+    history = History(PersistentList())
+    history.push(history.current.append(1))
+    history.push(history.current.append(2))
+    assert list(history.undo()) == [1]
+    assert list(history.redo()) == [1, 2]
+    history.undo()
+    # a new snapshot drops undone ones
+    history.push(history.current.append(3))
+    assert list(history.current) == [1, 3]
+    assert not history.can_redo()
+    with pytest.raises(IndexError):
+        history.redo()
+
+
+def test_history_limit_forgets_old_snapshots():
+    history = History(0, limit=3)
+    for snapshot in range(1, 5):
+        history.push(snapshot)
+    assert len(history) == 3
+    assert history.undo() == 3
+    assert history.undo() == 2
+    assert not history.can_undo()
@@ -0,0 +1,62 @@
+from kochkalib import Exercise, ExerciseIndex, TextIndex, stem, text_tokens
+
+EXERCISES = [
+    Exercise('2017.01.01', 'жим'),
+    Exercise('2017.01.03', 'тяга'),
+    Exercise('2017.01.02', 'жим'),
+    Exercise('2017.01.05', 'жим'),
+]
+
+
+def test_filter_by_name_and_dates():
+    index = ExerciseIndex(EXERCISES)
+    assert list(index.filter()) == [0, 1, 2, 3]
+    assert list(index.filter(name='жим')) == [0, 2, 3]
+    assert list(index.filter(name='жим', date_from='2017.01.02',
+                             date_to='2017.01.04')) == [2]
+    assert list(index.date_rows('2017.01.02')) == [1, 2, 3]
+    assert list(index.filter(name='присед')) == []
+
+
+def test_truncate_removes_rows_added_out_of_order():
+    index = ExerciseIndex(EXERCISES)
+    index.truncate(2)
+    assert len(index) == 2
+    assert list(index.filter(name='жим')) == [0]
+    assert list(index.date_rows()) == [0, 1]
+    index.add(Exercise('2017.01.02', 'присед'))
+    assert list(index.date_rows('2017.01.02', '2017.01.02')) == [2]
+
+
+def test_tokens_are_folded_stems():
+    assert text_tokens('Травмой поясницы, ёлка тяга_блока') == (
+        'травм', 'поясниц', 'елк', 'тяг', 'блок')
+    assert stem('травма') == stem('травмы') == 'травм'
+    # short words are not cut to nothing
+    assert stem('жим') == 'жим'
+
+
+def test_text_search_and_or_prefix():
+    index = TextIndex()
+    index.add(0, 'жим', 'травма поясницы')
+    index.add(1, 'тяга', 'после болезни')
+    index.add(2, 'тяга_блока', 'Травмы нет, Ёлки')
+    assert list(index.search('травма')) == [0, 2]
+    assert list(index.search('травма поясница')) == [0]
+    assert list(index.search('болезнь OR поясница')) == [0, 1]
+    assert list(index.search('тяг*')) == [1, 2]
+    assert list(index.search('елка')) == [2]
+    assert list(index.search('присед')) == []
+    index.truncate(1)
+    assert list(index.search('травм*')) == [0]
+    assert index.tokens == sorted(index.postings)
+
+
+def test_filter_by_text():
+    index = ExerciseIndex([
+        Exercise('2017.01.01', 'жим', note='травма'),
+        Exercise('2017.01.02', 'жим'),
+        Exercise('2017.01.03', 'тяга', note='травма'),
+    ])
+    assert list(index.filter(name='жим', text='травм*')) == [0]
+    assert list(index.filter(text='травма', date_from='2017.01.02')) == [2]
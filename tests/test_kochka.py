@@ -0,0 +1,58 @@
+import io
+
+import pytest
+
+from kochka import main
+
+LOG = ('2017.01.01\nжим\n50 5\n60 5 x2\n\n'
+       '2017.01.02\nтяга\n# спина\n100 5\n\n')
+BROKEN = LOG + 'не дата\n\n2017.01.03\nприсед\n70 5\n\n'
+
+
+@pytest.fixture
+def log(tmp_path):
+    filename = tmp_path / 'data.txt'
+    filename.write_text(LOG)
+    return filename
+
+
+def test_check_exit_codes(log, capsys):
+    assert main(['check', str(log)]) == 0
+    assert capsys.readouterr().err == 'exercises(2), errors(0)\n'
+    log.write_text(BROKEN)
+    assert main(['check', '-q', str(log)]) == 1
+    out, err = capsys.readouterr()
+    assert out == "{}:11: date expected: 'не дата'\n".format(log)
+    assert err == ''
+
+
+def test_wrong_arguments_and_missing_file(tmp_path, capsys):
+    with pytest.raises(SystemExit) as exc_info:
+        main(['check'])
+    assert exc_info.value.code == 2
+    capsys.readouterr()
+    assert main(['check', str(tmp_path / 'missing.txt')]) == 1
+    assert capsys.readouterr().err.startswith('kochka: ')
+
+
+def test_export_csv_from_stdin(monkeypatch, capsys):
+    monkeypatch.setattr('sys.stdin', io.StringIO(LOG))
+    assert main(['export', '-']) == 0
+    assert capsys.readouterr().out.splitlines() == [
+        'date,name,weight,count,set_count,note',
+        '2017.01.01,жим,50,5,1,',
+        '2017.01.01,жим,60,5,2,',
+        '2017.01.02,тяга,100,5,1,спина',
+    ]
+
+
+def test_convert_with_errors_does_not_create_the_target(log, tmp_path,
+                                                        capsys):
+    log.write_text(BROKEN)
+    target = tmp_path / 'data.db'
+    assert main(['convert', str(log), str(target)]) == 1
+    assert 'use --force' in capsys.readouterr().err
+    assert not target.exists()
+    assert main(['convert', '--force', str(log), str(target)]) == 1
+    assert 'exercises(3), errors(1)' in capsys.readouterr().err
+    assert main(['check', str(target)]) == 0
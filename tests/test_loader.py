@@ -0,0 +1,69 @@
+from kochkalib import ExerciseTxtTailLoader
+
+
+def names(exercises):
+    return [exercise.name for exercise in exercises]
+
+
+def test_partial_last_line_is_parsed_next_time(tmp_path):
+    filename = tmp_path / 'data.txt'
+    filename.write_text('2017.01.01\nжим\n50 5\n\n2017.01.02\nтя')
+    loader = ExerciseTxtTailLoader(str(filename))
+    assert names(loader.load()) == ['жим']
+    with filename.open('a') as f:
+        f.write('га\n60 5\n\n')
+    assert names(loader.load()) == ['тяга']
+    assert not loader.is_full
+
+
+def test_rewritten_file_with_partial_last_line(tmp_path):
+    filename = tmp_path / 'data.txt'
+    filename.write_text('2017.01.01\nжим\n50 5\n\n')
+    loader = ExerciseTxtTailLoader(str(filename))
+    loader.load()
+    filename.write_text('2017.01.03\nприсед\n70 5\n\n2017.01.04\nжи')
+    assert names(loader.load()) == ['присед']
+    assert loader.is_full
+    with filename.open('a') as f:
+        f.write('м\n80 5\n\n')
+    assert names(loader.load()) == ['жим']
+    assert not loader.is_full
+
+
+def test_cache_hit_reports_errors_again(tmp_path):
+    filename = tmp_path / 'data.txt'
+    filename.write_text('2017.01.01\nжим\n50 5\n\nбез даты\n\n'
+                        '2017.01.02\nтяга\n60 5\n\n')
+    reported = []
+    for _ in range(2):
+        loader = ExerciseTxtTailLoader(str(filename), use_cache=True,
+                                       resync=True)
+        errors = []
+        loader.on_parse_error.append(errors.append)
+        assert names(loader.load()) == ['жим', 'тяга']
+        reported.append([error.lineno for error in errors])
+    assert (tmp_path / 'data.txt.cache').exists()
+    assert reported == [[5], [5]]
+
+
+def test_cache_hit_parses_appended_records_only(tmp_path):
+    filename = tmp_path / 'data.txt'
+    filename.write_text('2017.01.01\nжим\n50 5\n\n')
+    ExerciseTxtTailLoader(str(filename), use_cache=True).load()
+    with filename.open('a') as f:
+        f.write('2017.01.02\nтяга\n60 5\n\n')
+    loader = ExerciseTxtTailLoader(str(filename), use_cache=True)
+    assert names(loader.load()) == ['жим', 'тяга']
+    assert loader.is_full
+    assert names(ExerciseTxtTailLoader(str(filename),
+                                       use_cache=True).load()) == \
+        ['жим', 'тяга']
+
+
+def test_stale_cache_is_not_used(tmp_path):
+    filename = tmp_path / 'data.txt'
+    filename.write_text('2017.01.01\nжим\n50 5\n\n')
+    ExerciseTxtTailLoader(str(filename), use_cache=True).load()
+    filename.write_text('2017.01.02\nтяга\n60 5\n\n')
+    loader = ExerciseTxtTailLoader(str(filename), use_cache=True)
+    assert names(loader.load()) == ['тяга']
@@ -0,0 +1,34 @@
+import logging
+import queue
+
+from loggingconf import LogListener, LogQueueHandler
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_full_queue_drops_and_counts_records():
+    log_queue = queue.Queue(2)
+    target = ListHandler()
+    queue_handler = LogQueueHandler(log_queue, [target])
+    logger = logging.getLogger('tests.loggingconf')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(queue_handler)
+    try:
+        for i in range(5):
+            logger.info('record %d', i)
+    finally:
+        logger.removeHandler(queue_handler)
+    assert queue_handler.dropped == 3
+    listener = LogListener(log_queue, [queue_handler])
+    assert listener.dropped == 3
+    listener.start()
+    listener.stop()
+    assert target.messages == ['record 0', 'record 1']
@@ -0,0 +1,65 @@
+import json
+import logging
+
+from metrics import Histogram, Metrics
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(json.loads(record.getMessage()))
+
+
+def metrics_with_log():
+    logger = logging.getLogger('tests.metrics')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.handlers = [ListHandler()]
+    return Metrics(logger), logger.handlers[0].lines
+
+
+def test_histogram_percentiles_of_last_samples():
+    histogram = Histogram(size=100)
+    for ms in range(1, 201):
+        histogram.add(ms / 1000)
+    summary = histogram.summary()
+    assert summary['calls'] == 200
+    # the first 100 samples are not kept
+    assert summary['p50_ms'] == 150
+    assert summary['p99_ms'] == 199
+    assert summary['max_ms'] == 200
+    assert Histogram().percentile(50) == 0.0
+
+
+def test_span_is_logged_and_kept():
+    metrics, lines = metrics_with_log()
+    with metrics.span('save', records=3) as fields:
+        fields['written'] = 10
+    metrics.count('errors')
+    metrics.count('errors', 2)
+    assert [(line['type'], line['name'], line['records'], line['written'])
+            for line in lines] == [('span', 'save', 3, 10)]
+    summary = metrics.summary()
+    assert summary['spans']['save']['calls'] == 1
+    assert summary['counters'] == {'errors': 3}
+
+
+def test_iter_span_counts_records_of_a_stopped_iteration():
+    metrics, lines = metrics_with_log()
+    closed = []
+
+    def items():
+        try:
+            yield from range(10)
+        finally:
+            closed.append(True)
+
+    for item in metrics.iter_span('parse', items()):
+        if item == 4:
+            break
+    assert closed == [True]
+    assert lines[-1]['records'] == 5
+    assert metrics.summary()['counters'] == {'parse.records': 5}
@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from oslib import BackupStore, filebackup
+
+
+def records(start, stop):
+    # records of different sizes, so chunks are cut at different places
+    return ''.join(
+        '2017.01.{:02d}\nжим\n# {}\n50 5\n60 5\n\n'.format(
+            day % 28 + 1, 'x' * (day % 50))
+        for day in range(start, stop))
+
+
+def chunk_files(store):
+    return sum(len(names) for _, _, names in os.walk(store.chunks_path))
+
+
+def test_backup_stores_only_new_chunks(tmp_path):
+    filename = tmp_path / 'data.txt'
+    filename.write_text(records(0, 2000))
+    store = BackupStore(str(tmp_path / 'backups'))
+    store.backup(str(filename))
+    first_chunks = chunk_files(store)
+    assert first_chunks > 1
+    with filename.open('a') as f:
+        f.write(records(2000, 2010))
+    store.backup(str(filename))
+    # appended records change the last chunk only
+    assert chunk_files(store) - first_chunks <= 2
+    assert store.generations() == [1, 2]
+
+
+def test_restore_generations(tmp_path):
+    filename = tmp_path / 'data.txt'
+    store = BackupStore(str(tmp_path / 'backups'))
+    versions = [records(0, 500), records(0, 600), records(100, 600)]
+    for text in versions:
+        filename.write_text(text)
+        store.backup(str(filename))
+    for generation, text in enumerate(versions, 1):
+        store.restore(str(filename), generation)
+        assert filename.read_text() == text
+    store.restore(str(filename))
+    assert filename.read_text() == versions[-1]
+
+
+def test_prune_keeps_chunks_of_kept_generations(tmp_path):
+    filename = tmp_path / 'data.txt'
+    store = BackupStore(str(tmp_path / 'backups'), keep=2)
+    for stop in (500, 600, 700):
+        filename.write_text(records(0, stop))
+        store.backup(str(filename))
+    assert store.generations() == [2, 3]
+    store.restore(str(filename), 2)
+    assert filename.read_text() == records(0, 600)
+
+
+def test_filebackup_restores_the_file_on_error(tmp_path):
+    filename = tmp_path / 'data.txt'
+    filename.write_text('old')
+    with pytest.raises(ValueError):
+        with filebackup(str(filename)):
+            filename.write_text('broken')
+            raise ValueError('write failed')
+    assert filename.read_text() == 'old'
+
+
+def test_changed_head_is_chunked_again(tmp_path):
+    filename = tmp_path / 'data.txt'
+    store = BackupStore(str(tmp_path / 'backups'))
+    filename.write_text(records(0, 2000))
+    store.backup(str(filename))
+    text = records(0, 1000) + records(5, 6) + records(1000, 2010)
+    filename.write_text(text)
+    generation = store.backup(str(filename))
+    filename.write_text('')
+    store.restore(str(filename), generation)
+    assert filename.read_text() == text
+
+
+def test_prune_removes_chunks_of_dropped_generations(tmp_path):
+    filename = tmp_path / 'data.txt'
+    store = BackupStore(str(tmp_path / 'backups'), keep=1)
+    filename.write_text(records(0, 2000))
+    store.backup(str(filename))
+    filename.write_text(records(3000, 3500))
+    store.backup(str(filename))
+    assert store.generations() == [2]
+    assert chunk_files(store) == len(store._manifest(2))
@@ -0,0 +1,107 @@
+import io
+
+import pytest
+
+from kochkalib import ExerciseTxtParser, ExerciseTxtBufferParser, \
+    ExerciseTxtParallelParser
+
+PARSERS = [ExerciseTxtParser, ExerciseTxtBufferParser]
+
+# well-formed records, notes, set counts and broken records
+TEXT = (
+    '2017.01.01\nжим\n50 5\n60 5x3\n\n'
+    '2017.01.02\nтяга\n# спина болит\n100 5 * 2\n110 3\n\n'
+    '2017.01.03\nприсед\nабв\n70 5\n\n'
+    '2017.01.04\nжим\n55 8х2\n\n'
+    'не дата\n\n'
+) * 50
+
+
+def parse(parser_class, tmp_path, text, resync=True):
+    filename = tmp_path / 'data.txt'
+    filename.write_text(text)
+    parser = parser_class(str(filename), resync=resync)
+    errors = []
+    parser.on_parse_error.append(errors.append)
+    return [(e.date, e.name, e.sets_str) for e in parser], errors
+
+
+@pytest.mark.parametrize('parser_class', PARSERS)
+def test_resync_keeps_records_around_missed_blank_line(parser_class,
+                                                       tmp_path):
+    exercises, errors = parse(parser_class, tmp_path, (
+        '2017.01.01\nжим\n50 5\n'
+        '2017.01.02\nтяга\n60 5\n\n'
+        '2017.01.03\nприсед\n70 5\n\n'))
+    assert exercises == [('2017.01.01', 'жим', '[50 5]'),
+                         ('2017.01.02', 'тяга', '[60 5]'),
+                         ('2017.01.03', 'присед', '[70 5]')]
+    assert [(error.lineno, error.reason) for error in errors] == [
+        (4, 'blank line expected')]
+
+
+@pytest.mark.parametrize('parser_class', PARSERS)
+def test_resync_drops_record_without_sets(parser_class, tmp_path):
+    exercises, errors = parse(parser_class, tmp_path, (
+        '2017.05.01\nжим\n'
+        '2017.05.02\nприсед\n60 5\n\n'))
+    assert exercises == [('2017.05.02', 'присед', '[60 5]')]
+    assert [error.lineno for error in errors] == [3]
+
+
+def exercises_of(parser, exercises):
+    errors = []
+    parser.on_parse_error.append(errors.append)
+    exercises = [(e.date, e.name, e.note, e.sets_str) for e in exercises]
+    return exercises, [(error.lineno, error.reason) for error in errors]
+
+
+def test_parsers_give_the_same_exercises_and_errors(tmp_path):
+    filename = tmp_path / 'data.txt'
+    filename.write_text(TEXT)
+    results = [exercises_of(parser, iter(parser)) for parser in (
+        parser_class(str(filename), resync=True) for parser_class in PARSERS)]
+    assert results[0] == results[1]
+    exercises, errors = results[0]
+    assert len(exercises) == 150
+    assert len(errors) == 100
+    assert exercises[1] == ('2017.01.02', 'тяга', 'спина болит',
+                            '[100 5 x2] [110 3]')
+
+
+def test_parallel_parser_is_the_same_as_buffer_parser(tmp_path):
+    filename = tmp_path / 'data.txt'
+    filename.write_text(TEXT)
+    parser = ExerciseTxtBufferParser(str(filename), resync=True)
+    expected = exercises_of(parser, iter(parser))
+    parser = ExerciseTxtParallelParser(str(filename), workers=3,
+                                       resync=True)
+    parser.parallel_threshold = 0
+    assert exercises_of(parser, iter(parser)) == expected
+
+
+def test_split_data_cuts_at_blank_lines():
+    data = TEXT.encode()
+    parser = ExerciseTxtParallelParser('-', workers=3)
+    chunks = parser._split_data(data)
+    assert len(chunks) == 3
+    assert chunks[0][0] == 0 and chunks[-1][1] == len(data)
+    for (_, stop, _), (start, _, lineno) in zip(chunks, chunks[1:]):
+        assert stop == start and data[start - 2:start] == b'\n\n'
+        assert lineno == data.count(b'\n', 0, start) + 1
+
+
+@pytest.mark.parametrize('block_size', [7, 64, 1024 * 1024])
+def test_parse_stream_is_the_same_as_parse_text(block_size):
+    parser = ExerciseTxtBufferParser('-', resync=True)
+    expected = exercises_of(parser, parser.parse_text(TEXT))
+    parser = ExerciseTxtBufferParser('-', resync=True)
+    assert exercises_of(parser, parser.parse_stream(
+        io.StringIO(TEXT), block_size=block_size)) == expected
+
+
+def test_parse_stream_finishes_the_last_record():
+    parser = ExerciseTxtBufferParser('-')
+    exercises = list(parser.parse_stream(io.StringIO(
+        '2017.01.01\nжим\n50 5\n\n2017.01.02\nтяга\n60 5')))
+    assert [e.name for e in exercises] == ['жим', 'тяга']
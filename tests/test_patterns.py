@@ -0,0 +1,62 @@
+import gc
+
+from patterns import Event, CoalescingEvent
+
+
+def test_batch_delivers_the_last_call_once():
+    calls = []
+    e = Event([calls.append])
+    with e.batch():
+        e(1)
+        with e.batch():
+            e(2)
+        assert calls == []
+        e(3)
+    assert calls == [3]
+    with e.batch():
+        pass
+    e(4)
+    assert calls == [3, 4]
+
+
+def test_weak_subscriber_is_removed_when_deleted():
+    class Counter:
+        def __init__(self):
+            self.calls = 0
+
+        def on_event(self):
+            self.calls += 1
+
+    counter = Counter()
+    e = Event()
+    e.append_weak(counter.on_event)
+    e()
+    assert counter.calls == 1
+    del counter
+    gc.collect()
+    assert len(e) == 0
+    e()
+
+
+def test_coalescing_event_delivers_the_last_call_per_tick():
+    calls = []
+    ticks = []
+    e = CoalescingEvent([calls.append], scheduler=ticks.append)
+    for i in range(1000):
+        e(i)
+    assert calls == [] and len(ticks) == 1
+    ticks.pop()()
+    assert calls == [999]
+    e(1000)
+    ticks.pop()()
+    assert calls == [999, 1000]
+
+
+def test_coalescing_event_without_scheduler_is_immediate():
+    calls = []
+    e = CoalescingEvent([calls.append])
+    e(1)
+    with e.batch():
+        e(2)
+        e(3)
+    assert calls == [1, 3]
@@ -0,0 +1,37 @@
+from array import array
+
+from kochkalib import Set, Exercise, record_key, diff_records
+
+
+def keys(*values):
+    return array('q', values)
+
+
+def test_record_key_of_equal_records():
+    assert record_key(Exercise('2017.01.01', 'жим', [Set(50, 5)])) == \
+        record_key(Exercise('2017.01.01', 'жим', [Set(50, 5)]))
+    assert record_key(Exercise('2017.01.01', 'жим', [Set(50, 5)])) != \
+        record_key(Exercise('2017.01.01', 'жим', [Set(50, 6)]))
+
+
+def test_diff_records_of_equal_keys():
+    assert diff_records(keys(1, 2, 3), keys(1, 2, 3)) == []
+    assert diff_records(keys(), keys()) == []
+
+
+def test_diff_records_changes():
+    assert diff_records(keys(1, 2, 3), keys(1, 2, 3, 4)) == [
+        ('insert', 3, 3, 3, 4)]
+    assert diff_records(keys(1, 2, 3), keys(1, 3)) == [
+        ('delete', 1, 2, 1, 1)]
+    assert diff_records(keys(1, 2, 3), keys(1, 5, 3)) == [
+        ('replace', 1, 2, 1, 2)]
+    assert diff_records(keys(1, 2, 3, 4), keys(0, 1, 2, 4)) == [
+        ('insert', 0, 0, 0, 1), ('delete', 2, 3, 3, 3)]
+
+
+def test_diff_records_replaces_long_differences():
+    old = keys(*range(100))
+    new = keys(*([0] + list(range(200, 250)) + [99]))
+    assert diff_records(old, new, max_matched=10) == [
+        ('replace', 1, 99, 1, 51)]
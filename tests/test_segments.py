@@ -0,0 +1,54 @@
+import os
+
+from kochkalib import Set, Exercise
+from storage import SegmentStorage
+
+EXERCISES = [
+    Exercise('2016.03.01', 'жим', [Set(50, 5)]),
+    Exercise('2016.12.31', 'тяга', [Set(90, 5)], 'спина'),
+    Exercise('2017.01.02', 'присед', [Set(70, 5)]),
+]
+
+
+def dates(exercises):
+    return [exercise.date for exercise in exercises]
+
+
+def test_save_writes_changed_segments_only(tmp_path):
+    path = str(tmp_path / 'data.segments')
+    storage = SegmentStorage(path)
+    assert storage.save(EXERCISES) == 3
+    assert sorted(os.listdir(path)) == ['2016.txt', '2017.txt',
+                                        'manifest.json']
+    stat = os.stat(os.path.join(path, '2016.txt'))
+    storage.save(EXERCISES + [Exercise('2017.01.03', 'жим', [Set(55, 5)])])
+    assert os.stat(os.path.join(path, '2016.txt')) == stat
+    assert storage.manifest['segments']['2017']['exercises'] == 2
+    loaded = SegmentStorage(path).load()
+    assert dates(loaded) == ['2016.03.01', '2016.12.31', '2017.01.02',
+                             '2017.01.03']
+    assert loaded[1].note == 'спина'
+
+
+def test_append_to_the_last_segment_is_tail_load(tmp_path):
+    path = str(tmp_path / 'data.segments')
+    SegmentStorage(path).save(EXERCISES)
+    ours = SegmentStorage(path)
+    assert len(ours.load()) == 3
+    SegmentStorage(path).append([Exercise('2017.01.05', 'жим', [Set(60, 5)])])
+    assert ours.is_changed()
+    assert dates(ours.load()) == ['2017.01.05']
+    assert not ours.is_full
+
+
+def test_frozen_segments_are_filtered_by_dates(tmp_path):
+    path = str(tmp_path / 'data.segments')
+    storage = SegmentStorage(path)
+    storage.save(EXERCISES)
+    assert storage.freeze(compression='gz') == ['2016']
+    assert os.path.exists(os.path.join(path, '2016.txt.gz'))
+    assert not os.path.exists(os.path.join(path, '2016.txt'))
+    assert dates(storage.filter(date_from='2016.06.01',
+                                date_to='2016.12.31')) == ['2016.12.31']
+    assert dates(storage.filter(name='присед')) == ['2017.01.02']
+    assert dates(SegmentStorage(path).load()) == dates(EXERCISES)
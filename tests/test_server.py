@@ -0,0 +1,117 @@
+import asyncio
+import json
+
+import pytest
+
+from server import LogServer
+
+LOG = ('2017.01.01\nжим\n50 5\n60 5\n\n'
+       '2017.01.02\nтяга\n# спина\n100 5\n\n')
+
+
+async def request(reader, writer, target, method='GET', headers=()):
+    """Sends a request on the connection, returns status, headers, body"""
+    lines = ['{} {} HTTP/1.1'.format(method, target), 'Host: test']
+    lines.extend('{}: {}'.format(*header) for header in headers)
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode())
+    status = int((await reader.readline()).split()[1])
+    response_headers = {}
+    while True:
+        line = (await reader.readline()).decode().strip()
+        if not line:
+            break
+        key, _, value = line.partition(':')
+        response_headers[key.lower()] = value.strip()
+    length = int(response_headers.get('content-length', 0))
+    if method == 'HEAD' or status == 304:
+        length = 0
+    body = await reader.readexactly(length)
+    return status, response_headers, body
+
+
+@pytest.fixture
+def log(tmp_path):
+    filename = tmp_path / 'data.txt'
+    filename.write_text(LOG)
+    return filename
+
+
+def serve(filename, test):
+    """Runs `test(server, reader, writer)` with the server on loopback"""
+    async def main():
+        server = LogServer(str(filename), port=0)
+        await server.start()
+        reader, writer = await asyncio.open_connection('127.0.0.1',
+                                                       server.port)
+        try:
+            await test(server, reader, writer)
+        finally:
+            writer.close()
+            server.close()
+    asyncio.run(main())
+
+
+def test_get_and_head_on_one_connection(log):
+    async def test(server, reader, writer):
+        status, headers, body = await request(
+            reader, writer, '/exercises?name=%D0%B6%D0%B8%D0%BC')
+        assert status == 200
+        assert headers['connection'] == 'keep-alive'
+        result = json.loads(body.decode())
+        assert result['total'] == 1
+        assert result['items'][0]['sets'] == [[50, 5, 1], [60, 5, 1]]
+        status, headers, body = await request(reader, writer, '/health',
+                                              method='HEAD')
+        assert status == 200 and body == b''
+        assert int(headers['content-length']) > 0
+    serve(log, test)
+
+
+def test_not_modified_by_etag(log):
+    async def test(server, reader, writer):
+        status, headers, _ = await request(reader, writer, '/names')
+        etag = headers['etag']
+        status, _, body = await request(reader, writer, '/names',
+                                        headers=[('If-None-Match', etag)])
+        assert status == 304 and body == b''
+    serve(log, test)
+
+
+def test_bad_limit_is_not_hidden_by_etag(log):
+    async def test(server, reader, writer):
+        status, _, body = await request(reader, writer,
+                                        '/exercises?limit=x')
+        assert status == 400
+        assert 'limit' in json.loads(body.decode())['error']
+        status, _, _ = await request(
+            reader, writer, '/exercises?limit=-1',
+            headers=[('If-None-Match', server.etag)])
+        assert status == 400
+    serve(log, test)
+
+
+def test_appended_records_are_a_new_version(log):
+    async def test(server, reader, writer):
+        _, headers, _ = await request(reader, writer, '/stats')
+        with log.open('a') as f:
+            f.write('2017.01.03\nприсед\n70 5\n\n')
+        await server.reload()
+        status, new_headers, body = await request(
+            reader, writer, '/health',
+            headers=[('If-None-Match', headers['etag'])])
+        assert status == 200
+        assert new_headers['etag'] != headers['etag']
+        assert json.loads(body.decode())['exercises'] == 3
+    serve(log, test)
+
+
+def test_missing_log_keeps_the_current_version(log):
+    async def test(server, reader, writer):
+        version = server.version
+        log.unlink()
+        assert server.storage.is_changed()
+        await server.reload()
+        assert server.version == version
+        _, _, body = await request(reader, writer, '/health')
+        assert json.loads(body.decode())['exercises'] == 2
+    serve(log, test)
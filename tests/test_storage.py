@@ -0,0 +1,66 @@
+import sqlite3
+
+import pytest
+
+from kochkalib import Set, Exercise
+from storage import Storage, SqliteStorage
+
+EXERCISES = [Exercise('2017.01.0{}'.format(day), 'жим', [Set(50, 5)])
+             for day in range(1, 4)]
+
+
+@pytest.fixture
+def storages(tmp_path):
+    filename = str(tmp_path / 'data.db')
+    ours, others = SqliteStorage(filename), SqliteStorage(filename)
+    others.save(EXERCISES)
+    ours.load()
+    yield ours, others, filename
+    ours.close()
+    others.close()
+
+
+def test_append_by_others_is_tail_load(storages):
+    ours, others, _ = storages
+    others.append([Exercise('2017.01.05', 'тяга', [Set(60, 5)])])
+    assert ours.is_changed()
+    assert [e.name for e in ours.load()] == ['тяга']
+    assert not ours.is_full
+
+
+def test_rewrite_by_others_is_full_load(storages):
+    ours, others, _ = storages
+    others.save(EXERCISES[:2] + [Exercise('2017.01.09', 'тяга', [])])
+    assert ours.is_changed()
+    assert [e.date for e in ours.load()] == [
+        '2017.01.01', '2017.01.02', '2017.01.09']
+    assert ours.is_full
+
+
+def test_update_by_others_is_full_load(storages):
+    ours, _, filename = storages
+    connection = sqlite3.connect(filename)
+    with connection:
+        connection.execute('UPDATE sets SET weight = 99 WHERE exercise_id = 1')
+    connection.close()
+    exercises = ours.load()
+    assert ours.is_full
+    assert [e.sets[0].weight for e in exercises] == [99, 50, 50]
+    assert ours.load() == [] and not ours.is_full
+
+
+def test_incomplete_storage_is_not_created():
+    class LoadOnly(Storage):
+        def reset(self):
+            pass
+
+        def iter_load(self):
+            return iter(())
+
+    with pytest.raises(TypeError):
+        LoadOnly()
+
+
+def test_write_ahead_log_is_watched(storages):
+    ours, _, filename = storages
+    assert ours.watched_files == [filename, filename + '-wal']